@@ -0,0 +1,147 @@
+'''asyncio counterparts of the blocking API in `http` and `dataset`,
+for issuing many service calls concurrently from an event loop
+(notebooks, pipeline orchestrators).
+
+Requests are built and decoded exactly as by `http.make_request`
+(see `http.prepare_request`) and retried on the same statuses (see
+`http.retries_status`) and transport errors (for POST and PATCH,
+only errors connecting), but go through one `httpx.AsyncClient` per
+event loop, whose connection pool is shared by every call made on
+that loop. At most `MAX_CONCURRENT_REQUESTS` requests are in flight
+per loop.
+
+Requires the optional `httpx` dependency
+(`pip install exao_dap_client[async]`).
+'''
+import asyncio
+import logging
+import weakref
+import httpx
+import orjson
+
+from . import http, dataset
+
+log = logging.getLogger(__name__)
+
+MAX_CONCURRENT_REQUESTS = 16
+
+_CLIENTS = weakref.WeakKeyDictionary()
+
+
+def get_client():
+    '''Shared client and concurrency limit for the running event loop
+
+    Returns
+    -------
+    client : httpx.AsyncClient
+    semaphore : asyncio.Semaphore
+    '''
+    loop = asyncio.get_running_loop()
+    if loop not in _CLIENTS:
+        limits = httpx.Limits(
+            max_connections=MAX_CONCURRENT_REQUESTS,
+            max_keepalive_connections=http.POOL_MAXSIZE
+        )
+        client = httpx.AsyncClient(limits=limits)
+        _CLIENTS[loop] = (client, asyncio.Semaphore(MAX_CONCURRENT_REQUESTS))
+    return _CLIENTS[loop]
+
+
+async def close():
+    '''Close the running event loop's client (e.g. before the loop
+    itself is closed)
+    '''
+    loop = asyncio.get_running_loop()
+    if loop in _CLIENTS:
+        client, _ = _CLIENTS.pop(loop)
+        await client.aclose()
+
+
+# Errors meaning the request never reached the service, so retrying
+# can't have it acted on twice
+_NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+def _backoff(attempt, resp=None):
+    if resp is not None and 'Retry-After' in resp.headers:
+        try:
+            return float(resp.headers['Retry-After'])
+        except ValueError:
+            pass
+    return http.BACKOFF_FACTOR * 2 ** attempt
+
+
+async def make_request(method, endpoint, payload):
+    url, body, headers, timeout = http.prepare_request(endpoint, payload)
+    client, semaphore = get_client()
+    async with semaphore:
+        for attempt in range(http.MAX_RETRIES + 1):
+            final = attempt == http.MAX_RETRIES
+            try:
+                resp = await client.request(method, url, headers=headers, content=body, timeout=timeout)
+            except httpx.TransportError as exc:
+                if final or not (method in http.IDEMPOTENT_METHODS or isinstance(exc, _NOT_SENT_ERRORS)):
+                    raise
+                log.debug(f'{method} {url} failed ({exc!r}), retrying')
+                await asyncio.sleep(_backoff(attempt))
+                continue
+            if http.retries_status(method, resp.status_code) and not final:
+                log.debug(f'{method} {url} returned {resp.status_code}, retrying')
+                await asyncio.sleep(_backoff(attempt, resp))
+                continue
+            break
+    resp.raise_for_status()
+    return orjson.loads(resp.content)
+
+
+async def get(endpoint, payload):
+    return await make_request('GET', endpoint, payload)
+
+
+async def post(endpoint, payload):
+    return await make_request('POST', endpoint, payload)
+
+
+async def patch(endpoint, payload):
+    return await make_request('PATCH', endpoint, payload)
+
+
+async def ingest(data_store_path, identifier, source, stage, kind, description, friendly_name, data_payloads):
+    '''See `dataset.ingest`'''
+    payload = dataset.dataset_payload_with_data(
+        data_store_path, identifier, source, stage, kind, description, friendly_name, data_payloads
+    )
+    return await post(dataset.DATASETS_ENDPOINT, payload)
+
+
+async def ingest_in_batches(
+    data_store_path, identifier, source, stage, kind, description, friendly_name, data_payloads,
+    batch_size=dataset.DEFAULT_BATCH_SIZE, batch_bytes=dataset.DEFAULT_BATCH_BYTES, checkpoint_path=None
+):
+    '''See `dataset.ingest_in_batches`. Batches are uploaded
+    concurrently, up to the per-loop request limit.
+    '''
+    dataset_payload, batches, checkpoint = dataset.prepare_batched_ingest(
+        data_store_path, identifier, source, stage, kind, description, friendly_name, data_payloads,
+        batch_size=batch_size, batch_bytes=batch_bytes, checkpoint_path=checkpoint_path
+    )
+    if not checkpoint.created:
+        await post(dataset.DATASETS_ENDPOINT, dataset.pending_dataset_payload(dataset_payload))
+        checkpoint.created = True
+        checkpoint.save()
+
+    async def upload(batch):
+        await post(dataset.data_endpoint(identifier), {'data': batch})
+        checkpoint.acknowledge(batch)
+
+    results = await asyncio.gather(*(upload(batch) for batch in batches), return_exceptions=True)
+    errors = [result for result in results if isinstance(result, BaseException)]
+    for exc in errors:
+        log.error(f'Failed to upload a batch for {identifier}: {exc!r}')
+    if errors:
+        # leave the checkpoint in place to resume from
+        raise errors[0]
+
+    result = await patch(dataset.dataset_endpoint(identifier), {'state': dataset.DatasetState.COMPLETE.value})
+    checkpoint.remove()
+    return result
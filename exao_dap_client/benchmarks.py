@@ -0,0 +1,420 @@
+'''Benchmarks for the hot paths: syncing, hashing, copying and
+metadata extraction, run on synthetic FITS trees.
+
+Run with::
+
+    python -m exao_dap_client.benchmarks --out results.jsonl
+    python -m exao_dap_client.benchmarks --compare results.jsonl
+
+Each benchmark is run `repeat` times against fresh copies of its
+inputs and a cold checksum index (except where being warm is the
+point, like a no-op sync), and recorded as one JSON line with the
+best and median wall time and the bytes and files it processed.
+Results from two runs match up by benchmark name and parameters, and
+`--compare` fails if any got slower than the baseline by more than
+the tolerance.
+'''
+import argparse
+from contextlib import contextmanager, nullcontext
+import dataclasses
+import datetime
+import logging
+import os
+import os.path
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+import numpy as np
+import orjson
+from astropy.io import fits
+
+from . import __version__, cache, config, data_store, datum, utils
+
+log = logging.getLogger(__name__)
+
+DEFAULT_TOLERANCE = 0.2
+
+
+@dataclasses.dataclass
+class TreeShape:
+    n_dirs: int = 4
+    files_per_dir: int = 25
+    image_shape: tuple = (256, 256)
+    n_extensions: int = 1
+    n_keywords: int = 50
+
+    @property
+    def n_files(self):
+        return self.n_dirs * self.files_per_dir
+
+
+def make_fits_file(path, shape, rng):
+    '''Write a FITS file with a primary image and `shape.n_extensions`
+    image extensions of random float32 data, each with
+    `shape.n_keywords` extra header cards
+    '''
+    hdul = fits.HDUList()
+    for idx in range(shape.n_extensions + 1):
+        data = rng.standard_normal(shape.image_shape, dtype=np.float32)
+        hdu = fits.PrimaryHDU(data) if idx == 0 else fits.ImageHDU(data, name=f'EXT{idx}')
+        for kw_idx in range(shape.n_keywords):
+            hdu.header[f'KW{kw_idx:05}'] = (kw_idx * 1.5, 'synthetic keyword')
+        if idx == 0:
+            hdu.header['DATE-OBS'] = '2021-03-04T05:06:07.0'
+        hdul.append(hdu)
+    hdul.writeto(path)
+
+
+def make_fits_tree(root, shape, seed=0):
+    '''Populate local directory `root` with `shape.n_dirs` directories
+    of `shape.files_per_dir` FITS files each
+
+    Returns
+    -------
+    paths : list of str
+    '''
+    rng = np.random.default_rng(seed)
+    paths = []
+    for dir_idx in range(shape.n_dirs):
+        dirpath = os.path.join(root, f'dir_{dir_idx:03}')
+        os.makedirs(dirpath, exist_ok=True)
+        for file_idx in range(shape.files_per_dir):
+            path = os.path.join(dirpath, f'frame_{file_idx:05}.fits')
+            make_fits_file(path, shape, rng)
+            paths.append(path)
+    return paths
+
+
+def tree_size(paths):
+    return sum(os.path.getsize(path) for path in paths)
+
+
+@contextmanager
+def cold_cache(workdir):
+    '''Use a new, empty cache directory (and so checksum index) in this
+    process and any worker processes started inside the block
+    '''
+    orig_config = config.get_config()
+    orig_index = cache._CHECKSUM_INDEX
+    cache_dir = os.path.join(workdir, f'cache_{uuid.uuid4().hex}')
+    config.set_config(dataclasses.replace(orig_config, CACHE_DIR=cache_dir))
+    cache._CHECKSUM_INDEX = None
+    try:
+        yield cache_dir
+    finally:
+        config.set_config(orig_config)
+        cache._CHECKSUM_INDEX = orig_index
+
+
+class Benchmark:
+    '''One timed operation. Subclasses set `name` and implement `run`,
+    and optionally `setup` (untimed, before every repetition) and
+    `params` (what distinguishes results that are comparable).
+    Repetitions run with a cold checksum index unless `warm` is set.
+    '''
+    name = None
+    warm = False
+
+    def __init__(self, workdir, paths, shape):
+        self.workdir = workdir
+        self.paths = paths
+        self.shape = shape
+        self.src = os.path.dirname(os.path.dirname(paths[0]))
+        self.n_bytes = tree_size(paths)
+        self.n_files = len(paths)
+
+    def params(self):
+        return dataclasses.asdict(self.shape)
+
+    def setup(self):
+        pass
+
+    def run(self):
+        raise NotImplementedError("Subclasses must implement run()")
+
+    def _fresh_dir(self, label):
+        return os.path.join(self.workdir, f'{label}_{uuid.uuid4().hex}')
+
+
+class SizeAndMd5sum(Benchmark):
+    name = 'utils.size_and_md5sum'
+
+    def run(self):
+        for path in self.paths:
+            with open(path, 'rb') as fh:
+                utils.size_and_md5sum(fh)
+
+
+class CopyBetweenFilesystems(Benchmark):
+    name = 'data_store.copy_between_filesystems[local->memory]'
+
+    def setup(self):
+        self.dest = f'/bench_{uuid.uuid4().hex}'
+
+    def run(self):
+        srcfs = data_store.get_fs(self.src)
+        memfs = data_store.get_fs('memory://')
+        for idx, path in enumerate(self.paths):
+            data_store.copy_between_filesystems(path, srcfs, f'{self.dest}/{idx}.fits', memfs)
+        memfs.rm(self.dest, recursive=True)
+
+
+class SyncLocalCold(Benchmark):
+    name = 'data_store.sync[local->local,new]'
+    jobs = 1
+
+    def params(self):
+        return dict(super().params(), jobs=self.jobs)
+
+    def setup(self):
+        self.dest = self._fresh_dir('sync_dest')
+
+    def run(self):
+        assert data_store.sync(self.src, self.dest, jobs=self.jobs) == {}
+
+
+class SyncLocalColdParallel(SyncLocalCold):
+    jobs = 4
+
+
+class SyncLocalUnchanged(Benchmark):
+    '''Sync to an up to date destination with a cold checksum index,
+    so every file is hashed on both sides
+    '''
+    name = 'data_store.sync[local->local,unchanged,full scan]'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dest = self._fresh_dir('sync_dest')
+        data_store.sync(self.src, self.dest, use_manifest=False)
+        self.n_bytes *= 2
+
+    def run(self):
+        assert data_store.sync(self.src, self.dest, use_manifest=False) == {}
+
+
+class SyncLocalManifest(Benchmark):
+    '''Sync to an up to date destination with its sync manifest'''
+    name = 'data_store.sync[local->local,unchanged,manifest]'
+    warm = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dest = self._fresh_dir('sync_dest')
+        data_store.sync(self.src, self.dest)
+        self.n_bytes = 0
+
+    def run(self):
+        assert data_store.sync(self.src, self.dest) == {}
+
+
+class SyncMemoryCold(Benchmark):
+    '''Sync to the fsspec memory filesystem, standing in for a remote
+    store like iRODS
+    '''
+    name = 'data_store.sync[local->memory,new]'
+
+    def setup(self):
+        self.dest = f'memory:///bench_{uuid.uuid4().hex}'
+
+    def run(self):
+        assert data_store.sync(self.src, self.dest) == {}
+        data_store.get_fs('memory://').rm(self.dest[len('memory://'):], recursive=True)
+
+
+class SyncMemoryUnchanged(Benchmark):
+    name = 'data_store.sync[local->memory,unchanged,full scan]'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dest = f'memory:///bench_{uuid.uuid4().hex}'
+        data_store.sync(self.src, self.dest, use_manifest=False)
+        self.n_bytes *= 2
+
+    def run(self):
+        assert data_store.sync(self.src, self.dest, use_manifest=False) == {}
+
+
+class ExtractInfo(Benchmark):
+    name = 'datum.extract_info'
+
+    def run(self):
+        for path in self.paths:
+            datum.extract_info(path)
+
+
+class ExtractAllInfo(Benchmark):
+    name = 'datum.extract_all_info'
+    jobs = 4
+
+    def params(self):
+        return dict(super().params(), jobs=self.jobs)
+
+    def run(self):
+        payloads = datum.extract_all_info(self.paths, jobs=self.jobs)
+        assert all(payload is not None for payload in payloads)
+
+
+BENCHMARKS = (
+    SizeAndMd5sum,
+    CopyBetweenFilesystems,
+    SyncLocalCold,
+    SyncLocalColdParallel,
+    SyncLocalUnchanged,
+    SyncLocalManifest,
+    SyncMemoryCold,
+    SyncMemoryUnchanged,
+    ExtractInfo,
+    ExtractAllInfo,
+)
+
+
+def _environment():
+    return {
+        'version': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def run_benchmark(benchmark, repeat=3):
+    '''Time `benchmark.run` `repeat` times
+
+    Returns
+    -------
+    result : dict
+        JSON-serializable record of the timings
+    '''
+    timings = []
+    for _ in range(repeat):
+        with nullcontext() if benchmark.warm else cold_cache(benchmark.workdir):
+            benchmark.setup()
+            start = time.perf_counter()
+            benchmark.run()
+            timings.append(time.perf_counter() - start)
+    best = min(timings)
+    return dict(
+        _environment(),
+        benchmark=benchmark.name,
+        params=benchmark.params(),
+        repeat=repeat,
+        seconds_min=best,
+        seconds_median=statistics.median(timings),
+        n_files=benchmark.n_files,
+        n_bytes=benchmark.n_bytes,
+        bytes_per_second=benchmark.n_bytes / best if best else None,
+        files_per_second=benchmark.n_files / best if best else None,
+        timestamp=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    )
+
+
+def run_benchmarks(workdir, shape, repeat=3, only=None):
+    '''Generate a FITS tree of `shape` under `workdir` and run
+    `BENCHMARKS` (or those whose names contain any of `only`) on it,
+    yielding result records as they finish
+    '''
+    paths = make_fits_tree(os.path.join(workdir, 'src'), shape)
+    for cls in BENCHMARKS:
+        if only and not any(pattern in cls.name for pattern in only):
+            continue
+        with cold_cache(workdir):
+            benchmark = cls(workdir, paths, shape)
+        log.info(f'Running {cls.name}')
+        yield run_benchmark(benchmark, repeat=repeat)
+
+
+def _label(result):
+    jobs = result['params'].get('jobs')
+    return result['benchmark'] if jobs is None else f'{result["benchmark"]} jobs={jobs}'
+
+
+def _result_key(result):
+    return result['benchmark'], orjson.dumps(result['params'], option=orjson.OPT_SORT_KEYS)
+
+
+def load_results(path):
+    with open(path, 'rb') as fh:
+        return [orjson.loads(line) for line in fh if line.strip()]
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    '''Match `results` with `baseline` results by benchmark and
+    parameters
+
+    Returns
+    -------
+    comparisons : list of (result, baseline_result, ratio)
+        ratio of best times (> 1 is slower), for matched results
+    regressions : list
+        the comparisons slower than the baseline by more than
+        `tolerance`
+    '''
+    by_key = {_result_key(result): result for result in baseline}
+    comparisons = []
+    for result in results:
+        base = by_key.get(_result_key(result))
+        if base is None or not base['seconds_min']:
+            continue
+        comparisons.append((result, base, result['seconds_min'] / base['seconds_min']))
+    regressions = [comp for comp in comparisons if comp[2] > 1 + tolerance]
+    return comparisons, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out', help='append results as JSON lines to this path')
+    parser.add_argument('--compare', help='results from an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='allowed slowdown relative to --compare (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3, help='times to run each benchmark (default: %(default)s)')
+    parser.add_argument('--only', action='append', help='run only benchmarks whose names contain this (may be repeated)')
+    parser.add_argument('--workdir', help='directory for generated files (default: a temporary directory, removed afterwards)')
+    defaults = TreeShape()
+    parser.add_argument('--n-dirs', type=int, default=defaults.n_dirs)
+    parser.add_argument('--files-per-dir', type=int, default=defaults.files_per_dir)
+    parser.add_argument('--image-shape', type=int, nargs=2, default=defaults.image_shape)
+    parser.add_argument('--n-extensions', type=int, default=defaults.n_extensions)
+    parser.add_argument('--n-keywords', type=int, default=defaults.n_keywords)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level='INFO')
+
+    shape = TreeShape(
+        n_dirs=args.n_dirs,
+        files_per_dir=args.files_per_dir,
+        image_shape=tuple(args.image_shape),
+        n_extensions=args.n_extensions,
+        n_keywords=args.n_keywords,
+    )
+    workdir = tempfile.mkdtemp(prefix='dap_bench_') if args.workdir is None else args.workdir
+    results = []
+    try:
+        for result in run_benchmarks(workdir, shape, repeat=args.repeat, only=args.only):
+            results.append(result)
+            print(
+                f'{_label(result):<60} {result["seconds_min"]:8.3f} s'
+                f' {(result["bytes_per_second"] or 0) / 1e6:9.1f} MB/s'
+                f' {result["files_per_second"] or 0:9.1f} files/s'
+            )
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir)
+    if args.out is not None:
+        with open(args.out, 'ab') as fh:
+            for result in results:
+                fh.write(orjson.dumps(result) + b'\n')
+    if args.compare is not None:
+        comparisons, regressions = compare(results, load_results(args.compare), tolerance=args.tolerance)
+        for result, _, ratio in comparisons:
+            flag = ' REGRESSION' if ratio > 1 + args.tolerance else ''
+            print(f'{_label(result):<60} {ratio:6.2f}x baseline{flag}')
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
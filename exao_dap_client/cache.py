@@ -0,0 +1,351 @@
+import io
+import logging
+import os
+import os.path
+import sqlite3
+import sys
+import threading
+import time
+
+import orjson
+
+from . import utils
+from .config import get_config
+
+log = logging.getLogger(__name__)
+
+_LOCK = threading.Lock()
+_CHECKSUM_INDEX = None
+_BLOCK_DIGEST_INDEX = None
+_METADATA_CACHE = None
+
+DEFAULT_MAX_ENTRIES = 1_000_000
+DEFAULT_METADATA_CACHE_BYTES = 2**28
+# Fraction of the cap to evict down to when full, so eviction isn't
+# triggered again by the very next insert
+_EVICT_TO_FRACTION = 0.9
+# Only count rows every this many inserts
+_EVICTION_CHECK_INTERVAL = 1000
+
+
+def local_path_of(file_handle):
+    '''Return the local filesystem path backing `file_handle`, if
+    there is one, or None (for remote files, in-memory buffers, etc.)
+
+    Only handles known to read a local file count, as remote fsspec
+    files also have a `path`, which may happen to exist locally too
+    (e.g. in a mirrored tree).
+    '''
+    if isinstance(file_handle, (io.FileIO, io.BufferedReader)):
+        path = file_handle.name
+    else:
+        # only loaded if a local fsspec file could have been opened
+        fsspec_local = sys.modules.get('fsspec.implementations.local')
+        if fsspec_local is None or not isinstance(file_handle, fsspec_local.LocalFileOpener):
+            return None
+        path = file_handle.path
+    if isinstance(path, str) and os.path.isfile(path):
+        return os.path.abspath(path)
+    return None
+
+
+class _SQLiteIndex:
+    '''Table of entries in an SQLite database, keyed by `KEY` and
+    created with `SCHEMA` (which must include a `last_used` column).
+    The least recently used entries are evicted once there are more
+    than `max_entries` of them.
+
+    Safe to share between threads (each thread gets its own
+    connection).
+    '''
+    TABLE = None
+    KEY = None
+    SCHEMA = None
+
+    def __init__(self, db_path, max_entries=DEFAULT_MAX_ENTRIES):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._inserts = 0
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(self.SCHEMA)
+            conn.execute(f'CREATE INDEX IF NOT EXISTS {self.TABLE}_last_used ON {self.TABLE} (last_used)')
+
+    def _connection(self):
+        if not hasattr(self._local, 'conn'):
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return self._local.conn
+
+    def _inserted(self):
+        with _LOCK:
+            self._inserts += 1
+            check = self._inserts % _EVICTION_CHECK_INTERVAL == 0
+        if check:
+            self.evict()
+
+    def evict(self):
+        '''Drop least recently used entries if over `max_entries`'''
+        conn = self._connection()
+        with conn:
+            (count,) = conn.execute(f'SELECT COUNT(*) FROM {self.TABLE}').fetchone()
+            if count <= self.max_entries:
+                return 0
+            n_evict = count - int(self.max_entries * _EVICT_TO_FRACTION)
+            conn.execute(
+                f'DELETE FROM {self.TABLE} WHERE {self.KEY} IN '
+                f'(SELECT {self.KEY} FROM {self.TABLE} ORDER BY last_used LIMIT ?)',
+                (n_evict,)
+            )
+        log.debug(f'Evicted {n_evict} {self.TABLE} entries')
+        return n_evict
+
+
+class ChecksumIndex(_SQLiteIndex):
+    '''Persistent map from local file paths to MD5 checksums, stored in
+    SQLite. An entry is only trusted while the file's size, mtime
+    (in ns) and inode are unchanged since it was recorded; otherwise
+    it is dropped and the file is hashed again.
+
+    The least recently used entries are evicted once there are more
+    than `max_entries` of them.
+
+    Safe to share between threads (each thread gets its own
+    connection).
+    '''
+    TABLE = 'checksums'
+    KEY = 'path'
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS checksums (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            md5 TEXT NOT NULL,
+            last_used REAL NOT NULL
+        )
+    '''
+
+    def lookup(self, path, stat_result=None):
+        '''Return the recorded MD5 hex digest for `path` or None
+        if there is no entry or the entry is stale
+        '''
+        path = os.path.abspath(path)
+        st = os.stat(path) if stat_result is None else stat_result
+        conn = self._connection()
+        with conn:
+            row = conn.execute(
+                'SELECT size, mtime_ns, inode, md5 FROM checksums WHERE path = ?',
+                (path,)
+            ).fetchone()
+            if row is None:
+                return None
+            size, mtime_ns, inode, md5 = row
+            if (size, mtime_ns, inode) != (st.st_size, st.st_mtime_ns, st.st_ino):
+                log.debug(f'Invalidating stale checksum for {path}')
+                conn.execute('DELETE FROM checksums WHERE path = ?', (path,))
+                return None
+            conn.execute(
+                'UPDATE checksums SET last_used = ? WHERE path = ?',
+                (time.time(), path)
+            )
+        return md5
+
+    def record(self, path, md5, stat_result=None):
+        '''Store `md5` as the checksum of `path` as it is right now
+        (or as it was when `stat_result` was taken)
+        '''
+        path = os.path.abspath(path)
+        st = os.stat(path) if stat_result is None else stat_result
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?, ?)',
+                (path, st.st_size, st.st_mtime_ns, st.st_ino, md5, time.time())
+            )
+        self._inserted()
+
+    def size_and_md5sum(self, path):
+        '''Like `utils.size_and_md5sum` for a local path, but only
+        reads the file when there's no valid entry for it
+        '''
+        st = os.stat(path)
+        md5 = self.lookup(path, stat_result=st)
+        if md5 is None:
+            with open(path, 'rb') as fh:
+                _, md5 = utils.size_and_md5sum(fh)
+            self.record(path, md5, stat_result=st)
+        return st.st_size, md5
+
+    def md5sum(self, path):
+        _, md5 = self.size_and_md5sum(path)
+        return md5
+
+
+class BlockDigestIndex(_SQLiteIndex):
+    '''Persistent map from file URLs (typically remote sync
+    destinations) to the MD5s of their fixed-size blocks, stored in
+    SQLite, so a changed file can be sent as just its changed blocks
+    without reading the copy at the other end.
+
+    An entry is only trusted for a file whose whole-file MD5 (e.g. as
+    reported by iRODS) is still the one recorded with it.
+    '''
+    TABLE = 'block_digests'
+    KEY = 'url'
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS block_digests (
+            url TEXT PRIMARY KEY,
+            md5 TEXT NOT NULL,
+            block_size INTEGER NOT NULL,
+            digests BLOB NOT NULL,
+            last_used REAL NOT NULL
+        )
+    '''
+
+    def lookup(self, url, md5, block_size):
+        '''Return the recorded block MD5s of `url` if they were recorded
+        for contents with whole-file MD5 `md5` in blocks of
+        `block_size` bytes, or None
+        '''
+        if md5 is None:
+            return None
+        conn = self._connection()
+        with conn:
+            row = conn.execute(
+                'SELECT md5, block_size, digests FROM block_digests WHERE url = ?',
+                (url,)
+            ).fetchone()
+            if row is None or tuple(row[:2]) != (md5, block_size):
+                return None
+            conn.execute(
+                'UPDATE block_digests SET last_used = ? WHERE url = ?',
+                (time.time(), url)
+            )
+        return orjson.loads(row[2])
+
+    def record(self, url, md5, block_size, digests):
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO block_digests VALUES (?, ?, ?, ?, ?)',
+                (url, md5, block_size, orjson.dumps(digests), time.time())
+            )
+        self._inserted()
+
+
+class MetadataCache(_SQLiteIndex):
+    '''Persistent map from MD5 checksums of file contents to metadata
+    extracted from them (e.g. by `datum.extract_info`), stored in SQLite
+    as orjson, so the same bytes are never parsed twice whatever path
+    they turn up under.
+
+    Entries written by a different `PAYLOAD_VERSION` are ignored. The
+    least recently used entries are evicted once the stored payloads
+    add up to more than `max_bytes`.
+    '''
+    # bump when extractors change what they produce
+    PAYLOAD_VERSION = 1
+    TABLE = 'metadata'
+    KEY = 'md5'
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS metadata (
+            md5 TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            payload BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            last_used REAL NOT NULL
+        )
+    '''
+
+    def __init__(self, db_path, max_bytes=DEFAULT_METADATA_CACHE_BYTES):
+        super().__init__(db_path)
+        self.max_bytes = max_bytes
+
+    def lookup(self, md5):
+        '''Return the payload recorded for contents with checksum `md5`,
+        or None
+        '''
+        if md5 is None:
+            return None
+        conn = self._connection()
+        with conn:
+            row = conn.execute(
+                'SELECT version, payload FROM metadata WHERE md5 = ?',
+                (md5,)
+            ).fetchone()
+            if row is None or row[0] != self.PAYLOAD_VERSION:
+                return None
+            conn.execute(
+                'UPDATE metadata SET last_used = ? WHERE md5 = ?',
+                (time.time(), md5)
+            )
+        return orjson.loads(row[1])
+
+    def record(self, md5, payload):
+        '''Store `payload` for contents with checksum `md5`, unless it
+        can't be serialized
+        '''
+        try:
+            data = orjson.dumps(payload)
+        except TypeError as exc:
+            log.debug(f'Not caching metadata for {md5}: {exc}')
+            return
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?)',
+                (md5, self.PAYLOAD_VERSION, data, len(data), time.time())
+            )
+        self._inserted()
+
+    def evict(self):
+        '''Drop least recently used entries if over `max_bytes`'''
+        conn = self._connection()
+        with conn:
+            (total,) = conn.execute('SELECT COALESCE(SUM(size), 0) FROM metadata').fetchone()
+            if total <= self.max_bytes:
+                return 0
+            to_free = total - int(self.max_bytes * _EVICT_TO_FRACTION)
+            evicted = []
+            for md5, size in conn.execute('SELECT md5, size FROM metadata ORDER BY last_used'):
+                if to_free <= 0:
+                    break
+                evicted.append((md5,))
+                to_free -= size
+            conn.executemany('DELETE FROM metadata WHERE md5 = ?', evicted)
+        log.debug(f'Evicted {len(evicted)} metadata entries')
+        return len(evicted)
+
+
+def get_checksum_index():
+    '''Shared `ChecksumIndex` stored in the configured cache directory'''
+    global _CHECKSUM_INDEX
+    with _LOCK:
+        if _CHECKSUM_INDEX is None:
+            db_path = os.path.join(get_config().CACHE_DIR, 'checksums.sqlite')
+            _CHECKSUM_INDEX = ChecksumIndex(db_path)
+    return _CHECKSUM_INDEX
+
+
+def get_block_digest_index():
+    '''Shared `BlockDigestIndex` stored in the configured cache directory'''
+    global _BLOCK_DIGEST_INDEX
+    with _LOCK:
+        if _BLOCK_DIGEST_INDEX is None:
+            db_path = os.path.join(get_config().CACHE_DIR, 'block_digests.sqlite')
+            _BLOCK_DIGEST_INDEX = BlockDigestIndex(db_path)
+    return _BLOCK_DIGEST_INDEX
+
+
+def get_metadata_cache():
+    '''Shared `MetadataCache` stored in the configured cache directory'''
+    global _METADATA_CACHE
+    with _LOCK:
+        if _METADATA_CACHE is None:
+            db_path = os.path.join(get_config().CACHE_DIR, 'metadata.sqlite')
+            _METADATA_CACHE = MetadataCache(db_path)
+    return _METADATA_CACHE
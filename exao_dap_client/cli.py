@@ -1,39 +1,58 @@
 import argparse
+import importlib
 import logging
 import os
 import sys
 from . import config
-from .commands import sync, ingest, extract_info
 
 log = logging.getLogger(__name__)
 
-COMMANDS = {sync.Sync, ingest.Ingest, extract_info.ExtractInfo}
+# subcommand name -> (module in .commands, class name, help), so that
+# only the command being run gets imported, along with whatever heavy
+# dependencies it needs
+COMMANDS = {
+    'sync': ('sync', 'Sync', "Sync a local filesystem directory to an iRODS collection"),
+    'ingest': ('ingest', 'Ingest', "Turn a Data Store path into a registered dataset"),
+    'extract_info': (
+        'extract_info', 'ExtractInfo',
+        "Extract metadata and output the file's info payload as understood by the platform"
+    ),
+}
 
 
-def main():
+def load_command(name):
+    '''Import and return the command class registered as `name`'''
+    module_name, class_name, _ = COMMANDS[name]
+    module = importlib.import_module(f'.commands.{module_name}', __package__)
+    return getattr(module, class_name)
+
+
+def main(argv=None):
     parser = argparse.ArgumentParser()
     config.add_cli_options(parser)
     parser.add_argument('-v', '--verbose', action='store_true')
-    parser.set_defaults(command_cls=None)
     subps = parser.add_subparsers(title='subcommands',
-                                  description='valid subcommands')
-
-    for command_cls in COMMANDS:
-        cmd = command_cls.name
-        print(f'{cmd=}')
-        assert cmd is not None
-        subp = subps.add_parser(cmd, help=command_cls.help)
-        print(f'{subp=}')
-        subp.set_defaults(command_cls=command_cls)
-        command_cls.add_arguments(subp)
-    
-    args = parser.parse_args()
-    if args.command_cls is None:
+                                  description='valid subcommands',
+                                  dest='command')
+    subparsers = {
+        name: subps.add_parser(name, help=help, add_help=False)
+        for name, (_, _, help) in COMMANDS.items()
+    }
+
+    # find out which command it is first, then give only that one
+    # its arguments
+    args, _ = parser.parse_known_args(argv)
+    if args.command is None:
         parser.print_help()
-        sys.exit(1)    
+        sys.exit(1)
+    command_cls = load_command(args.command)
+    subp = subparsers[args.command]
+    subp.add_argument('-h', '--help', action='help', help='show this help message and exit')
+    command_cls.add_arguments(subp)
+    args = parser.parse_args(argv)
 
     logging.basicConfig(level='INFO' if not args.verbose else 'DEBUG')
     log.debug(f'Verbose logging: {args.verbose}')
-    
-    command = args.command_cls(args)
-    sys.exit(command.run())
+
+    command = command_cls(args)
+    sys.exit(command.main())
@@ -1,6 +1,6 @@
 import argparse
+import itertools
 import logging
-from fsspec.registry import filesystem
 import orjson
 import os.path
 import sys
@@ -18,17 +18,80 @@ class ExtractInfo(Command):
     @staticmethod
     def add_arguments(parser: argparse.ArgumentParser):
         super(ExtractInfo, ExtractInfo).add_arguments(parser)
-        parser.add_argument('filename', help='Filename in any supported format to generate a payload for')
+        parser.add_argument(
+            'filename',
+            help='Filename in any supported format to generate a payload for, or a directory or glob pattern to find them with',
+            nargs='*'
+        )
+        parser.add_argument(
+            '--file-list',
+            help='File with one filename per line to generate payloads for (- for stdin)',
+        )
+        parser.add_argument(
+            '-j', '--jobs',
+            help='number of worker processes for extracting multiple files (default: number of CPUs)',
+            type=int,
+        )
+        parser.add_argument(
+            '--table',
+            help='Directory to append extracted headers to as a columnar (Parquet) table, instead of printing JSON (requires pyarrow)',
+        )
 
-    def main(self):
-        fn = self.args.filename
+    def _single_file(self, fn):
         fs = data_store.get_fs(fn)
         if not fs.exists(fn) or not fs.info(fn)['type'] == 'file':
             print(f'{repr(fn)} is not a recognized path to a file', file=sys.stderr)
-            sys.exit(1)
+            return self.FAILURE
         with warnings.catch_warnings():
             warnings.simplefilter('ignore')
             with fs.open(fn) as fh:
                 payload = datum.extract_info(fh)
         print(orjson.dumps(payload, option=orjson.OPT_INDENT_2).decode('utf8'))
-        sys.exit(0)
+        return self.SUCCESS
+
+    def _file_list(self):
+        fh = sys.stdin if self.args.file_list == '-' else open(self.args.file_list)
+        with fh:
+            for line in fh:
+                line = line.strip()
+                if line:
+                    yield line
+
+    def _is_single_file(self):
+        specs = self.args.filename
+        if self.args.file_list is not None or len(specs) != 1:
+            return False
+        fn = specs[0]
+        return not any(char in fn for char in '*?[') and not data_store.get_fs(fn).isdir(fn)
+
+    def main(self):
+        if self.args.table is None and self._is_single_file():
+            return self._single_file(self.args.filename[0])
+        paths = data_store.expand_paths(self.args.filename)
+        if self.args.file_list is not None:
+            paths = itertools.chain(paths, self._file_list())
+        if self.args.table is not None:
+            from ..header_table import HeaderTableWriter
+            writer = HeaderTableWriter(self.args.table)
+        else:
+            writer = None
+        # one JSON object per line, in order of completion
+        n_failed = 0
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            for path, payload in datum.iter_extract_info(paths, jobs=self.args.jobs):
+                if payload is None:
+                    n_failed += 1
+                    continue
+                if writer is not None:
+                    writer.append(path, payload)
+                    continue
+                sys.stdout.buffer.write(orjson.dumps({'path': path, 'payload': payload}) + b'\n')
+                sys.stdout.flush()
+        if writer is not None:
+            writer.close()
+            print(f'Wrote {writer.n_rows} row(s) to {self.args.table}', file=sys.stderr)
+        if n_failed:
+            print(f'Failed to extract info from {n_failed} file(s)', file=sys.stderr)
+            return self.FAILURE
+        return self.SUCCESS
@@ -43,10 +43,21 @@ class Ingest(Command):
             '--friendly-name',
             help=f'Friendly name for this dataset',
         )
+        parser.add_argument(
+            '--batch-size',
+            help=f'upload data payloads in batches of this many per request, resuming with the rest if rerun after a failure (default: send the whole dataset in one request; try {dataset.DEFAULT_BATCH_SIZE})',
+            type=int,
+        )
+        parser.add_argument(
+            '-j', '--jobs',
+            help='number of files to read headers from, and of batches to upload, concurrently (default: 4)',
+            type=int,
+            default=4
+        )
 
     def main(self):
-        data_payloads = datum.init_from_collection(self.args.data_store_path)
-        result = dataset.ingest(
+        data_payloads = datum.init_from_collection(self.args.data_store_path, jobs=self.args.jobs)
+        args = (
             self.args.data_store_path,
             self.args.identifier,
             self.args.source,
@@ -56,4 +67,8 @@ class Ingest(Command):
             self.args.friendly_name,
             data_payloads
         )
+        if self.args.batch_size:
+            result = dataset.ingest_in_batches(*args, batch_size=self.args.batch_size, jobs=self.args.jobs)
+        else:
+            result = dataset.ingest(*args)
         return self.SUCCESS
@@ -1,29 +1,137 @@
 import argparse
+import concurrent.futures
 import logging
 import os
+import shutil
+import sys
 from astropy.io import fits
 import warnings
 
+from .. import fits_headers
+
 log = logging.getLogger(__name__)
 
+# what `normalize_file` had to do
+UNCHANGED = 'unchanged'
+HEADERS_PATCHED = 'headers_patched'
+REWRITTEN = 'rewritten'
+
+def _fixed_headers(hdul, hdus):
+    '''Raw bytes of each header of `hdul` after fixing, or None if any
+    header (or the data size it describes) changed length, so the file
+    can't be patched in place
+    '''
+    if len(hdul) != len(hdus):
+        return None
+    fixed = []
+    for hdu, info in zip(hdul, hdus):
+        header_bytes = hdu.header.tostring().encode('ascii')
+        if len(header_bytes) != len(info.header_bytes):
+            return None
+        if fits_headers.data_size(header_bytes) != info.data_size:
+            return None
+        fixed.append(header_bytes)
+    return fixed
+
+def _patch_headers(path, hdus, fixed):
+    with open(path, 'r+b') as fh:
+        for info, header_bytes in zip(hdus, fixed):
+            if header_bytes != info.header_bytes:
+                fh.seek(info.header_offset)
+                fh.write(header_bytes)
+
+def normalize_file(fn, outfolder=None, overwrite=False):
+    '''Fix what `verify('fix')` can in FITS file `fn`, writing the
+    result to `outfolder` (under the same name) or, if `outfolder` is
+    None, back to `fn`.
+
+    The file is opened memory-mapped, so pixel data are only read if
+    they have to be rewritten. When fixing leaves every header the same
+    number of blocks long, just the changed header blocks are written:
+    over the original for in-place fixes, or over a copy made with
+    `shutil.copyfile` (which copies in the kernel where it can).
+    Otherwise the whole file is written out by astropy (in place via a
+    temporary file moved over the original).
+
+    Returns
+    -------
+    outpath : str
+    action : str
+        `UNCHANGED`, `HEADERS_PATCHED` or `REWRITTEN`
+    '''
+    outpath = fn if outfolder is None else os.path.join(outfolder, os.path.basename(fn))
+    if outpath != fn and os.path.exists(outpath) and not overwrite:
+        raise OSError(f'File {outpath!r} already exists.')
+    with open(fn, 'rb') as fh:
+        hdus = fits_headers.scan(fh)
+    with fits.open(fn, memmap=True) as hdul:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            hdul.verify('fix')  # TODO this can't handle the corrupted Clio split header
+            fixed = _fixed_headers(hdul, hdus)
+            if fixed is None:
+                tmp_path = f'{outpath}.{os.getpid()}.tmp'
+                hdul.writeto(tmp_path, overwrite=True, output_verify='fix')
+                os.replace(tmp_path, outpath)
+                return outpath, REWRITTEN
+    changed = any(header_bytes != info.header_bytes for info, header_bytes in zip(hdus, fixed))
+    if outpath != fn:
+        shutil.copyfile(fn, outpath)
+    if changed:
+        _patch_headers(outpath, hdus, fixed)
+    return outpath, HEADERS_PATCHED if changed else UNCHANGED
+
+def normalize_files(fn_list, outfolder=None, overwrite=False, jobs=1):
+    '''Run `normalize_file` on each of `fn_list`, on a pool of `jobs`
+    worker processes if more than one, yielding `(fn, outpath, action)`
+    as each is done (`outpath` and `action` are None if it failed, and
+    the error is logged)
+    '''
+    if jobs == 1:
+        results = ((fn, _try_normalize_file(fn, outfolder, overwrite)) for fn in fn_list)
+        for fn, result in results:
+            yield (fn,) + result
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(_try_normalize_file, fn, outfolder, overwrite): fn
+            for fn in fn_list
+        }
+        for future in concurrent.futures.as_completed(futures):
+            yield (futures[future],) + future.result()
+
+def _try_normalize_file(fn, outfolder, overwrite):
+    try:
+        return normalize_file(fn, outfolder, overwrite)
+    except Exception as exc:
+        log.error(f'Failed to normalize {fn}: {exc!r}')
+        return None, None
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('filename', help='Filename in any supported format to generate a payload for', nargs='+')
     parser.add_argument('-o', '--outfolder', help='Destination folder for updated files', nargs='?', default='./normalized_fits')
+    parser.add_argument('-i', '--in-place', help='Fix the files where they are instead of writing to --outfolder', action='store_true')
     parser.add_argument('-f', '--force-overwrite', help='Whether to overwrite existing files', action='store_true')
+    parser.add_argument(
+        '-j', '--jobs',
+        help='number of files to normalize concurrently in worker processes (default: number of CPUs)',
+        type=int,
+        default=os.cpu_count()
+    )
     # TODO options to set keywords on all files
     args = parser.parse_args()
-    fn_list = args.filename
-    outfolder = args.outfolder
-    overwrite = args.force_overwrite
-    os.makedirs(outfolder, exist_ok=True)
-    for fn in fn_list:
-        with open(fn, 'rb') as f:
-            basename = os.path.basename(fn)
-            hdul = fits.open(f)
-            with warnings.catch_warnings():
-                warnings.simplefilter('ignore')
-                hdul.verify('fix')  # TODO this can't handle the corrupted Clio split header
-                outpath = os.path.join(outfolder, basename)
-                hdul.writeto(outpath, overwrite=overwrite)
-                log.info(f'Validated {fn} and wrote to {outpath}')
+    logging.basicConfig(level='INFO')
+    outfolder = None if args.in_place else args.outfolder
+    if outfolder is not None:
+        os.makedirs(outfolder, exist_ok=True)
+    n_failed = 0
+    for fn, outpath, action in normalize_files(args.filename, outfolder, args.force_overwrite, jobs=args.jobs):
+        if outpath is None:
+            n_failed += 1
+        else:
+            log.info(f'Validated {fn} and wrote to {outpath} ({action})')
+    if n_failed:
+        print(f'Failed to normalize {n_failed} file(s)', file=sys.stderr)
+        return 1
+    return 0
@@ -4,15 +4,19 @@ import os
 import os.path
 import pathlib
 import sys
+import time
 import warnings
 import logging
 
 from .base import Command
 
-from .. import utils, data_store
+from .. import utils, data_store, metrics
 
 log = logging.getLogger(__name__)
 
+# seconds between progress updates
+PROGRESS_INTERVAL = 0.5
+
 class Sync(Command):
     name = "sync"
     help = "Sync a local filesystem directory to an iRODS collection"
@@ -20,12 +24,173 @@ class Sync(Command):
     @staticmethod
     def add_arguments(parser: argparse.ArgumentParser):
         super(Sync, Sync).add_arguments(parser)
-        parser.add_argument('source_dir', help='path or URL to sync from')
-        parser.add_argument('destination_dir', help='path or URL to sync to')
-    
+        parser.add_argument('source_dir', help='path or URL to sync from', nargs='?')
+        parser.add_argument('destination_dir', help='path or URL to sync to', nargs='?')
+        parser.add_argument(
+            '-j', '--jobs',
+            help='number of files to checksum and transfer concurrently (default: 1)',
+            type=int,
+            default=1
+        )
+        parser.add_argument(
+            '--full-scan',
+            help="list the whole destination rather than trusting the manifest left there by the last sync",
+            action='store_true'
+        )
+        parser.add_argument(
+            '--delta',
+            help='send only the changed blocks of files that already exist at the destination, between local files and iRODS',
+            action='store_true'
+        )
+        parser.add_argument(
+            '-n', '--dry-run',
+            help='list both sides and report what would be transferred and how long it might take, without doing it',
+            action='store_true'
+        )
+        parser.add_argument(
+            '--plan-out',
+            help='save the sync plan as JSON to this path instead of carrying it out (with --split, one file per part, suffixed .0, .1, ...)'
+        )
+        parser.add_argument(
+            '--plan',
+            help='carry out a sync plan previously saved with --plan-out, instead of giving source and destination'
+        )
+        parser.add_argument(
+            '--split',
+            help='with --plan-out, divide the plan into this many parts of similar cost',
+            type=int
+        )
+        parser.add_argument(
+            '--progress',
+            help='report progress on stderr as files are synced (default: when stderr is a terminal)',
+            action='store_const',
+            const=True
+        )
+        parser.add_argument(
+            '--no-progress',
+            help="don't report progress",
+            action='store_const',
+            const=False,
+            dest='progress'
+        )
+        parser.add_argument(
+            '--metrics-out',
+            help='write per-file and summary metrics as JSON lines to this path (- for stdout)'
+        )
+        parser.add_argument(
+            '--prometheus-textfile',
+            help='write summary metrics in Prometheus textfile format to this path (e.g. for node_exporter)'
+        )
+        parser.add_argument(
+            '--transfer-rate',
+            help='transfer rate in MB/s for --dry-run time estimates (default: %(default)s)',
+            type=float,
+            default=data_store.DEFAULT_TRANSFER_RATE / 1e6
+        )
+        parser.add_argument(
+            '--hash-rate',
+            help='checksumming rate in MB/s for --dry-run time estimates (default: %(default)s)',
+            type=float,
+            default=data_store.DEFAULT_HASH_RATE / 1e6
+        )
+
+    def _print_summary(self, plan):
+        summary = plan.summary()
+        for action, totals in summary['actions'].items():
+            if totals['count']:
+                print(f'{action:>16}: {totals["count"]} ({totals["bytes"] / 1e6:.1f} MB)')
+        print(f'To transfer: {summary["bytes_to_transfer"] / 1e6:.1f} MB (up to {summary["bytes_to_transfer_max"] / 1e6:.1f} MB)')
+        print(f'To checksum: {summary["bytes_to_hash"] / 1e6:.1f} MB')
+        best, worst = plan.estimate_seconds(
+            transfer_rate=self.args.transfer_rate * 1e6,
+            hash_rate=self.args.hash_rate * 1e6
+        )
+        print(f'Estimated time: {best:.0f} to {worst:.0f} s')
+
+    def _print_progress(self, metrics):
+        now = time.monotonic()
+        if now - self._last_progress < PROGRESS_INTERVAL:
+            return
+        self._last_progress = now
+        summary = metrics.summary()
+        rate = summary['overall_bytes_per_second'] or 0
+        print(
+            f'\r{metrics.files_done} files ({summary["files_transferred"]} sent, '
+            f'{summary["files_skipped"]} skipped, {summary["files_failed"]} failed), '
+            f'{summary["bytes_transferred"] / 1e6:.1f} MB sent at {rate / 1e6:.1f} MB/s, '
+            f'{summary["bytes_hashed"] / 1e6:.1f} MB hashed',
+            end='', file=sys.stderr, flush=True
+        )
+
+    def _make_metrics(self):
+        show_progress = self.args.progress
+        if show_progress is None:
+            show_progress = sys.stderr.isatty()
+        self._last_progress = 0
+        return metrics.SyncMetrics(
+            progress=self._print_progress if show_progress else None,
+            keep_files=self.args.metrics_out is not None
+        )
+
+    def _report(self, sync_metrics):
+        if sync_metrics.progress is not None:
+            # final state, whenever the last update was
+            self._last_progress = 0
+            self._print_progress(sync_metrics)
+            print(file=sys.stderr)
+        summary = sync_metrics.summary()
+        log.info(
+            f'Listing took {summary["dest_listing_seconds"]:.1f} s (destination) and '
+            f'{summary["src_listing_seconds"]:.1f} s (source), checksumming {summary["checksum_seconds"]:.1f} s, '
+            f'copying {summary["copy_seconds"]:.1f} s, in {summary["elapsed_seconds"]:.1f} s overall'
+        )
+        if self.args.metrics_out == '-':
+            sync_metrics.write_json_lines(sys.stdout.buffer)
+        elif self.args.metrics_out is not None:
+            with open(self.args.metrics_out, 'wb') as fh:
+                sync_metrics.write_json_lines(fh)
+        if self.args.prometheus_textfile is not None:
+            sync_metrics.write_prometheus(self.args.prometheus_textfile)
+
     def main(self):
         logging.getLogger('irods').setLevel('WARN')
         src = self.args.source_dir
         dest = self.args.destination_dir
-        data_store.sync(src, dest)
+        if self.args.plan is not None:
+            plan = data_store.SyncPlan.load(self.args.plan)
+        elif src is None or dest is None:
+            print('Give a source and destination, or a saved --plan', file=sys.stderr)
+            return self.FAILURE
+        elif self.args.dry_run or self.args.plan_out is not None:
+            plan = data_store.make_sync_plan(src, dest, use_manifest=not self.args.full_scan)
+        else:
+            plan = None
+
+        if self.args.dry_run:
+            self._print_summary(plan)
+            return self.SUCCESS
+        if self.args.plan_out is not None:
+            if self.args.split:
+                for idx, part in enumerate(plan.split(self.args.split)):
+                    part.save(f'{self.args.plan_out}.{idx}')
+            else:
+                plan.save(self.args.plan_out)
+            self._print_summary(plan)
+            return self.SUCCESS
+
+        sync_metrics = self._make_metrics()
+        if plan is None:
+            failures = data_store.sync(
+                src, dest, jobs=self.args.jobs, use_manifest=not self.args.full_scan,
+                delta=self.args.delta, metrics=sync_metrics
+            )
+        else:
+            failures = data_store.execute_sync_plan(
+                plan, jobs=self.args.jobs, delta=self.args.delta, metrics=sync_metrics
+            )
+        self._report(sync_metrics)
+        if failures:
+            for path, exc in failures.items():
+                print(f'Failed: {path} ({exc})', file=sys.stderr)
+            return self.FAILURE
         return self.SUCCESS
@@ -6,21 +6,36 @@ from typing import Union
 
 DEFAULT_SERVICE_URL = "https://dap.xwcl.science"
 DEFAULT_IRODS_URL = "irods://data.cyverse.org"
+DEFAULT_HTTP_TIMEOUT = 60.0
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+    'exao_dap_client'
+)
 
 _LOCAL = threading.local()
+# the first configuration created in this process, used by threads
+# that haven't been given their own
+_PROCESS_CONFIG = None
 
 @dataclass
 class Config:
     SERVICE_URL: str
     TOKEN: str
     IRODS_URL: str
+    CACHE_DIR: str
+    HTTP_TIMEOUT: float = DEFAULT_HTTP_TIMEOUT
 
 def get_config(args=None) -> Config:
+    global _PROCESS_CONFIG
+    if not hasattr(_LOCAL, 'config') and args is None and _PROCESS_CONFIG is not None:
+        _LOCAL.config = _PROCESS_CONFIG
     if not hasattr(_LOCAL, 'config'):
         kwargs = {
             'SERVICE_URL': os.environ.get('DAP_SERVICE_URL', DEFAULT_SERVICE_URL),
             'TOKEN': os.environ.get('DAP_TOKEN'),
             'IRODS_URL': os.environ.get('DAP_IRODS_URL', DEFAULT_IRODS_URL),
+            'CACHE_DIR': os.environ.get('DAP_CACHE_DIR', DEFAULT_CACHE_DIR),
+            'HTTP_TIMEOUT': float(os.environ.get('DAP_HTTP_TIMEOUT', DEFAULT_HTTP_TIMEOUT)),
         }
         if args:
             if args.service_url:
@@ -29,9 +44,24 @@ def get_config(args=None) -> Config:
                 kwargs['TOKEN'] = args.token
             if args.irods_url:
                 kwargs['IRODS_URL'] = args.irods_url
+            if args.cache_dir:
+                kwargs['CACHE_DIR'] = args.cache_dir
+            if args.http_timeout:
+                kwargs['HTTP_TIMEOUT'] = args.http_timeout
         _LOCAL.config = Config(**kwargs)
+        if _PROCESS_CONFIG is None:
+            _PROCESS_CONFIG = _LOCAL.config
     return _LOCAL.config
 
+def set_config(config: Config):
+    '''Use `config` for this thread (e.g. in a worker process that
+    should see the same settings as its parent)
+    '''
+    global _PROCESS_CONFIG
+    _LOCAL.config = config
+    if _PROCESS_CONFIG is None:
+        _PROCESS_CONFIG = config
+
 def add_cli_options(parser):
     parser.add_argument(
         '--token',
@@ -45,3 +75,12 @@ def add_cli_options(parser):
         '--irods-url',
         help=f'override iRODS connection information (default uses ~/.irods info, falling back to $DAP_IRODS_URL if present, or {DEFAULT_IRODS_URL})'
     )
+    parser.add_argument(
+        '--cache-dir',
+        help=f'directory for local checksum and metadata caches (defaults to $DAP_CACHE_DIR if present, or {DEFAULT_CACHE_DIR})'
+    )
+    parser.add_argument(
+        '--http-timeout',
+        type=float,
+        help=f'seconds to wait for the service to connect or respond (defaults to $DAP_HTTP_TIMEOUT if present, or {DEFAULT_HTTP_TIMEOUT})'
+    )
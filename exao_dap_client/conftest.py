@@ -0,0 +1,70 @@
+import gzip
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import orjson
+import pytest
+from . import cache, config, http
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache(tmp_path, monkeypatch):
+    '''Keep tests from reading or writing the user's cache directory'''
+    cache_dir = tmp_path / 'dap_cache'
+    monkeypatch.setenv('DAP_CACHE_DIR', str(cache_dir))
+    monkeypatch.setattr(cache, '_CHECKSUM_INDEX', cache.ChecksumIndex(str(cache_dir / 'checksums.sqlite')))
+    monkeypatch.setattr(cache, '_BLOCK_DIGEST_INDEX', cache.BlockDigestIndex(str(cache_dir / 'block_digests.sqlite')))
+    monkeypatch.setattr(cache, '_METADATA_CACHE', cache.MetadataCache(str(cache_dir / 'metadata.sqlite')))
+    return cache_dir
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _respond(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        server = self.server
+        with server.lock:
+            server.requests.append((self.command, self.path, dict(self.headers), body, self.client_address[1]))
+            status, response = server.handler(self.command, self.path, body)
+        extra_headers = {'Retry-After': '0'} if status in (429, 503) else {}
+        response = orjson.dumps(response)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        for key, value in extra_headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(response)
+
+    do_GET = do_POST = do_PATCH = _respond
+
+
+@pytest.fixture
+def stub_server(monkeypatch, isolated_cache):
+    '''Local HTTP server standing in for the DAP service, configured as
+    its SERVICE_URL. Requests are recorded in `requests`, and answered
+    by `handler(method, path, body) -> (status, json_payload)`
+    '''
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.requests = []
+    server.lock = threading.Lock()
+    server.handler = lambda method, path, body: (200, {'ok': True, 'length': len(body)})
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(config, '_PROCESS_CONFIG', config.Config(
+        SERVICE_URL=f'http://127.0.0.1:{server.server_port}',
+        TOKEN='secret',
+        IRODS_URL=config.DEFAULT_IRODS_URL,
+        CACHE_DIR=str(isolated_cache),
+        HTTP_TIMEOUT=5,
+    ))
+    monkeypatch.setattr(config, '_LOCAL', threading.local())
+    monkeypatch.setattr(http, 'BACKOFF_FACTOR', 0)
+    monkeypatch.setattr(http, '_LOCAL', threading.local())
+    yield server
+    server.shutdown()
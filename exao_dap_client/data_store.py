@@ -1,28 +1,85 @@
+import concurrent.futures
+import contextlib
+import dataclasses
+import datetime
+from dataclasses import dataclass
+from enum import Enum
+import hashlib
 import logging
 import os
 import re
 import pathlib
+import posixpath
+import random
+import sys
 import threading
-from urllib.parse import urlparse, urljoin
+from urllib.parse import urlparse, urlunparse, urljoin
 
-from irods.session import iRODSSession
 import fsspec
-import irods_fsspec
-irods_fsspec.register()
+import orjson
+from fsspec.implementations.local import LocalFileSystem
 
-from . import utils
+from . import utils, cache, fs_pool
+from .metrics import FileMetrics, SyncMetrics
 from .config import get_config
 
 log = logging.getLogger(__name__)
-_LOCAL = threading.local()
-_LOCAL.filesystems = {}
+# key -> filesystem instance shared by all threads (see `get_fs`)
+_SHARED_FILESYSTEMS = {}
+_SHARED_LOCK = threading.Lock()
+
+def _irods_fsspec():
+    '''The `irods_fsspec` module, imported and registered with fsspec
+    on first use rather than with this module, as it brings in the
+    whole iRODS client
+    '''
+    import irods_fsspec
+    irods_fsspec.register()
+    return irods_fsspec
+
+def is_irods(fs):
+    '''Whether `fs` is an iRODS filesystem (without importing the
+    iRODS client if it hasn't been already, in which case it can't be)
+    '''
+    irods_fsspec = sys.modules.get('irods_fsspec')
+    return irods_fsspec is not None and isinstance(fs, irods_fsspec.IRODSFileSystem)
+
+def _fs_healthy(fs):
+    if is_irods(fs):
+        # a round trip to the server
+        fs.session.collections.get(f'/{fs.session.zone}')
+    return True
+
+def _close_fs(fs):
+    if is_irods(fs):
+        fs.session.cleanup()
+
+_POOL = fs_pool.FilesystemPool(health_check=_fs_healthy, close=_close_fs)
+
+def _shared_fs(key, factory):
+    with _SHARED_LOCK:
+        if key not in _SHARED_FILESYSTEMS:
+            _SHARED_FILESYSTEMS[key] = factory()
+        return _SHARED_FILESYSTEMS[key]
+
+def _irods_config_key_and_factory():
+    irods_url = get_config().IRODS_URL
+    def factory():
+        kwargs = _irods_fsspec().irods_config_from_url(irods_url)
+        return fsspec.filesystem('irods', skip_instance_cache=True, **kwargs)
+    return ('irods', irods_url), factory
 
 def irods_get_fs():
-    if not hasattr(_LOCAL, 'irodsfs'):
-        config = get_config()
-        fs = fsspec.filesystem('irods', **irods_fsspec.irods_config_from_url(config.IRODS_URL))
-        _LOCAL.irodsfs = fs
-    return _LOCAL.irodsfs
+    '''The iRODS filesystem for the configured `IRODS_URL`, shared by
+    all threads (see `checkout_irods_fs` for work done on many threads)
+    '''
+    return _shared_fs(*_irods_config_key_and_factory())
+
+def checkout_irods_fs(timeout=None):
+    '''Context manager checking out an iRODS filesystem for the
+    configured `IRODS_URL` from the shared pool (see `checkout_fs`)
+    '''
+    return _POOL.checkout(*_irods_config_key_and_factory(), timeout=timeout)
 
 IGNORED_FILENAMES_RE = re.compile(r'__pycache__|\.+')
 
@@ -40,46 +97,843 @@ def basename(path):
     res = urlparse(path)
     return os.path.basename(res.path)
 
-def get_fs(path) -> fsspec.spec.AbstractFileSystem:
-    '''Obtain a concrete fsspec filesystem from a path using
-    the protocol string (if any; defaults to 'file:///') and 
-    `_get_kwargs_from_urls` on the associated fsspec class. The same
-    instance will be returned if the same kwargs are used multiple times
-    in the same thread.
+def with_prefix_of(url, path):
+    '''Give a bare `path` the same scheme and host (etc.) as `url`,
+    e.g. to turn paths returned by an fsspec filesystem back into URLs
+    '''
+    res = urlparse(url)
+    if res.scheme == '':
+        return path
+    return urlunparse(res._replace(path=path))
 
-    Note: Won't work when kwargs are required but not encoded in the
-    URL.
+def expand_paths(specs):
+    '''Yield paths to files from `specs`, which may be paths to files,
+    directories (searched recursively, skipping ignored names) or
+    glob patterns, in any supported filesystem
     '''
+    for spec in specs:
+        fs = get_fs(spec)
+        path = urlparse(spec).path if urlparse(spec).scheme else spec
+        if any(char in path for char in '*?['):
+            matches = fs.glob(path)
+        elif fs.isdir(path):
+            base = fs._strip_protocol(path)
+            matches = (
+                match for match in fs.find(base)
+                if not any(name_is_ignored(part) for part in pathlib.PurePath(match).relative_to(base).parts)
+            )
+        else:
+            yield spec
+            continue
+        for match in matches:
+            yield with_prefix_of(spec, match)
+
+def _fs_key_and_factory(path):
     scheme = urlparse(path).scheme
     proto = scheme if scheme != '' else 'file'
+    if proto == 'irods':
+        _irods_fsspec()
     cls = fsspec.get_filesystem_class(proto)
     if hasattr(cls, '_get_kwargs_from_urls'):
         kwargs = cls._get_kwargs_from_urls(path)
     else:
         kwargs = {}
     key = (proto,) + tuple(kwargs.items())
-    if not hasattr(_LOCAL, 'filesystems'):
-        _LOCAL.filesystems = {}   # unclear why this is not init at import in dask workers
-    if key not in _LOCAL.filesystems:
-        fs = cls(**kwargs)
-        _LOCAL.filesystems[key] = fs
-    return _LOCAL.filesystems[key]
+    # distinct instances (and sessions), not fsspec's cached one
+    return key, lambda: cls(skip_instance_cache=True, **kwargs)
+
+def get_fs(path) -> fsspec.spec.AbstractFileSystem:
+    '''Obtain a concrete fsspec filesystem from a path using
+    the protocol string (if any; defaults to 'file:///') and 
+    `_get_kwargs_from_urls` on the associated fsspec class. The same
+    instance will be returned if the same kwargs are used multiple times,
+    from any thread. Work spread over many threads should use
+    `checkout_fs` instead.
+
+    Note: Won't work when kwargs are required but not encoded in the
+    URL.
+    '''
+    return _shared_fs(*_fs_key_and_factory(path))
+
+# filesystems holding no connections or sessions, whose `get_fs`
+# instance any number of threads can share
+_UNPOOLED_PROTOCOLS = ('file', 'memory')
+
+def checkout_fs(path, timeout=None):
+    '''Context manager checking out a filesystem for `path` (see
+    `get_fs`) from a pool shared by all threads, which keeps at most
+    `fs_pool.DEFAULT_MAX_SIZE` instances (and so iRODS sessions) per
+    distinct filesystem, closes them when left idle, and health-checks
+    them before reuse. Waits up to `timeout` seconds (forever if None)
+    for an instance to be returned when all are in use.
+
+    Local and memory filesystems aren't pooled: every checkout gets
+    the shared `get_fs` instance straight away.
+    '''
+    key, factory = _fs_key_and_factory(path)
+    if key[0] in _UNPOOLED_PROTOCOLS:
+        return contextlib.nullcontext(_shared_fs(key, factory))
+    return _POOL.checkout(key, factory, timeout=timeout)
+
+class ChecksumMismatchError(IOError):
+    pass
+
+_MD5_HEX_RE = re.compile(r'^[0-9a-f]{32}$')
+
+def md5_from_entry(fs, entry):
+    '''Return the MD5 checksum in a detailed listing `entry` from `fs`
+    (iRODS listings include the checksum in its catalog), or None if
+    there isn't one or it isn't an MD5 hex digest
+    '''
+    if not is_irods(fs):
+        return None
+    checksum = entry.get('checksum')
+    if checksum and _MD5_HEX_RE.match(checksum):
+        return checksum
+    return None
+
+def reported_md5(fs, path):
+    '''Return the MD5 checksum the filesystem itself reports for
+    `path` (see `md5_from_entry`)
+    '''
+    if not is_irods(fs):
+        return None
+    return md5_from_entry(fs, fs.info(path))
+
+SERVER_CHECKSUM_THREADS = 8
+SERVER_CHECKSUM_BATCH_SIZE = 64
+
+def server_md5(fs, path):
+    '''Have the server storing `path` compute its MD5 checksum where it
+    is, instead of transferring the contents to hash them: iRODS
+    returns the checksum in its catalog, computing and registering
+    one first if there isn't any. Returns None for other filesystems,
+    if the server couldn't, or if it uses a checksum scheme other
+    than MD5.
+    '''
+    if not is_irods(fs):
+        return None
+    try:
+        checksum = fs.session.data_objects.chksum(fs._strip_protocol(path))
+    except Exception as exc:
+        log.warning(f'Server failed to checksum {path}: {exc!r}')
+        return None
+    if checksum and _MD5_HEX_RE.match(checksum):
+        return checksum
+    log.debug(f'Server checksum of {path} is not an MD5: {checksum!r}')
+    return None
+
+def server_md5s(url, paths, jobs=SERVER_CHECKSUM_THREADS):
+    '''`server_md5` of each of `paths` in the filesystem of `url`, as a
+    dict, with up to `jobs` requests in flight on filesystems checked
+    out of the pool (see `checkout_fs`)
+    '''
+    def one(path):
+        with checkout_fs(url) as fs:
+            return server_md5(fs, path)
+    paths = list(paths)
+    if not paths:
+        return {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(jobs, len(paths))) as executor:
+        return dict(zip(paths, executor.map(one, paths)))
+
+def _record_local_checksum(fs, path, md5, stat_result=None):
+    if isinstance(fs, LocalFileSystem):
+        cache.get_checksum_index().record(fs._strip_protocol(path), md5, stat_result=stat_result)
+
+RANGED_TRANSFER_THRESHOLD = 2**30
+RANGED_TRANSFER_PART_SIZE = 2**26
+RANGED_TRANSFER_THREADS = 4
+RESUME_CHUNK_SIZE = RANGED_TRANSFER_PART_SIZE
+DELTA_BLOCK_SIZE = 2**20
+PARTIAL_SUFFIX = '.dap_partial'
+PARTIAL_TRANSFER_VERSION = 1
+
+def _irods_modify_time(fs, path):
+    modify_time = fs.session.data_objects.get(fs._strip_protocol(path)).modify_time
+    return modify_time.timestamp() if isinstance(modify_time, datetime.datetime) else modify_time
+
+def _source_stamp(srcfs, src, size):
+    '''Size and version (modification time, or for iRODS the checksum
+    in its catalog) identifying the current contents of `src`, or None
+    if the filesystem reports neither (so an interrupted copy of it
+    can't safely be resumed)
+    '''
+    if isinstance(srcfs, LocalFileSystem):
+        version = os.stat(srcfs._strip_protocol(src)).st_mtime_ns
+    else:
+        info = srcfs.info(src)
+        # iRODS `info` has the catalog checksum (if one was registered)
+        # but no modification time, which is on the data object
+        version = info.get('checksum') or _entry_mtime(info)
+        if version is None and is_irods(srcfs):
+            version = _irods_modify_time(srcfs, src)
+    if not isinstance(version, (int, float, str)):
+        return None
+    return [size, version]
+
+def _local_range_md5(fd, offset, length, hasher=None):
+    '''MD5 of `length` bytes from `offset` in open file `fd`, read in
+    bounded pieces (also fed to `hasher`, if given)
+    '''
+    md5 = hashlib.md5()
+    while length > 0:
+        data = os.pread(fd, min(length, utils.DEFAULT_CHUNK_SIZE), offset)
+        if not data:
+            break
+        md5.update(data)
+        if hasher is not None:
+            hasher.update(data)
+        offset += len(data)
+        length -= len(data)
+    return md5.hexdigest()
+
+class PartialTransfer:
+    '''Progress of a copy to the local file `dest_path`, so that an
+    interrupted one can pick up where it stopped.
+
+    Data are written to a hidden temporary file beside the destination
+    (skipped by listings, see `name_is_ignored`), and the MD5 of each
+    `chunk_size` chunk written is recorded in a JSON sidecar next to it
+    along with the source's size and modification time. `complete`
+    moves the data into place atomically, so readers never see a
+    partially written destination.
+    '''
+    def __init__(self, dest_path, source_stamp, chunk_size, n_chunks):
+        self.dest_path = dest_path
+        self.source_stamp = source_stamp
+        self.chunk_size = chunk_size
+        self.chunks = [None] * n_chunks
+        self._lock = threading.Lock()
+        dirname, name = os.path.split(dest_path)
+        self.partial_path = os.path.join(dirname, f'.{name}{PARTIAL_SUFFIX}')
+        self.sidecar_path = f'{self.partial_path}.json'
+
+    @classmethod
+    def open(cls, dest_path, source_stamp, size, chunk_size, **kwargs):
+        '''Pick up the record of an earlier attempt at copying the
+        same source (same `source_stamp`) in chunks of the same size,
+        or discard any leftovers and start afresh
+        '''
+        transfer = cls(dest_path, source_stamp, chunk_size, -(-size // chunk_size), **kwargs)
+        try:
+            with open(transfer.sidecar_path, 'rb') as fh:
+                state = orjson.loads(fh.read())
+        except FileNotFoundError:
+            state = None
+        except (OSError, orjson.JSONDecodeError) as exc:
+            log.warning(f'Unreadable partial transfer record {transfer.sidecar_path} ({exc!r}), starting over')
+            state = None
+        if (
+            state is not None and source_stamp is not None and
+            state.get('version') == PARTIAL_TRANSFER_VERSION and
+            state.get('source') == source_stamp and
+            state.get('chunk_size') == chunk_size and
+            len(state.get('chunks', ())) == len(transfer.chunks) and
+            transfer._partial_exists()
+        ):
+            transfer.chunks = state['chunks']
+        else:
+            transfer.discard()
+        return transfer
+
+    def _partial_exists(self):
+        return os.path.exists(self.partial_path)
+
+    def _save(self):
+        if self.source_stamp is None:
+            return
+        state = {
+            'version': PARTIAL_TRANSFER_VERSION,
+            'source': self.source_stamp,
+            'chunk_size': self.chunk_size,
+            'chunks': self.chunks,
+        }
+        tmp_path = f'{self.sidecar_path}.tmp'
+        with open(tmp_path, 'wb') as fh:
+            fh.write(orjson.dumps(state))
+        os.replace(tmp_path, self.sidecar_path)
+
+    def record(self, idx, md5):
+        '''Note that chunk `idx` has been written with digest `md5`'''
+        with self._lock:
+            if idx >= len(self.chunks):
+                # source grew while being copied
+                return
+            self.chunks[idx] = md5
+            self._save()
+
+    def verified(self, fd, idx, length):
+        '''Whether chunk `idx` (of `length` bytes) of open partial
+        file `fd` was recorded and still has the recorded digest
+        '''
+        md5 = self.chunks[idx]
+        return md5 is not None and _local_range_md5(fd, idx * self.chunk_size, length) == md5
+
+    def verified_prefix(self, fd, hash_name='md5'):
+        '''Length in bytes of the leading run of recorded chunks in
+        open partial file `fd` whose contents still match, and a
+        `hash_name` hasher that has been fed those bytes
+        '''
+        hasher = hashlib.new(hash_name)
+        offset = 0
+        for md5 in self.chunks:
+            if md5 is None:
+                break
+            candidate = hasher.copy()
+            if _local_range_md5(fd, offset, self.chunk_size, candidate) != md5:
+                break
+            hasher = candidate
+            offset += self.chunk_size
+        return offset, hasher
+
+    def complete(self):
+        '''Move the finished data into place and forget the record'''
+        os.replace(self.partial_path, self.dest_path)
+        if os.path.exists(self.sidecar_path):
+            os.remove(self.sidecar_path)
+
+    def discard(self):
+        for path in (self.partial_path, self.sidecar_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+def _irods_partial_path(irods_path):
+    dirname, name = posixpath.split(irods_path)
+    return posixpath.join(dirname, f'.{name}{PARTIAL_SUFFIX}')
+
+def _irods_replace(fs, path, irods_path):
+    '''Move data object `path` to `irods_path`. iRODS won't move onto
+    an existing data object, so one already there is first moved
+    aside (and put back if the move fails) and removed afterwards,
+    leaving `irods_path` missing only between two renames.
+    '''
+    data_objects = fs.session.data_objects
+    if not data_objects.exists(irods_path):
+        data_objects.move(path, irods_path)
+    else:
+        dirname, name = posixpath.split(irods_path)
+        old_path = posixpath.join(dirname, f'.{name}.dap_replaced')
+        if data_objects.exists(old_path):
+            data_objects.unlink(old_path, force=True)
+        data_objects.move(irods_path, old_path)
+        try:
+            data_objects.move(path, irods_path)
+        except BaseException:
+            data_objects.move(old_path, irods_path)
+            raise
+        data_objects.unlink(old_path, force=True)
+    fs.invalidate_cache(fs._parent(irods_path))
+
+class IRODSPartialTransfer(PartialTransfer):
+    '''`PartialTransfer` of an upload to the iRODS data object
+    `dest_path` on `fs`: the data go to a hidden partial data object
+    beside it, and the record is kept in the local cache directory.
+
+    Recorded chunks aren't read back to verify them, which would mean
+    downloading them; instead the server's checksum of the whole
+    partial object is compared with the source before `complete`.
+    '''
+    def __init__(self, dest_path, source_stamp, chunk_size, n_chunks, fs=None):
+        super().__init__(dest_path, source_stamp, chunk_size, n_chunks)
+        self.fs = fs
+        self.partial_path = _irods_partial_path(dest_path)
+        key = hashlib.md5(_block_index_key(fs, dest_path).encode('utf8')).hexdigest()
+        self.sidecar_path = os.path.join(get_config().CACHE_DIR, 'partial_uploads', f'{key}.json')
+        os.makedirs(os.path.dirname(self.sidecar_path), exist_ok=True)
+
+    def _partial_exists(self):
+        return self.fs.session.data_objects.exists(self.partial_path)
+
+    def complete(self):
+        _irods_replace(self.fs, self.partial_path, self.dest_path)
+        if os.path.exists(self.sidecar_path):
+            os.remove(self.sidecar_path)
+
+    def discard(self):
+        if self._partial_exists():
+            self.fs.session.data_objects.unlink(self.partial_path, force=True)
+        if os.path.exists(self.sidecar_path):
+            os.remove(self.sidecar_path)
+
+def _block_index_key(fs, path):
+    session = fs.session
+    return f'irods://{session.host}:{session.port}{fs._strip_protocol(path)}'
+
+def _record_block_digests(fs, path, md5, digests, block_size=DELTA_BLOCK_SIZE):
+    '''Keep the block MD5s of what was just written to `path` on a
+    remote `fs`, for a later `delta_copy` to it
+    '''
+    if is_irods(fs):
+        cache.get_block_digest_index().record(_block_index_key(fs, path), md5, block_size, digests)
+
+def _local_md5_and_blocks(local_path, block_size=DELTA_BLOCK_SIZE):
+    st = os.stat(local_path)
+    with open(local_path, 'rb') as fh:
+        _, md5, digests = utils.block_md5sums(fh, block_size)
+    cache.get_checksum_index().record(local_path, md5, stat_result=st)
+    return md5, digests
+
+def _part_ranges(size, part_size):
+    return [(offset, min(part_size, size - offset)) for offset in range(0, size, part_size)]
+
+def _supports_ranged_transfer(srcfs, destfs):
+    if isinstance(srcfs, LocalFileSystem) and is_irods(destfs):
+        return True
+    return isinstance(destfs, LocalFileSystem)
+
+def _copy_part_to_irods(src, src_fh, dest_fh, offset, length):
+    hasher = hashlib.md5()
+    src_fh.seek(offset)
+    dest_fh.seek(offset)
+    remaining = length
+    while remaining > 0:
+        data = src_fh.read(min(utils.DEFAULT_CHUNK_SIZE, remaining))
+        if not data:
+            raise IOError(f'Short read of {src} at {offset}: {length - remaining} of {length} bytes')
+        hasher.update(data)
+        dest_fh.write(data)
+        remaining -= len(data)
+    return hasher.hexdigest()
+
+def _irods_partial_upload(src, srcfs, dest, destfs, size, part_size, n_threads):
+    '''Upload local `src` to iRODS in `part_size` parts through an
+    `IRODSPartialTransfer`, so an interrupted upload sends only the
+    parts it hadn't finished when retried. Parts are written on
+    `n_threads` threads, each with its own handle on the partial
+    object's replica (as the iRODS client's multi-threaded put does),
+    while the local file's MD5 and block digests (for `delta_copy`)
+    are computed on another. The server's checksum of the result is
+    registered and compared with the MD5 before it replaces `dest`.
+    '''
+    from irods import keywords as irods_kw
+    data_objects = destfs.session.data_objects
+    local_path = srcfs._strip_protocol(src)
+    irods_path = destfs._strip_protocol(dest)
+    transfer = IRODSPartialTransfer.open(irods_path, _source_stamp(srcfs, src, size), size, part_size, fs=destfs)
+    parts = [
+        (idx, offset, length)
+        for idx, (offset, length) in enumerate(_part_ranges(size, part_size))
+        if transfer.chunks[idx] is None
+    ]
+    if len(parts) < len(transfer.chunks):
+        log.info(f'Resuming upload of {src} to {dest} with {len(parts)} of {len(transfer.chunks)} parts left')
+    n_threads = max(1, min(n_threads, len(parts)))
+    options = {irods_kw.NUM_THREADS_KW: str(n_threads), irods_kw.DATA_SIZE_KW: str(size)}
+
+    def upload_parts(thread_parts, part_options):
+        with data_objects.open(
+            transfer.partial_path, 'a', create=False, finalize_on_close=False, allow_redirect=False, **part_options
+        ) as dest_fh, open(local_path, 'rb') as src_fh:
+            for idx, offset, length in thread_parts:
+                transfer.record(idx, _copy_part_to_irods(src, src_fh, dest_fh, offset, length))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_threads + 1) as executor:
+        local_md5 = executor.submit(_local_md5_and_blocks, local_path)
+        # the first handle finalizes the replica when closed, after the
+        # others are done with it
+        mode = 'a' if any(transfer.chunks) else 'w'
+        with data_objects.open(transfer.partial_path, mode, **options) as main_fh:
+            replica_token, resc_hier = main_fh.raw.replica_access_info()
+            part_options = dict(options, **{
+                irods_kw.RESC_HIER_STR_KW: resc_hier,
+                irods_kw.REPLICA_TOKEN_KW: replica_token,
+            })
+            futures = [
+                executor.submit(upload_parts, parts[i::n_threads], part_options)
+                for i in range(n_threads)
+            ]
+            for future in futures:
+                future.result()
+        digest, block_digests = local_md5.result()
+    dest_checksum = data_objects.chksum(transfer.partial_path, **{irods_kw.FORCE_CHKSUM_KW: ''})
+    if dest_checksum and _MD5_HEX_RE.match(dest_checksum) and dest_checksum != digest:
+        transfer.discard()
+        raise ChecksumMismatchError(
+            f'Uploaded {src} to {dest} but destination checksum '
+            f'{dest_checksum} != {digest}'
+        )
+    transfer.complete()
+    _record_block_digests(destfs, dest, digest, block_digests)
+    return digest
+
+def _copy_part_to_local(src, srcfs, dest_fd, offset, length, transfer, idx):
+    if transfer.verified(dest_fd, idx, length):
+        log.debug(f'Part of {src} at {offset} already copied')
+        return transfer.chunks[idx]
+    hasher = hashlib.md5()
+    position = offset
+    with srcfs.open(src, 'rb') as src_fh:
+        src_fh.seek(offset)
+        while position < offset + length:
+            data = src_fh.read(min(utils.DEFAULT_CHUNK_SIZE, offset + length - position))
+            if not data:
+                raise IOError(f'Short read of {src} at {offset}: {position - offset} of {length} bytes')
+            hasher.update(data)
+            written = os.pwrite(dest_fd, data, position)
+            if written != len(data):
+                raise IOError(f'Short write at {position}: {written} of {len(data)} bytes')
+            position += written
+    part_md5 = hasher.hexdigest()
+    if _local_range_md5(dest_fd, offset, length) != part_md5:
+        raise ChecksumMismatchError(f'Part of {src} at {offset} did not read back intact')
+    transfer.record(idx, part_md5)
+    return part_md5
+
+def copy_ranged(
+    src: str, srcfs: fsspec.spec.AbstractFileSystem,
+    dest: str, destfs: fsspec.spec.AbstractFileSystem,
+    size=None, part_size=RANGED_TRANSFER_PART_SIZE,
+    n_threads=RANGED_TRANSFER_THREADS
+):
+    '''Copy `src` to `dest` as parts transferred in parallel, for
+    large files where a single stream can't use the available
+    bandwidth.
+
+    Local files going to iRODS are written on `n_threads` threads to a
+    hidden partial data object that replaces `dest` once its checksum
+    is verified (see `_irods_partial_upload`). Anything going to a
+    local destination is fetched as
+    byte ranges (streamed from a seek in chunks of
+    `utils.DEFAULT_CHUNK_SIZE`) on `n_threads` threads and written in
+    place with `os.pwrite`, each part's MD5 being checked against what
+    was written. Either way the parts go to a
+    `PartialTransfer`, so parts already copied by an interrupted
+    attempt are kept rather than transferred again.
+
+    Returns
+    -------
+    digest : str or None
+        MD5 hex digest of the whole file when the transfer
+        established one (uploads to iRODS), otherwise None
+    '''
+    if not _supports_ranged_transfer(srcfs, destfs):
+        raise NotImplementedError(f'No parallel transfer from {srcfs} to {destfs}')
+    size = srcfs.size(src) if size is None else size
+    if is_irods(destfs):
+        log.debug(f'Multi-threaded upload of {src} ({size} B) to {dest} in parts of {part_size} B')
+        return _irods_partial_upload(src, srcfs, dest, destfs, size, part_size, n_threads)
+    dest_path = destfs._strip_protocol(dest)
+    log.debug(f'Ranged copy of {src} ({size} B) to {dest_path} in parts of {part_size} B')
+    transfer = PartialTransfer.open(dest_path, _source_stamp(srcfs, src, size), size, part_size)
+    dest_fd = os.open(transfer.partial_path, os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+        os.ftruncate(dest_fd, size)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=n_threads) as executor:
+            futures = [
+                executor.submit(_copy_part_to_local, src, srcfs, dest_fd, offset, length, transfer, idx)
+                for idx, (offset, length) in enumerate(_part_ranges(size, part_size))
+            ]
+            for future in futures:
+                future.result()
+    finally:
+        os.close(dest_fd)
+    transfer.complete()
+    return None
+
+def _copy_resumable(src, srcfs, dest_path, hash_name, size, chunk_size):
+    '''Stream `src` to local `dest_path` through a `PartialTransfer`,
+    continuing after the verified prefix left by an interrupted
+    attempt, and return the digest of the whole file
+    '''
+    transfer = PartialTransfer.open(dest_path, _source_stamp(srcfs, src, size), size, chunk_size)
+    fd = os.open(transfer.partial_path, os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+        offset, hasher = transfer.verified_prefix(fd, hash_name)
+        os.ftruncate(fd, offset)
+        if offset:
+            log.info(f'Resuming copy of {src} to {dest_path} after {offset} B')
+        with srcfs.open(src, 'rb') as src_fh, open(fd, 'r+b', closefd=False) as dest_fh:
+            def chunk_written(idx, md5):
+                dest_fh.flush()
+                transfer.record(idx, md5)
+            chunk_hasher = utils.BlockHasher(chunk_size, on_block=chunk_written, first_block=offset // chunk_size)
+            src_fh.seek(offset)
+            dest_fh.seek(offset)
+            for chunk in utils.read_in_chunks(src_fh):
+                hasher.update(chunk)
+                dest_fh.write(chunk)
+                chunk_hasher.update(chunk)
+    finally:
+        os.close(fd)
+    transfer.complete()
+    return hasher.hexdigest()
 
 def copy_between_filesystems(
-    src: str, srcfs: fsspec.spec.AbstractFileSystem, 
-    dest: str, destfs: fsspec.spec.AbstractFileSystem
+    src: str, srcfs: fsspec.spec.AbstractFileSystem,
+    dest: str, destfs: fsspec.spec.AbstractFileSystem,
+    hash_name='md5', verify=True,
+    size=None, ranged_threshold=RANGED_TRANSFER_THRESHOLD,
+    resume_chunk_size=RESUME_CHUNK_SIZE
 ):
+    '''Stream the bytes of `src` on `srcfs` to `dest` on `destfs`,
+    computing a digest of the stream as it's copied so the data
+    are only read once.
+
+    When the digest is MD5 it is recorded in the local checksum index
+    for whichever side(s) are local files, and (if `verify` is True)
+    compared against the checksum the destination filesystem reports
+    for the new file, if it reports one.
+
+    Files of at least `ranged_threshold` bytes are transferred in
+    parallel parts with `copy_ranged` when the pair of filesystems
+    supports it, and streamed otherwise.
+
+    Copies to local files are resumable: they are written to a
+    temporary file and moved into place when complete (see
+    `PartialTransfer`), so if one is interrupted the next attempt
+    checks what was already written and continues from there. So are
+    MD5-hashed uploads of local files of more than one chunk to iRODS
+    (see `_irods_partial_upload`); smaller ones are written directly,
+    as resuming them would gain nothing.
+
+    Parameters
+    ----------
+    src : str
+    srcfs : fsspec.spec.AbstractFileSystem subclass
+    dest : str
+    destfs : fsspec.spec.AbstractFileSystem subclass
+    hash_name : str (default: 'md5')
+        name of any algorithm supported by `hashlib.new`
+    verify : bool (default: True)
+        whether to compare against the destination's checksum
+    size : int or None
+        size of `src` in bytes, None to obtain from filesystem
+    ranged_threshold : int or None
+        size in bytes from which to use `copy_ranged`, None to
+        always stream
+    resume_chunk_size : int or None
+        size in bytes of the chunks whose progress is recorded for
+        resuming streamed copies to local files, None to write the
+        destination directly (also for uploads to iRODS)
+
+    Returns
+    -------
+    digest : str or None
+        hex digest of the bytes copied (None if a ranged transfer
+        could not establish one)
+
+    Raises
+    ------
+    ChecksumMismatchError
+        if the destination reports a different checksum than
+        was computed from the copied bytes
+    '''
+    if ranged_threshold is not None and _supports_ranged_transfer(srcfs, destfs):
+        size = srcfs.size(src) if size is None else size
+        if size >= ranged_threshold:
+            return copy_ranged(src, srcfs, dest, destfs, size=size)
+    resumable_upload = False
+    if resume_chunk_size is not None and hash_name == 'md5' and isinstance(srcfs, LocalFileSystem) and is_irods(destfs):
+        size = srcfs.size(src) if size is None else size
+        resumable_upload = size > resume_chunk_size
     log.debug(f'Copying {src} from {srcfs} to {dest} on {destfs}')
-    with destfs.open(dest, 'wb') as dest_fh, srcfs.open(src, 'rb') as src_fh:
-        for chunk in utils.read_in_chunks(src_fh):
-            dest_fh.write(chunk)
+    src_stat = os.stat(srcfs._strip_protocol(src)) if isinstance(srcfs, LocalFileSystem) else None
+    # remote destinations' block digests are kept for `delta_copy`
+    keep_blocks = hash_name == 'md5' and is_irods(destfs)
+    block_hasher = utils.BlockHasher(DELTA_BLOCK_SIZE) if keep_blocks else None
+    if resume_chunk_size is not None and isinstance(destfs, LocalFileSystem):
+        size = srcfs.size(src) if size is None else size
+        digest = _copy_resumable(src, srcfs, destfs._strip_protocol(dest), hash_name, size, resume_chunk_size)
+    elif resumable_upload:
+        digest = _irods_partial_upload(src, srcfs, dest, destfs, size, resume_chunk_size, n_threads=1)
+        block_hasher = None
+    else:
+        hasher = hashlib.new(hash_name)
+        with destfs.open(dest, 'wb') as dest_fh, srcfs.open(src, 'rb') as src_fh:
+            for chunk in utils.read_in_chunks(src_fh):
+                hasher.update(chunk)
+                dest_fh.write(chunk)
+                if block_hasher is not None:
+                    block_hasher.update(chunk)
+        digest = hasher.hexdigest()
+    if hash_name == 'md5':
+        if verify:
+            dest_checksum = reported_md5(destfs, dest)
+            if dest_checksum is not None and dest_checksum != digest:
+                raise ChecksumMismatchError(
+                    f'Copied {src} to {dest} but destination checksum '
+                    f'{dest_checksum} != {digest}'
+                )
+        _record_local_checksum(srcfs, src, digest, stat_result=src_stat)
+        _record_local_checksum(destfs, dest, digest)
+        if block_hasher is not None:
+            _record_block_digests(destfs, dest, digest, block_hasher.finish())
+    return digest
+
+def _supports_delta(srcfs, destfs):
+    # only where the unchanged blocks needn't cross the network
+    if isinstance(srcfs, LocalFileSystem):
+        return is_irods(destfs)
+    return is_irods(srcfs) and isinstance(destfs, LocalFileSystem)
+
+def _read_blocks(fh, block_size):
+    while True:
+        block = fh.read(block_size)
+        if not block:
+            return
+        yield block
+
+def _delta_copy_to_local(src, srcfs, dest_path, size, src_md5, block_size):
+    src_digests = cache.get_block_digest_index().lookup(_block_index_key(srcfs, src), src_md5, block_size)
+    if src_digests is None or len(src_digests) != -(-size // block_size):
+        log.debug(f'No block digests for {src} with checksum {src_md5}')
+        return None
+    transfer = PartialTransfer(dest_path, None, block_size, 0)
+    transfer.discard()
+    # the old file is patched behind the rename rather than copied
+    os.replace(dest_path, transfer.partial_path)
+    written = 0
+    fd = os.open(transfer.partial_path, os.O_RDWR)
+    try:
+        with srcfs.open(src, 'rb') as src_fh:
+            for idx, src_digest in enumerate(src_digests):
+                offset = idx * block_size
+                length = min(block_size, size - offset)
+                if _local_range_md5(fd, offset, length) == src_digest:
+                    continue
+                src_fh.seek(offset)
+                block = src_fh.read(length)
+                if len(block) != length:
+                    raise IOError(f'Short read of {src} at {offset}: {len(block)} of {length} bytes')
+                os.pwrite(fd, block, offset)
+                written += length
+        os.ftruncate(fd, size)
+        new_digest = _local_range_md5(fd, 0, size)
+        if new_digest != src_md5:
+            raise ChecksumMismatchError(
+                f'Delta update of {dest_path} from {src} has checksum {new_digest} != {src_md5}'
+            )
+    except BaseException:
+        os.close(fd)
+        transfer.discard()
+        raise
+    os.close(fd)
+    transfer.complete()
+    return src_md5, written
+
+def _delta_copy_to_irods(src, srcfs, dest, destfs, dest_md5, block_size):
+    from irods import keywords as irods_kw
+    key = _block_index_key(destfs, dest)
+    dest_digests = cache.get_block_digest_index().lookup(key, dest_md5, block_size)
+    if dest_digests is None:
+        log.debug(f'No block digests for {dest} with checksum {dest_md5}')
+        return None
+    local_path = srcfs._strip_protocol(src)
+    irods_path = destfs._strip_protocol(dest)
+    src_stat = os.stat(local_path)
+    hasher = hashlib.md5()
+    digests = []
+    written = 0
+    with open(local_path, 'rb') as src_fh, destfs.session.data_objects.open(irods_path, 'r+') as dest_fh:
+        for idx, block in enumerate(_read_blocks(src_fh, block_size)):
+            hasher.update(block)
+            digests.append(hashlib.md5(block).hexdigest())
+            if idx >= len(dest_digests) or digests[-1] != dest_digests[idx]:
+                dest_fh.seek(idx * block_size)
+                dest_fh.write(block)
+                written += len(block)
+    digest = hasher.hexdigest()
+    dest_checksum = destfs.session.data_objects.chksum(irods_path, **{irods_kw.FORCE_CHKSUM_KW: ''})
+    destfs.invalidate_cache(destfs._parent(irods_path))
+    if dest_checksum and _MD5_HEX_RE.match(dest_checksum) and dest_checksum != digest:
+        raise ChecksumMismatchError(
+            f'Delta update of {dest} from {src} left destination checksum '
+            f'{dest_checksum} != {digest}'
+        )
+    cache.get_block_digest_index().record(key, digest, block_size, digests)
+    _record_local_checksum(srcfs, src, digest, stat_result=src_stat)
+    return digest, written
+
+def delta_copy(
+    src: str, srcfs: fsspec.spec.AbstractFileSystem,
+    dest: str, destfs: fsspec.spec.AbstractFileSystem,
+    size=None, dest_size=None, dest_md5=None, src_md5=None,
+    block_size=DELTA_BLOCK_SIZE
+):
+    '''Update the existing `dest` to match `src` by writing only
+    the `block_size` blocks whose MD5s differ, rsync-style, for large
+    files of which only a part (e.g. a FITS header) has changed.
+
+    Only done where it saves sending the unchanged blocks over the
+    network, between a local file and iRODS. The iRODS side is never
+    read to find which blocks changed: its block digests are those
+    recorded in the `cache.BlockDigestIndex` when the file was last
+    sent there, trusted while the object's checksum is still
+    `dest_md5` (or `src_md5`, for a source; looked up if not given).
+
+    iRODS destinations have the changed blocks written in place and
+    the server asked to checksum the result. Local destinations are
+    moved aside (see `PartialTransfer`), have the changed blocks
+    fetched from the source written into them, and are moved back
+    once their checksum matches the source's.
+
+    Returns
+    -------
+    result : (str, int) or None
+        MD5 hex digest of the new contents and the number of bytes
+        written, or None if the destination must be copied whole
+        instead (the iRODS side's block digests are unknown, or an
+        iRODS destination is of a different size)
+
+    Raises
+    ------
+    ChecksumMismatchError
+        if the updated destination's checksum isn't the source's
+    '''
+    if not _supports_delta(srcfs, destfs):
+        raise NotImplementedError(f'No delta transfer from {srcfs} to {destfs}')
+    size = srcfs.size(src) if size is None else size
+    if isinstance(destfs, LocalFileSystem):
+        src_md5 = reported_md5(srcfs, src) if src_md5 is None else src_md5
+        log.debug(f'Delta copy of {src} to {dest} in blocks of {block_size} B')
+        result = _delta_copy_to_local(src, srcfs, destfs._strip_protocol(dest), size, src_md5, block_size)
+        if result is not None:
+            _record_local_checksum(destfs, dest, result[0])
+        return result
+    dest_size = destfs.size(dest) if dest_size is None else dest_size
+    if dest_size != size:
+        return None
+    dest_md5 = reported_md5(destfs, dest) if dest_md5 is None else dest_md5
+    return _delta_copy_to_irods(src, srcfs, dest, destfs, dest_md5, block_size)
+
+def _checksum_file(fs, path, checksum, file_metrics):
+    '''Apply `checksum` to the file at `path`, using the persistent
+    local checksum index to skip re-reading unchanged local files
+    when the checksum is `utils.md5sum` (and having iRODS checksum
+    its own data objects, see `server_md5`), and counting the bytes
+    and time spent reading in `file_metrics`
+    '''
+    if checksum is utils.md5sum and is_irods(fs):
+        with file_metrics.timing('checksum_seconds'):
+            md5 = server_md5(fs, path)
+        if md5 is not None:
+            return md5
+    if checksum is utils.md5sum and isinstance(fs, LocalFileSystem):
+        index = cache.get_checksum_index()
+        local_path = fs._strip_protocol(path)
+        md5 = index.lookup(local_path)
+        if md5 is not None:
+            return md5
+        with file_metrics.timing('checksum_seconds'):
+            size, md5 = index.size_and_md5sum(local_path)
+        file_metrics.bytes_hashed += size
+        return md5
+    with file_metrics.timing('checksum_seconds'):
+        with fs.open(path) as fh:
+            digest = checksum(fh)
+    file_metrics.bytes_hashed += fs.size(path)
+    return digest
 
 def sync_single_file(
     src, dest,
     src_checksum=None, src_size=None, srcfs=None,
     dest_checksum=None, dest_size=None, destfs=None,
     checksum=utils.md5sum,
-    force_overwrite=False
+    force_overwrite=False,
+    delta=False,
+    metrics=None,
+    dest_exists=None
 ):
     '''Sync the file at path `dest` so that it contains the same bytes
     as `src`. The decision of whether to update `dest` depends on both
@@ -91,19 +945,26 @@ def sync_single_file(
     either `src_checksum` and `dest_checksum` (passed in by the caller
     for the same reasons) or recomputed with `checksum`
     (`utils.md5sum` by default). When the checksums differ, `dest` will
-    be overwritten with `src`.
+    be overwritten with `src`. MD5 sums of local files are looked up in
+    (and recorded to) the persistent `cache.ChecksumIndex`, so
+    unchanged files are not re-read on every sync.
 
     If `force_overwrite` is `True`, `dest` will be overwritten with
     `src` regardless.
 
+    If `delta` is `True` and `dest` already exists, only the blocks of
+    it that differ from `src` are rewritten where possible (see
+    `delta_copy`).
+
     Note: `fsspec.AbstractFileSystem.checksum` depends on the particular
     remote filesystem implementation, and may not be comparable between
     two different ones. This is why the caller must choose to pass them
     in.
 
-    Note: If both `src` and `dest` are remote, the same size, and no
-    checksum is provided, they will both be downloaded and checksummed
-    locally to decide whether to sync. This may ultimately use more
+    Note: If `src` and `dest` are the same size and no checksum is
+    provided, iRODS computes the MD5 of its side on the server (see
+    `server_md5`). Other remote files are downloaded and checksummed
+    locally to decide whether to sync, which may ultimately use more
     bandwidth and be slower than blindly overwriting.
     
     Parameters
@@ -125,53 +986,774 @@ def sync_single_file(
         and returning a string
     force_overwrite : bool
         short-circuit the comparisons and just overwrite
+    delta : bool
+        send only changed blocks of files that exist at `dest`
+    metrics : metrics.FileMetrics or None
+        record of bytes and time spent checksumming and copying to
+        update
+    dest_exists : bool or None
+        whether `dest` exists, if already known (e.g. from a listing),
+        to save a network call when `dest_size` isn't given
     '''
+    metrics = FileMetrics(src, 'sync') if metrics is None else metrics
     srcfs = get_fs(src) if srcfs is None else srcfs
     destfs = get_fs(dest) if destfs is None else destfs
     if src_size is None:
         src_size = srcfs.size(src)
-    if dest_size is None and destfs.exists(dest):
+    if dest_size is None and dest_exists is None:
+        dest_exists = destfs.exists(dest)
+    if dest_size is None and dest_exists:
         dest_size = destfs.size(dest)
     overwrite = True
     if not force_overwrite and src_size == dest_size:
         if src_checksum is None:
-            src_fh = srcfs.open(src)
-            src_checksum = checksum(src_fh)
+            src_checksum = _checksum_file(srcfs, src, checksum, metrics)
         if dest_checksum is None:
-            dest_fh = destfs.open(dest)
-            dest_checksum = checksum(dest_fh)
+            dest_checksum = _checksum_file(destfs, dest, checksum, metrics)
         if src_checksum == dest_checksum:
             overwrite = False
     overwrite = overwrite or force_overwrite
     if overwrite:
-        if srcfs is destfs:
-            log.debug(f'Copying {src} to {dest} with {srcfs}')
-            srcfs.copy(src, dest)
-        else:
-            copy_between_filesystems(
-                src, srcfs,
-                dest, destfs
-            )
+        with metrics.timing('copy_seconds'):
+            result = None
+            if delta and dest_size is not None and _supports_delta(srcfs, destfs):
+                result = delta_copy(
+                    src, srcfs,
+                    dest, destfs,
+                    size=src_size, dest_size=dest_size,
+                    dest_md5=dest_checksum if checksum is utils.md5sum else None,
+                    src_md5=src_checksum if checksum is utils.md5sum else None
+                )
+            if result is not None:
+                digest, bytes_sent = result
+            elif srcfs is destfs and not isinstance(destfs, LocalFileSystem):
+                log.debug(f'Copying {src} to {dest} with {srcfs}')
+                srcfs.copy(src, dest)
+                digest, bytes_sent = None, src_size
+            else:
+                # (local copies too, so they can resume when interrupted)
+                digest = copy_between_filesystems(
+                    src, srcfs,
+                    dest, destfs,
+                    size=src_size,
+                    resume_chunk_size=RESUME_CHUNK_SIZE
+                )
+                bytes_sent = src_size
+        metrics.bytes_transferred += bytes_sent
+        if checksum is utils.md5sum and None not in (src_checksum, digest) and digest != src_checksum:
+            log.warning(f'{src} changed while being copied (checksum {src_checksum} before, {digest} during copy)')
     else:
         log.debug(f'Skipping {src=} {src_size=} {src_checksum=} / {dest=} {dest_size=} {dest_checksum=}')
+        metrics.skipped = True
     return overwrite
 
-def _filenames_lookup(fs, path):
-    contents = fs.ls(path, detail=True)
-    files = {}
-    for entry in contents:
-        if name_is_ignored(entry['name']):
+def _is_ignored_relpath(relpath):
+    return any(name_is_ignored(part) for part in pathlib.PurePosixPath(relpath).parts)
+
+def _irods_iter_listing(fs, root):
+    '''Bulk catalog queries for everything under collection `root`,
+    fetched in pages of rows rather than one request per collection
+    '''
+    from irods.models import Collection, DataObject
+    from irods.column import Like
+    def in_tree(coll_name):
+        return coll_name == root or coll_name.startswith(root + '/')
+    collections = fs.session.query(Collection.name).filter(Like(Collection.name, f'{root}/%'))
+    for batch in collections.get_batches():
+        for row in batch:
+            coll_name = row[Collection.name]
+            if in_tree(coll_name):
+                yield coll_name, {'name': coll_name, 'size': 0, 'type': 'directory'}
+    seen = set()
+    for criterion in (Collection.name == root, Like(Collection.name, f'{root}/%')):
+        data_objects = fs.session.query(
+            Collection.name, DataObject.name, DataObject.size, DataObject.checksum, DataObject.modify_time
+        ).filter(criterion)
+        for batch in data_objects.get_batches():
+            for row in batch:
+                coll_name = row[Collection.name]
+                path = f'{coll_name}/{row[DataObject.name]}'
+                # one row per replica
+                if not in_tree(coll_name) or path in seen:
+                    continue
+                seen.add(path)
+                yield path, {
+                    'name': path,
+                    'size': row[DataObject.size],
+                    'type': 'file',
+                    'checksum': row[DataObject.checksum],
+                    'mtime': row[DataObject.modify_time],
+                }
+
+def _walk_iter_listing(fs, root):
+    for dirpath, dirs, files in fs.walk(root, detail=True):
+        for entry in dirs.values():
+            yield entry['name'], entry
+        for entry in files.values():
+            yield entry['name'], entry
+
+def iter_listing(fs, root):
+    '''Recursively list everything under `root` on `fs`, yielding
+    `(relpath, entry)` pairs as they are found, where entries are
+    detailed fsspec listing dicts (with 'name', 'size', 'type', and for
+    iRODS 'checksum' and 'mtime'). Paths with ignored components are
+    skipped.
+
+    iRODS trees are listed with a few paginated bulk catalog queries,
+    other filesystems with `walk`.
+    '''
+    root = root.rstrip('/') or '/'
+    if is_irods(fs):
+        listing = _irods_iter_listing(fs, root)
+    else:
+        listing = _walk_iter_listing(fs, root)
+    for path, entry in listing:
+        relpath = str(pathlib.PurePosixPath(path).relative_to(root))
+        if relpath == '.' or _is_ignored_relpath(relpath):
             continue
-        if entry['type'] == 'file':
-            key = os.path.basename(entry['name'])
-            files[key] = entry
-    return files
+        yield relpath, entry
+
+def list_tree(fs, root):
+    '''Index of `iter_listing(fs, root)` by relative path, or an
+    empty one if `root` doesn't exist
+
+    (Not checked for with `exists` first, as directories are only
+    implied by the files in them on some filesystems, e.g. object
+    stores.)
+    '''
+    try:
+        return dict(iter_listing(fs, root))
+    except FileNotFoundError:
+        return {}
+
+def _sync_file_task(src, dest, src_file_path, dest_file_path, **kwargs):
+    '''Run `sync_single_file` on a worker thread, using filesystem
+    instances checked out from the pool (see `checkout_fs`) for the
+    root `src` and `dest` URLs rather than the ones used for listing
+    '''
+    with checkout_fs(src) as srcfs, checkout_fs(dest) as destfs:
+        return sync_single_file(
+            src_file_path,
+            dest_file_path,
+            srcfs=srcfs,
+            destfs=destfs,
+            **kwargs
+        )
+
+class SyncAction(Enum):
+    MKDIR = 'mkdir'
+    NEW = 'new'
+    CHANGED_SIZE = 'changed_size'
+    CHANGED_CHECKSUM = 'changed_checksum'
+    NEEDS_CHECKSUM = 'needs_checksum'
+    IDENTICAL = 'identical'
+    OVERWRITE = 'overwrite'
+    EXTRA = 'extra'
+
+# actions that always mean sending the source file
+TRANSFER_ACTIONS = (SyncAction.NEW, SyncAction.CHANGED_SIZE, SyncAction.CHANGED_CHECKSUM, SyncAction.OVERWRITE)
+
+DEFAULT_TRANSFER_RATE = 100e6
+DEFAULT_HASH_RATE = 500e6
+
+@dataclass
+class PlanEntry:
+    relpath: str
+    action: SyncAction
+    src_size: int = None
+    dest_size: int = None
+    src_checksum: str = None
+    dest_checksum: str = None
+    src_mtime: float = None
+
+    @property
+    def bytes_to_hash(self):
+        if self.action is not SyncAction.NEEDS_CHECKSUM:
+            return 0
+        return (
+            (self.src_size if self.src_checksum is None else 0) +
+            (self.dest_size if self.dest_checksum is None else 0)
+        )
+
+@dataclass
+class SyncPlan:
+    '''What `sync` would do to make `dest` match `src`, one `PlanEntry`
+    per directory to create and per file on either side, classified
+    by `SyncAction`.
+
+    Plans are built by `make_sync_plan` from the two listings, can be
+    saved to and loaded from JSON, split into parts of similar cost to
+    run on different workers, and carried out by `execute_sync_plan`.
+    '''
+    src: str
+    dest: str
+    src_path: str
+    dest_path: str
+    entries: list
+
+    def summary(self):
+        '''Counts and bytes for each action, plus the bytes that must
+        be transferred (at least, and at most, depending on how the
+        checksums that still need computing turn out) and hashed
+        '''
+        totals = {action.value: {'count': 0, 'bytes': 0} for action in SyncAction}
+        bytes_to_transfer = bytes_to_hash = bytes_to_check = 0
+        for entry in self.entries:
+            size = entry.dest_size if entry.action is SyncAction.EXTRA else entry.src_size
+            totals[entry.action.value]['count'] += 1
+            totals[entry.action.value]['bytes'] += size or 0
+            if entry.action in TRANSFER_ACTIONS:
+                bytes_to_transfer += entry.src_size
+            elif entry.action is SyncAction.NEEDS_CHECKSUM:
+                bytes_to_check += entry.src_size
+            bytes_to_hash += entry.bytes_to_hash
+        return {
+            'actions': totals,
+            'bytes_to_transfer': bytes_to_transfer,
+            'bytes_to_transfer_max': bytes_to_transfer + bytes_to_check,
+            'bytes_to_hash': bytes_to_hash,
+        }
+
+    def estimate_seconds(self, transfer_rate=DEFAULT_TRANSFER_RATE, hash_rate=DEFAULT_HASH_RATE):
+        '''Rough (serial) time to carry out the plan given rates in
+        bytes per second, as a (best case, worst case) pair
+        '''
+        summary = self.summary()
+        hashing = summary['bytes_to_hash'] / hash_rate
+        return (
+            summary['bytes_to_transfer'] / transfer_rate + hashing,
+            summary['bytes_to_transfer_max'] / transfer_rate + hashing,
+        )
+
+    def to_dict(self):
+        return dataclasses.asdict(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        entries = [
+            PlanEntry(**dict(entry, action=SyncAction(entry['action'])))
+            for entry in data['entries']
+        ]
+        return cls(**dict(data, entries=entries))
+
+    def save(self, path):
+        with open(path, 'wb') as fh:
+            fh.write(orjson.dumps(self.to_dict()))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as fh:
+            return cls.from_dict(orjson.loads(fh.read()))
+
+    def split(self, n_parts):
+        '''Divide the file entries into `n_parts` plans of roughly
+        equal bytes to transfer or hash (each part creates all the
+        directories, so parts can run in any order)
+        '''
+        dirs = [entry for entry in self.entries if entry.action is SyncAction.MKDIR]
+        files = [entry for entry in self.entries if entry.action is not SyncAction.MKDIR]
+        parts = [[] for _ in range(n_parts)]
+        costs = [0] * n_parts
+        def cost(entry):
+            return (entry.src_size if entry.action in TRANSFER_ACTIONS else 0) + entry.bytes_to_hash
+        for entry in sorted(files, key=cost, reverse=True):
+            idx = costs.index(min(costs))
+            parts[idx].append(entry)
+            costs[idx] += cost(entry)
+        return [dataclasses.replace(self, entries=dirs + part) for part in parts]
+
+SYNC_MANIFEST_NAME = '.dap_sync_manifest.json'
+SYNC_MANIFEST_VERSION = 1
+# number of manifest entries compared with the destination before
+# trusting the rest
+MANIFEST_SPOT_CHECKS = 16
+
+def _entry_mtime(entry):
+    mtime = entry.get('mtime')
+    if isinstance(mtime, datetime.datetime):
+        mtime = mtime.timestamp()
+    return mtime
+
+def _directory_digests(files):
+    '''Digest of the relative paths, sizes and modification times of
+    every file beneath each directory, from a mapping of relative
+    file paths to `(size, mtime)`. Directories with files of unknown
+    modification time beneath them get None.
+    '''
+    hashers = {}
+    unknown = set()
+    for relpath in sorted(files):
+        size, mtime = files[relpath]
+        line = f'{relpath}\t{size}\t{mtime!r}\n'.encode('utf8')
+        reldir = relpath
+        while reldir != '.':
+            reldir = os.path.dirname(reldir) or '.'
+            hashers.setdefault(reldir, hashlib.md5()).update(line)
+            if mtime is None:
+                unknown.add(reldir)
+    return {
+        reldir: None if reldir in unknown else hasher.hexdigest()
+        for reldir, hasher in hashers.items()
+    }
+
+@dataclass
+class SyncManifest:
+    '''Record, kept in `SYNC_MANIFEST_NAME` at the root of a sync
+    destination, of what the last `sync` from `src_path` left there:
+    the size, source modification time and (if known) MD5 of every file
+    it synced, and a digest per directory (see `_directory_digests`).
+
+    With a valid manifest, the next sync reads it instead of listing
+    the destination, treats every file beneath a source directory whose
+    digest is unchanged as identical without comparing them one by one,
+    and treats files whose source size and modification time are
+    unchanged as identical without checksumming them.
+    '''
+    src_path: str
+    files: dict
+    dirs: dict
+
+    @staticmethod
+    def path_on(dest_path):
+        return os.path.join(dest_path, SYNC_MANIFEST_NAME)
+
+    @staticmethod
+    def _files_digest(files):
+        return hashlib.md5(orjson.dumps(files, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+    @classmethod
+    def load(cls, destfs, dest_path, src_path):
+        '''Return the manifest at `dest_path`, or None if there isn't
+        one, it was written by a sync from somewhere else, or it fails
+        validation (a corrupt manifest, or a sample of its files not
+        matching the destination)
+        '''
+        path = cls.path_on(dest_path)
+        try:
+            with destfs.open(path, 'rb') as fh:
+                state = orjson.loads(fh.read())
+        except FileNotFoundError:
+            log.debug(f'No sync manifest at {path}')
+            return None
+        except (OSError, orjson.JSONDecodeError) as exc:
+            log.warning(f'Unreadable sync manifest at {path} ({exc!r}), doing a full scan')
+            return None
+        if state.get('version') != SYNC_MANIFEST_VERSION or state.get('src_path') != src_path:
+            log.info(f'Sync manifest at {path} is for another source or version, doing a full scan')
+            return None
+        if state.get('digest') != cls._files_digest(state.get('files')):
+            log.warning(f'Sync manifest at {path} is corrupt, doing a full scan')
+            return None
+        manifest = cls(src_path, state['files'], state['dirs'])
+        if not manifest.spot_check(destfs, dest_path):
+            log.warning(f'Sync manifest at {path} does not match the destination, doing a full scan')
+            return None
+        return manifest
+
+    def spot_check(self, destfs, dest_path, n_files=MANIFEST_SPOT_CHECKS):
+        '''Whether a random sample of `n_files` recorded files are
+        present on `destfs` with the recorded sizes
+        '''
+        for relpath in random.sample(sorted(self.files), min(n_files, len(self.files))):
+            try:
+                size = destfs.size(os.path.join(dest_path, relpath))
+            except FileNotFoundError:
+                return False
+            if size != self.files[relpath]['size']:
+                return False
+        return True
+
+    def save(self, destfs, dest_path):
+        '''Write the manifest to a temporary file beside its final
+        location and move it into place (removing any existing one
+        first, as iRODS won't rename onto an existing data object)
+        '''
+        state = {
+            'version': SYNC_MANIFEST_VERSION,
+            'src_path': self.src_path,
+            'files': self.files,
+            'dirs': self.dirs,
+            'digest': self._files_digest(self.files),
+        }
+        path = self.path_on(dest_path)
+        tmp_path = f'{path}.tmp'
+        with destfs.open(tmp_path, 'wb') as fh:
+            fh.write(orjson.dumps(state))
+        self.remove(destfs, dest_path)
+        destfs.mv(tmp_path, path)
 
-def sync(src, dest, checksum=utils.md5sum, force_overwrite=False):
+    @classmethod
+    def remove(cls, destfs, dest_path):
+        path = cls.path_on(dest_path)
+        if destfs.exists(path):
+            destfs.rm(path)
+
+    @classmethod
+    def from_entries(cls, src_path, entries, failures=(), checksum=utils.md5sum):
+        '''Manifest of the files in a carried out plan, leaving out
+        `failures` (source file paths) so they are looked at again
+        '''
+        files = {}
+        for entry in entries:
+            if entry.action in (SyncAction.MKDIR, SyncAction.EXTRA):
+                continue
+            if os.path.join(src_path, entry.relpath) in failures:
+                continue
+            md5 = entry.src_checksum if checksum is utils.md5sum else None
+            files[entry.relpath] = {'size': entry.src_size, 'mtime': entry.src_mtime, 'md5': md5}
+        dirs = _directory_digests({
+            relpath: (record['size'], record['mtime'])
+            for relpath, record in files.items()
+        })
+        return cls(src_path, files, dirs)
+
+    def dest_index(self):
+        '''Stand-in for `list_tree` of the destination'''
+        index = {}
+        for relpath, record in self.files.items():
+            index[relpath] = dict(record, type='file')
+            reldir = os.path.dirname(relpath)
+            while reldir and reldir not in index:
+                index[reldir] = {'type': 'directory', 'size': 0}
+                reldir = os.path.dirname(reldir)
+        return index
+
+    def unchanged_dirs(self, src_listing):
+        '''Source directories (relative paths) whose contents have the
+        same digest as when the manifest was written
+        '''
+        src_digests = _directory_digests({
+            relpath: (entry['size'], _entry_mtime(entry))
+            for relpath, entry in src_listing
+            if entry['type'] == 'file'
+        })
+        return {
+            reldir for reldir, digest in src_digests.items()
+            if digest is not None and self.dirs.get(reldir) == digest
+        }
+
+def _plan_inputs(srcfs, src_path, destfs, dest_path, use_manifest=True, metrics=None):
+    '''Source listing, destination index and unchanged source
+    directories for `_plan_entries`, from the destination\'s sync
+    manifest if it has a valid one and from listing it otherwise
+
+    Returns
+    -------
+    src_listing : iterable of (relpath, entry)
+    dest_index : dict
+    unchanged_dirs : set
+    manifest : SyncManifest or None
+    '''
+    metrics = SyncMetrics(keep_files=False) if metrics is None else metrics
+    with metrics.timing('dest_listing_seconds'):
+        manifest = SyncManifest.load(destfs, dest_path, src_path) if use_manifest else None
+        dest_index = list_tree(destfs, dest_path) if manifest is None else manifest.dest_index()
+    src_listing = metrics.timed_iter(iter_listing(srcfs, src_path), 'src_listing_seconds')
+    if manifest is None:
+        return src_listing, dest_index, set(), None
+    # directory digests need the whole source listing up front
+    src_listing = list(src_listing)
+    return src_listing, dest_index, manifest.unchanged_dirs(src_listing), manifest
+
+def _resolve_path(url):
+    res = urlparse(url)
+    return os.path.abspath(res.path) if res.scheme in ('file', '') else res.path
+
+def _index_md5(fs, path):
+    '''MD5 of a local file if the checksum index already has it'''
+    if not isinstance(fs, LocalFileSystem):
+        return None
+    try:
+        return cache.get_checksum_index().lookup(fs._strip_protocol(path))
+    except FileNotFoundError:
+        return None
+
+def _plan_entries(
+    srcfs, src_path, destfs, dest_path, src_listing, dest_index, unchanged_dirs=(),
+    checksum=utils.md5sum, force_overwrite=False
+):
+    '''Compare a (possibly streamed) listing of the source against
+    `dest_index` (see `list_tree` and `SyncManifest.dest_index`),
+    yielding a `PlanEntry` for each directory to create and each file
+    on either side. Files in `unchanged_dirs` are taken to be identical.
+    '''
+    dest_dirs = {relpath for relpath, entry in dest_index.items() if entry['type'] == 'directory'}
+    dest_dirs.add('.')
+    seen = set()
+
+    def missing_dirs(reldir):
+        new_dirs = []
+        while reldir not in dest_dirs:
+            dest_dirs.add(reldir)
+            new_dirs.append(reldir)
+            reldir = os.path.dirname(reldir) or '.'
+        return [PlanEntry(reldir, SyncAction.MKDIR) for reldir in reversed(new_dirs)]
+
+    for relpath, src_entry in src_listing:
+        seen.add(relpath)
+        if src_entry['type'] == 'directory':
+            yield from missing_dirs(relpath)
+            continue
+        yield from missing_dirs(os.path.dirname(relpath) or '.')
+        entry = PlanEntry(relpath, SyncAction.NEW, src_size=src_entry['size'], src_mtime=_entry_mtime(src_entry))
+        dest_entry = dest_index.get(relpath)
+        if dest_entry is None or dest_entry['type'] != 'file':
+            yield entry
+            continue
+        entry.dest_size = dest_entry['size']
+        if force_overwrite:
+            entry.action = SyncAction.OVERWRITE
+        elif entry.src_size != entry.dest_size:
+            entry.action = SyncAction.CHANGED_SIZE
+        elif 'md5' in dest_entry and (
+            (os.path.dirname(relpath) or '.') in unchanged_dirs or
+            (entry.src_mtime is not None and entry.src_mtime == dest_entry['mtime'])
+        ):
+            # unchanged since the last sync recorded it in the manifest
+            entry.action = SyncAction.IDENTICAL
+            entry.src_checksum = entry.dest_checksum = dest_entry['md5']
+        else:
+            if 'checksum' in src_entry and srcfs is destfs:
+                # trust the filesystem's checksums are comparable
+                # regardless of which it is
+                entry.src_checksum = src_entry['checksum']
+                # (manifest entries only have the MD5 recorded)
+                entry.dest_checksum = dest_entry.get('checksum', dest_entry.get('md5'))
+            elif checksum is utils.md5sum:
+                # we know iRODS checksums are md5, otherwise who knows,
+                # and local files may already be in the checksum index
+                entry.src_checksum = (
+                    md5_from_entry(srcfs, src_entry) or
+                    _index_md5(srcfs, os.path.join(src_path, relpath))
+                )
+                entry.dest_checksum = (
+                    dest_entry.get('md5') or
+                    md5_from_entry(destfs, dest_entry) or
+                    _index_md5(destfs, os.path.join(dest_path, relpath))
+                )
+            if entry.src_checksum is None or entry.dest_checksum is None:
+                entry.action = SyncAction.NEEDS_CHECKSUM
+            elif entry.src_checksum == entry.dest_checksum:
+                entry.action = SyncAction.IDENTICAL
+            else:
+                entry.action = SyncAction.CHANGED_CHECKSUM
+        yield entry
+    for relpath, dest_entry in dest_index.items():
+        if relpath not in seen and dest_entry['type'] == 'file':
+            yield PlanEntry(relpath, SyncAction.EXTRA, dest_size=dest_entry['size'])
+
+def make_sync_plan(src, dest, checksum=utils.md5sum, force_overwrite=False, use_manifest=True, metrics=None):
+    '''Build the `SyncPlan` for syncing `src` to `dest` (see `sync`
+    for the arguments) from one listing of each (or of the source and
+    the destination's `SyncManifest`), without reading or transferring
+    any file contents
+    '''
+    srcfs, destfs = get_fs(src), get_fs(dest)
+    src_path, dest_path = _resolve_path(src), _resolve_path(dest)
+    src_listing, dest_index, unchanged_dirs, _ = _plan_inputs(
+        srcfs, src_path, destfs, dest_path, use_manifest, metrics=metrics
+    )
+    entries = list(_plan_entries(
+        srcfs, src_path, destfs, dest_path, src_listing, dest_index, unchanged_dirs,
+        checksum=checksum, force_overwrite=force_overwrite
+    ))
+    return SyncPlan(src, dest, src_path, dest_path, entries)
+
+def _resolve_server_checksums(batch, src, dest, src_path, dest_path):
+    '''Fill in the checksums of the iRODS sides of `NEEDS_CHECKSUM`
+    entries in `batch` with concurrent `server_md5s` requests, and
+    decide their action where both are then known
+    '''
+    for url, root, attr in ((src, src_path, 'src_checksum'), (dest, dest_path, 'dest_checksum')):
+        if not is_irods(get_fs(url)):
+            continue
+        missing = {
+            os.path.join(root, entry.relpath): entry
+            for entry in batch if getattr(entry, attr) is None
+        }
+        for path, md5 in server_md5s(url, missing).items():
+            setattr(missing[path], attr, md5)
+    for entry in batch:
+        if entry.src_checksum is None or entry.dest_checksum is None:
+            continue
+        if entry.src_checksum == entry.dest_checksum:
+            entry.action = SyncAction.IDENTICAL
+        else:
+            entry.action = SyncAction.CHANGED_CHECKSUM
+
+def _with_server_checksums(entries, src, dest, src_path, dest_path, batch_size=SERVER_CHECKSUM_BATCH_SIZE):
+    '''Pass `entries` through, holding back `NEEDS_CHECKSUM` ones in
+    batches of `batch_size` to checksum on the server (see
+    `_resolve_server_checksums`) if either side is in iRODS
+    '''
+    if not (is_irods(get_fs(src)) or is_irods(get_fs(dest))):
+        yield from entries
+        return
+    batch = []
+    for entry in entries:
+        if entry.action is not SyncAction.NEEDS_CHECKSUM:
+            yield entry
+            continue
+        batch.append(entry)
+        if len(batch) >= batch_size:
+            _resolve_server_checksums(batch, src, dest, src_path, dest_path)
+            yield from batch
+            batch = []
+    if batch:
+        _resolve_server_checksums(batch, src, dest, src_path, dest_path)
+        yield from batch
+
+def _makedirs(fs, path):
+    '''`fs.makedirs(path, exist_ok=True)`, except on filesystems that
+    leave `makedirs` unimplemented (like the memory filesystem, whose
+    empty directories only `mkdir` can make)
+    '''
+    if type(fs).makedirs is not fsspec.spec.AbstractFileSystem.makedirs:
+        fs.makedirs(path, exist_ok=True)
+    elif not fs.exists(path):
+        fs.mkdir(path, create_parents=True)
+
+def _execute_entries(
+    entries, src, dest, src_path, dest_path, checksum=utils.md5sum, jobs=1, delta=False, metrics=None
+):
+    metrics = SyncMetrics(keep_files=False) if metrics is None else metrics
+    srcfs = get_fs(src)
+    destfs = get_fs(dest)
+    if not destfs.exists(dest_path):
+        destfs.makedirs(dest_path, exist_ok=True)
+    if checksum is utils.md5sum:
+        entries = _with_server_checksums(entries, src, dest, src_path, dest_path)
+
+    failures = {}
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=jobs) if jobs > 1 else None
+    pending = {}
+    max_pending = 4 * jobs
+
+    def done(src_file_path, file_metrics, exc):
+        if exc is not None:
+            log.error(f'Failed to sync {src_file_path}: {exc!r}')
+            failures[src_file_path] = exc
+            file_metrics.error = repr(exc)
+        metrics.file_done(file_metrics)
+
+    def collect(done_futures):
+        for future in done_futures:
+            done(*pending.pop(future), future.exception())
+
+    try:
+        for entry in entries:
+            if entry.action is SyncAction.MKDIR:
+                dest_dir_path = os.path.join(dest_path, entry.relpath)
+                log.debug(f'No existing directory at {dest_dir_path}, making one')
+                _makedirs(destfs, dest_dir_path)
+                continue
+            src_file_path = os.path.join(src_path, entry.relpath)
+            dest_file_path = os.path.join(dest_path, entry.relpath)
+            if entry.action is SyncAction.EXTRA:
+                continue
+            file_metrics = FileMetrics(entry.relpath, entry.action.value, size=entry.src_size)
+            if entry.action is SyncAction.IDENTICAL:
+                log.debug(f'Skipping {entry}')
+                file_metrics.skipped = True
+                metrics.file_done(file_metrics)
+                continue
+            kwargs = dict(
+                src_size=entry.src_size,
+                src_checksum=entry.src_checksum,
+                dest_size=entry.dest_size,
+                dest_checksum=entry.dest_checksum,
+                checksum=checksum,
+                force_overwrite=entry.action in TRANSFER_ACTIONS,
+                delta=delta,
+                metrics=file_metrics,
+                # the listing already showed there's nothing there
+                dest_exists=False if entry.action is SyncAction.NEW else None
+            )
+            if executor is None:
+                exc = None
+                try:
+                    sync_single_file(
+                        src_file_path,
+                        dest_file_path,
+                        srcfs=srcfs,
+                        destfs=destfs,
+                        **kwargs
+                    )
+                except Exception as err:
+                    exc = err
+                done(src_file_path, file_metrics, exc)
+                continue
+            # bound the number of queued files so a huge tree
+            # doesn't get listed entirely into memory ahead of
+            # the transfers
+            if len(pending) >= max_pending:
+                finished, _ = concurrent.futures.wait(
+                    pending,
+                    return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                collect(finished)
+            future = executor.submit(
+                _sync_file_task,
+                src, dest,
+                src_file_path, dest_file_path,
+                **kwargs
+            )
+            pending[future] = (src_file_path, file_metrics)
+        if pending:
+            finished, _ = concurrent.futures.wait(pending)
+            collect(finished)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
+        metrics.finish()
+    if failures:
+        log.error(f'{len(failures)} file(s) failed to sync')
+    return failures
+
+def execute_sync_plan(plan, checksum=utils.md5sum, jobs=1, delta=False, metrics=None):
+    '''Carry out a `SyncPlan` (see `sync` for the arguments). Files
+    planned as `SyncAction.NEEDS_CHECKSUM` are checksummed now and
+    only sent if they differ.
+
+    Any `SyncManifest` at the destination is removed, since the plan
+    (or this part of it) leaves the destination in a state the
+    manifest doesn't record.
+    '''
+    SyncManifest.remove(get_fs(plan.dest), plan.dest_path)
+    return _execute_entries(
+        plan.entries, plan.src, plan.dest, plan.src_path, plan.dest_path,
+        checksum=checksum, jobs=jobs, delta=delta, metrics=metrics
+    )
+
+def sync(
+    src, dest, checksum=utils.md5sum, force_overwrite=False, jobs=1, use_manifest=True, delta=False, metrics=None
+):
     '''Sync `src` to `dest`, using any fsspec compatible URL for
     either (including local paths). See `sync_single_file` for
     details on how.
 
+    Each side is listed once, recursively (see `iter_listing`): the
+    destination into an in-memory index up front, and the source as
+    a stream compared entry by entry against that index to produce
+    the entries of a `SyncPlan`, which are carried out as they come.
+    Use `make_sync_plan` and `execute_sync_plan` to look at the plan
+    before acting on it.
+
+    Afterwards, a `SyncManifest` of what was synced is written to the
+    destination, and the next sync from the same source uses it in
+    place of listing the destination and to skip unchanged
+    directories (listing the whole source before starting). Without a
+    valid manifest, or with `use_manifest` False, both sides are
+    scanned in full.
+
+    With `jobs` > 1, files are checksummed and transferred on a pool
+    of worker threads while the source tree is still being listed.
+    Workers check filesystem instances out of the shared, bounded
+    pool (see `checkout_fs`) for each file, so no more iRODS sessions
+    are opened than the pool allows.
+    A failure syncing one file is logged and recorded, but does not
+    stop the rest of the run.
+
     Parameters
     ----------
     src
@@ -187,72 +1769,42 @@ def sync(src, dest, checksum=utils.md5sum, force_overwrite=False):
         checking their checksums (in other words, if you know it's more
         efficient to just send the files rather than compute their
         checksums)
-    '''
-    srcfs = get_fs(src)
-    src_url = urlparse(src)
-    src_path = os.path.abspath(src_url.path) if src_url.scheme in ('file', '') else src_url.path
-    destfs = get_fs(dest)
-    dest_url = urlparse(dest)
-    dest_path = os.path.abspath(dest_url.path) if dest_url.scheme in ('file', '') else dest_url.path
+    jobs : int (default: 1)
+        number of files to sync concurrently
+    use_manifest : bool (default: True)
+        whether to read and write the destination's `SyncManifest`
+    delta : bool (default: False)
+        whether to send only the changed blocks of files that already
+        exist at the destination (see `delta_copy`)
+    metrics : metrics.SyncMetrics or None
+        collects bytes transferred and hashed, time spent listing,
+        checksumming and copying, and per-file records for the run
 
-    for dirpath, dirnames, filenames in srcfs.walk(src_path):
-        if name_is_ignored(dirpath):
-            continue
-        # collect list of contents of source dir from local or remote fs
-        # and filter out the files to sync
-        # TODO this is redundant with `walk` but unless it's too slow
-        # it's not worth reimplementing walk
-        src_files = _filenames_lookup(srcfs, dirpath)
-
-        the_dir = pathlib.Path(dirpath)
-        dest_dir_path = os.path.join(dest_path, the_dir.relative_to(src_path))
-
-        # Collect any existing files and their checksums
-        if not destfs.isdir(dest_dir_path):
-            log.debug(f'No existing directory at {dest_dir_path}, making one')
-            destfs.mkdir(dest_dir_path)
-            dest_files = {}
-        else:
-            log.debug(f"Existing collection {dest_dir_path}")
-            dest_files = _filenames_lookup(destfs, dest_dir_path)
-            log.debug(f'Collected existing files {list(dest_files.keys())}')
-        
-        # Loop over local files, computing and comparing checksums
-        # if they exist on the remote, then upload if needed
-        # TODO this may benefit from parallelization
-        for fn, src_entry in src_files.items():
-            src_file_path = str(the_dir.joinpath(fn))
-            src_size = src_entry['size']
-            src_checksum = None
-
-            dest_file_path = os.path.join(dest_dir_path, fn)
-            dest_size = None
-            dest_checksum = None
-
-            if fn in dest_files:
-                dest_entry = dest_files[fn]
-                dest_size = dest_entry['size']
-                if 'checksum' in src_entry and srcfs is destfs:
-                    # trust the filesystem's checksums are comparable
-                    # regardless of which it is
-                    src_checksum = src_entry['checksum']
-                    dest_checksum = dest_entry['checksum']
-                elif checksum is utils.md5sum:
-                    # we know iRODS checksums are md5, otherwise who knows
-                    if isinstance(srcfs, irods_fsspec.IRODSFileSystem):
-                        src_checksum = src_entry['checksum']
-                    if isinstance(destfs, irods_fsspec.IRODSFileSystem):
-                        dest_checksum = dest_entry['checksum']
-
-            sync_single_file(
-                src_file_path,
-                dest_file_path,
-                src_size=src_size,
-                src_checksum=src_checksum,
-                srcfs=srcfs,
-                dest_size=dest_size,
-                dest_checksum=dest_checksum,
-                destfs=destfs,
-                checksum=checksum,
-                force_overwrite=force_overwrite
-            )
+    Returns
+    -------
+    failures : dict
+        mapping of source file paths that could not be synced to
+        the exception raised while syncing them
+    '''
+    srcfs, destfs = get_fs(src), get_fs(dest)
+    src_path, dest_path = _resolve_path(src), _resolve_path(dest)
+    src_listing, dest_index, unchanged_dirs, manifest = _plan_inputs(
+        srcfs, src_path, destfs, dest_path, use_manifest, metrics=metrics
+    )
+    # until this run is recorded, any old manifest (valid or not)
+    # would be wrong
+    SyncManifest.remove(destfs, dest_path)
+    entries = []
+    def planned():
+        for entry in _plan_entries(
+            srcfs, src_path, destfs, dest_path, src_listing, dest_index, unchanged_dirs,
+            checksum=checksum, force_overwrite=force_overwrite
+        ):
+            entries.append(entry)
+            yield entry
+    failures = _execute_entries(
+        planned(), src, dest, src_path, dest_path, checksum=checksum, jobs=jobs, delta=delta, metrics=metrics
+    )
+    if use_manifest:
+        SyncManifest.from_entries(src_path, entries, failures, checksum=checksum).save(destfs, dest_path)
+    return failures
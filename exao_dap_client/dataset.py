@@ -1,5 +1,20 @@
+import concurrent.futures
 from enum import Enum
+import hashlib
+import logging
+import os
+import os.path
+import threading
+import orjson
 from . import http
+from .config import get_config
+
+log = logging.getLogger(__name__)
+
+DATASETS_ENDPOINT = '/api/v1/registrar/datasets/'
+DEFAULT_BATCH_SIZE = 500
+# Upper bound on the encoded size of a batch, whatever its length
+DEFAULT_BATCH_BYTES = 2**23
 
 
 class DatasetSource(Enum):
@@ -16,18 +31,181 @@ class DatasetState(Enum):
     PENDING = 'pending'
     COMPLETE = 'complete'
 
-def ingest(data_store_path, identifier, source, stage, kind, description, friendly_name, data_payloads):
+def _dataset_payload(data_store_path, identifier, source, stage, kind, description, friendly_name):
     payload = {
         'identifier': identifier,
         'source_path': data_store_path,
         'source': source.value,
         'stage': stage.value,
         'kind': kind.value,
-        'data': data_payloads,
     }
     # optional
     if friendly_name:
         payload['friendly_name'] = friendly_name
     if description:
         payload['description'] = description
-    return http.post('/api/v1/registrar/datasets/', payload)
+    return payload
+
+def dataset_payload_with_data(data_store_path, identifier, source, stage, kind, description, friendly_name, data_payloads):
+    payload = _dataset_payload(data_store_path, identifier, source, stage, kind, description, friendly_name)
+    payload['data'] = data_payloads
+    return payload
+
+def ingest(data_store_path, identifier, source, stage, kind, description, friendly_name, data_payloads):
+    payload = dataset_payload_with_data(data_store_path, identifier, source, stage, kind, description, friendly_name, data_payloads)
+    return http.post(DATASETS_ENDPOINT, payload)
+
+def dataset_endpoint(identifier):
+    return f'{DATASETS_ENDPOINT}{identifier}/'
+
+def data_endpoint(identifier):
+    return f'{DATASETS_ENDPOINT}{identifier}/data/'
+
+def make_batches(data_payloads, batch_size=DEFAULT_BATCH_SIZE, batch_bytes=DEFAULT_BATCH_BYTES):
+    '''Split `data_payloads` into consecutive lists of at most
+    `batch_size` payloads whose JSON encoding is at most about
+    `batch_bytes` bytes (a single larger payload gets its own batch)
+    '''
+    batches = []
+    batch, n_bytes = [], 0
+    for payload in data_payloads:
+        size = len(orjson.dumps(payload))
+        if batch and (len(batch) >= batch_size or n_bytes + size > batch_bytes):
+            batches.append(batch)
+            batch, n_bytes = [], 0
+        batch.append(payload)
+        n_bytes += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class IngestCheckpoint:
+    '''Local record of how far a batched ingest got (which data
+    payloads, by filename, the service acknowledged), so a failed run
+    can resume with only the rest. Saved as JSON (atomically replaced
+    on every update) under the cache directory.
+
+    Only valid for the same dataset and set of files it was made for,
+    as identified by `fingerprint`; the payloads themselves may differ
+    (e.g. if a header reads differently on the rerun).
+    '''
+    def __init__(self, path, fingerprint):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.created = False
+        self.acknowledged = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def default_path(cls, identifier):
+        return os.path.join(get_config().CACHE_DIR, 'ingest', f'{identifier}.json')
+
+    @classmethod
+    def load(cls, path, fingerprint):
+        checkpoint = cls(path, fingerprint)
+        if os.path.exists(path):
+            with open(path, 'rb') as fh:
+                state = orjson.loads(fh.read())
+            if state['fingerprint'] != fingerprint:
+                raise ValueError(
+                    f'Checkpoint {path} was made for a different dataset or set of '
+                    'files, remove it to start the ingest over'
+                )
+            checkpoint.created = state['created']
+            checkpoint.acknowledged = set(state['acknowledged'])
+            log.info(f'Resuming ingest from {path} ({len(checkpoint.acknowledged)} data payloads done)')
+        return checkpoint
+
+    def save(self):
+        with self._lock:
+            state = {
+                'fingerprint': self.fingerprint,
+                'created': self.created,
+                'acknowledged': sorted(self.acknowledged),
+            }
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'wb') as fh:
+                fh.write(orjson.dumps(state))
+            os.replace(tmp_path, self.path)
+
+    def acknowledge(self, batch):
+        with self._lock:
+            self.acknowledged.update(payload['filename'] for payload in batch)
+        self.save()
+
+    def remaining(self, data_payloads):
+        return [payload for payload in data_payloads if payload['filename'] not in self.acknowledged]
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def prepare_batched_ingest(
+    data_store_path, identifier, source, stage, kind, description, friendly_name, data_payloads,
+    batch_size=DEFAULT_BATCH_SIZE, batch_bytes=DEFAULT_BATCH_BYTES, checkpoint_path=None
+):
+    '''Dataset payload (without data), batches of the data payloads
+    not yet acknowledged and the checkpoint to resume from for
+    `ingest_in_batches`
+    '''
+    data_payloads = list(data_payloads)
+    dataset_payload = _dataset_payload(data_store_path, identifier, source, stage, kind, description, friendly_name)
+    hasher = hashlib.md5(orjson.dumps(dataset_payload))
+    hasher.update(orjson.dumps(sorted(payload['filename'] for payload in data_payloads)))
+    checkpoint_path = IngestCheckpoint.default_path(identifier) if checkpoint_path is None else checkpoint_path
+    checkpoint = IngestCheckpoint.load(checkpoint_path, hasher.hexdigest())
+    remaining = checkpoint.remaining(data_payloads)
+    log.info(f'Uploading {len(remaining)} of {len(data_payloads)} data payloads for {identifier}')
+    batches = make_batches(remaining, batch_size=batch_size, batch_bytes=batch_bytes)
+    return dataset_payload, batches, checkpoint
+
+def pending_dataset_payload(dataset_payload):
+    return dict(dataset_payload, data=[], state=DatasetState.PENDING.value)
+
+def ingest_in_batches(
+    data_store_path, identifier, source, stage, kind, description, friendly_name, data_payloads,
+    batch_size=DEFAULT_BATCH_SIZE, batch_bytes=DEFAULT_BATCH_BYTES, jobs=4, checkpoint_path=None
+):
+    '''Register a dataset like `ingest`, but without sending every
+    data payload in one request. The dataset is created in the
+    `DatasetState.PENDING` state, its data payloads are uploaded in
+    batches (see `make_batches`) on `jobs` concurrent connections, and
+    it is then marked `DatasetState.COMPLETE`.
+
+    Progress is kept in an `IngestCheckpoint` (at `checkpoint_path`, or
+    under the cache directory by default), so rerunning a failed
+    ingest with the same files resumes with the data payloads not yet
+    acknowledged. The checkpoint is removed once the dataset is complete.
+    '''
+    dataset_payload, batches, checkpoint = prepare_batched_ingest(
+        data_store_path, identifier, source, stage, kind, description, friendly_name, data_payloads,
+        batch_size=batch_size, batch_bytes=batch_bytes, checkpoint_path=checkpoint_path
+    )
+    if not checkpoint.created:
+        http.post(DATASETS_ENDPOINT, pending_dataset_payload(dataset_payload))
+        checkpoint.created = True
+        checkpoint.save()
+
+    errors = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(http.post, data_endpoint(identifier), {'data': batch}): idx
+            for idx, batch in enumerate(batches)
+        }
+        for future in concurrent.futures.as_completed(futures):
+            exc = future.exception()
+            if exc is not None:
+                log.error(f'Failed to upload batch {futures[future]} for {identifier}: {exc!r}')
+                errors.append(exc)
+                continue
+            checkpoint.acknowledge(batches[futures[future]])
+    if errors:
+        # leave the checkpoint in place to resume from
+        raise errors[0]
+
+    result = http.patch(dataset_endpoint(identifier), {'state': DatasetState.COMPLETE.value})
+    checkpoint.remove()
+    return result
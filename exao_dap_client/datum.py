@@ -1,12 +1,16 @@
+import concurrent.futures
+import contextlib
 from enum import Enum
 import hashlib
+import itertools
+import logging
+import multiprocessing
 import re
+import os
 import os.path
-from astropy.io import fits
-import dateutil.parser, dateutil.tz
-from dateutil.utils import default_tzinfo
+from . import utils, data_store, cache, fits_headers, config
 
-from . import utils, data_store
+log = logging.getLogger(__name__)
 
 class DatumKind(Enum):
     SCIENCE = 'science'
@@ -30,10 +34,17 @@ def merge_payload(original_payload, new_payload):
                 final_payload[key] = new_payload[key]
     return final_payload
 
-def fits_extractor(payload, file_handle):
-    '''If the payload['filename'] value has a FITS extension,
-    parse `file_handle` as FITS and construct dictionaries
-    from the headers to produce a payload for merging into the final
+def _header_to_dict(header):
+    data = {}
+    for card in header.cards:
+        if card.keyword in _FITS_IGNORE_KEYWORDS:
+            continue
+        data[card.keyword] = card.value
+    return data
+
+class FitsHeaderTap:
+    '''Streaming extractor that picks the FITS headers out of the
+    bytes going by, producing a payload for merging into the final
     value::
 
         {'meta':
@@ -46,37 +57,55 @@ def fits_extractor(payload, file_handle):
                     'ext_2': {'KEYWORD': value, ...}
                 }
             }}
-        }    
+        }
+
+    Only needs the header blocks (see `fits_headers.HeaderScanner`),
+    so it stops consuming as soon as the data turn out not to be FITS
+    and can have data sections skipped with `take_skip`.
     '''
-    try:
-        hdulist = fits.open(file_handle)
-    except Exception:
-        return payload
-    # primary extension -> top level keys
-    data = {}
-    for card in hdulist[0].header.cards:
-        if card.keyword in _FITS_IGNORE_KEYWORDS:
-            continue
-        data[card.keyword] = card.value
-    extensions = {}
-    for idx, hdu in enumerate(hdulist[1:], start=1):
-        hdr = hdu.header
-        extdata = {}
-        for card in hdr.cards:
-            if card.keyword in _FITS_IGNORE_KEYWORDS:
-                continue
-            extdata[card.keyword] = card.value
-        if 'EXTNAME' in hdr:
-            name = hdr['EXTNAME']
-        else:
-            name = f'idx_{idx}'
-        extensions[name] = extdata
-    data['ext'] = extensions
-    return {'meta': {'fits': data}}
+    headers_only = True
+
+    def __init__(self, file_handle):
+        self.scanner = fits_headers.HeaderScanner()
+
+    @property
+    def done(self):
+        return self.scanner.done
+
+    def feed(self, chunk):
+        return self.scanner.feed(chunk)
+
+    def take_skip(self):
+        return self.scanner.take_skip()
+
+    def result(self):
+        if not self.scanner.hdus:
+            return {}
+        # astropy is slow to import, and not needed for non-FITS files
+        from astropy.io import fits
+        try:
+            headers = [fits.Header.fromstring(hdu.header_bytes) for hdu in self.scanner.hdus]
+        except Exception:
+            return {}
+        if not headers:
+            return {}
+        # primary extension -> top level keys
+        data = _header_to_dict(headers[0])
+        extensions = {}
+        for idx, hdr in enumerate(headers[1:], start=1):
+            if 'EXTNAME' in hdr:
+                name = hdr['EXTNAME']
+            else:
+                name = f'idx_{idx}'
+            extensions[name] = _header_to_dict(hdr)
+        data['ext'] = extensions
+        return {'meta': {'fits': data}}
 
 DATE_KEYWORDS = ('DATE-OBS', 'DATE')
 
 def _parse_datetime(value):
+    import dateutil.parser, dateutil.tz
+    from dateutil.utils import default_tzinfo
     dt = default_tzinfo(dateutil.parser.parse(value), dateutil.tz.UTC)
     return dt.astimezone(tz=dateutil.tz.UTC)
 
@@ -91,7 +120,7 @@ def date_extractor(payload, file_handle):
 
     Supplies `created_at` key for payload.
     '''
-    if 'fits' in payload['meta']:
+    if 'fits' in payload.get('meta', {}):
         headers = payload['meta']['fits']
         for kw in DATE_KEYWORDS:
             if kw in headers:
@@ -108,48 +137,301 @@ def date_extractor(payload, file_handle):
     return {}
 
 
-def checksum_size_extractor(payload, file_handle):
-    size_bytes, md5sum = utils.size_and_md5sum(file_handle)
-    return {'checksum_md5': md5sum, 'size_bytes': size_bytes}
+class ChecksumSizeTap:
+    '''Streaming extractor computing size in bytes and MD5 checksum of
+    every byte going by. Local files go through the persistent
+    checksum index, so unchanged files need not be read at all.
+
+    Supplies `checksum_md5` and `size_bytes` keys for payload.
+    '''
+    headers_only = False
+
+    def __init__(self, file_handle):
+        self.hasher = hashlib.md5()
+        self.size_bytes = 0
+        self.md5sum = None
+        self.done = False
+        self._local_path = cache.local_path_of(file_handle)
+        if self._local_path is not None:
+            self._stat = os.stat(self._local_path)
+            self.md5sum = cache.get_checksum_index().lookup(self._local_path, stat_result=self._stat)
+            if self.md5sum is not None:
+                self.size_bytes = self._stat.st_size
+                self.done = True
+
+    def feed(self, chunk):
+        self.hasher.update(chunk)
+        self.size_bytes += len(chunk)
+        return True
+
+    def result(self):
+        if self.md5sum is None:
+            self.md5sum = self.hasher.hexdigest()
+            if self._local_path is not None:
+                cache.get_checksum_index().record(self._local_path, self.md5sum, stat_result=self._stat)
+        return {'checksum_md5': self.md5sum, 'size_bytes': self.size_bytes}
 
-EXTRACTOR_STACK = (
-    fits_extractor,
+# Extractors fed the file contents in a single pass by `run_extractors`
+STREAM_EXTRACTORS = (
+    FitsHeaderTap,
+    ChecksumSizeTap,
+)
+# Extractors run on the merged payload afterwards
+POST_EXTRACTORS = (
     date_extractor,
-    checksum_size_extractor,
 )
 
+def run_extractors(file_handle, extractor_classes):
+    '''Read `file_handle` once from the start, feeding each chunk to
+    instances of `extractor_classes` until they have all the data
+    they want, and return their payload updates in order.
+
+    When every extractor still consuming only needs headers (and
+    there's nothing to read in between), data sections are seeked
+    over instead of read.
+    '''
+    extractors = [cls(file_handle) for cls in extractor_classes]
+    active = [ext for ext in extractors if not ext.done]
+    file_handle.seek(0)
+    if active and all(ext.headers_only for ext in active):
+        while active:
+            block = file_handle.read(fits_headers.HEADER_READ_SIZE)
+            if not block:
+                break
+            active = [ext for ext in active if ext.feed(block)]
+            n_skip = min((ext.take_skip() for ext in active), default=0)
+            if n_skip:
+                file_handle.seek(n_skip, 1)
+    elif active:
+        for chunk in utils.read_in_chunks(file_handle):
+            active = [ext for ext in active if ext.feed(chunk)]
+            if not active:
+                break
+    return [ext.result() for ext in extractors]
+
+def fits_extractor(payload, file_handle):
+    '''Payload from the FITS headers in `file_handle` alone
+    (see `FitsHeaderTap`)
+    '''
+    update, = run_extractors(file_handle, (FitsHeaderTap,))
+    return update
+
+def checksum_size_extractor(payload, file_handle):
+    '''Payload with size and checksum of `file_handle` alone
+    (see `ChecksumSizeTap`)
+    '''
+    update, = run_extractors(file_handle, (ChecksumSizeTap,))
+    return update
+
+# keys of `STREAM_EXTRACTORS` payloads that describe the file rather
+# than its contents, so aren't kept in the metadata cache
+_UNCACHED_KEYS = ('checksum_md5', 'size_bytes')
+
+def _cached_contents_payload(md5):
+    return cache.get_metadata_cache().lookup(md5)
+
+def _cache_contents_payload(payload):
+    md5 = payload.get('checksum_md5')
+    if md5 is not None:
+        contents_payload = {key: value for key, value in payload.items() if key not in _UNCACHED_KEYS}
+        cache.get_metadata_cache().record(md5, contents_payload)
+
+def _stream_payload_from_cache(file_handle):
+    '''The `STREAM_EXTRACTORS` payload for a local file from the caches
+    alone, when the checksum index has its MD5 (so it is unchanged
+    since last hashed) and the metadata cache has that MD5's payload,
+    otherwise None
+    '''
+    local_path = cache.local_path_of(file_handle)
+    if local_path is None:
+        return None
+    st = os.stat(local_path)
+    md5 = cache.get_checksum_index().lookup(local_path, stat_result=st)
+    contents_payload = _cached_contents_payload(md5)
+    if contents_payload is None:
+        return None
+    return dict(contents_payload, checksum_md5=md5, size_bytes=st.st_size)
+
 def extract_info(filename_or_file):
+    '''Build the info payload for a file (path or open binary file
+    handle) from a single pass over its contents with
+    `STREAM_EXTRACTORS`, followed by `POST_EXTRACTORS`.
+
+    What the stream extractors find is kept in the metadata cache
+    (see `cache.MetadataCache`) under the file's MD5, and an unchanged
+    local file whose contents have been seen before is not read at all.
+    '''
     if isinstance(filename_or_file, str):
         fh = open(filename_or_file, 'rb')
     else:
         fh = filename_or_file
     try:
-        payload = {}
-        for extractor_func in EXTRACTOR_STACK:
+        payload = _stream_payload_from_cache(fh)
+        if payload is None:
+            payload = {}
+            for payload_update in run_extractors(fh, STREAM_EXTRACTORS):
+                payload = merge_payload(payload, payload_update)
+            _cache_contents_payload(payload)
+        for extractor_func in POST_EXTRACTORS:
             payload_update = extractor_func(payload, fh)
             payload = merge_payload(payload, payload_update)
     finally:
-        if not isinstance(filename_or_file, str):
+        if isinstance(filename_or_file, str):
             fh.close()
     return payload
 
-def extract_all_info(filenames_or_files, minimal=False, file_likes=None):
-    payloads = []
-    for fn_or_fh in filenames_or_files:
-        if isinstance(fn_or_fh, str):
-            fh = open(fn_or_fh, 'rb')
+def _extract_info_from_path(path):
+    fs = data_store.get_fs(path)
+    with fs.open(path, 'rb') as fh:
+        return extract_info(fh)
+
+# fewer files than this are extracted in-process, as starting worker
+# processes (each importing the package afresh) would take longer
+MIN_FILES_FOR_PROCESS_POOL = 8
+
+def _extract_info_or_none(path):
+    try:
+        return _extract_info_from_path(path)
+    except Exception as exc:
+        log.error(f'Failed to extract info from {path}: {exc!r}')
+        return None
+
+def iter_extract_info(paths, jobs=None, max_in_flight=None):
+    '''Extract info payloads for `paths` (local paths or URLs of
+    files in any supported filesystem) on a pool of up to `jobs`
+    worker processes (no more than there are files), yielding results
+    as they complete. With `jobs` of 1, or fewer than
+    `MIN_FILES_FOR_PROCESS_POOL` files, they are extracted in this
+    process instead, in order.
+
+    At most `max_in_flight` files (default: twice the number of
+    workers) are submitted at once, so `paths` may be a lazy iterable
+    over a very large collection. Each worker opens and closes its
+    own file handles. Workers are spawned rather than forked, so they
+    don't inherit this process's cache database connections (or any
+    other state held by its threads).
+
+    Yields
+    ------
+    path : str
+    payload : dict or None
+        None if extraction failed (the error is logged)
+    '''
+    jobs = os.cpu_count() if jobs is None else jobs
+    paths = iter(paths)
+    head = list(itertools.islice(paths, max(jobs, MIN_FILES_FOR_PROCESS_POOL)))
+    paths = itertools.chain(head, paths)
+    if jobs == 1 or len(head) < MIN_FILES_FOR_PROCESS_POOL:
+        for path in paths:
+            yield path, _extract_info_or_none(path)
+        return
+    jobs = min(jobs, len(head))
+    max_in_flight = 2 * jobs if max_in_flight is None else max_in_flight
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=jobs,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=config.set_config,
+        initargs=(config.get_config(),)
+    ) as executor:
+        pending = {}
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < max_in_flight:
+                try:
+                    path = next(paths)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[executor.submit(_extract_info_from_path, path)] = path
+            if not pending:
+                break
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                exc = future.exception()
+                if exc is not None:
+                    log.error(f'Failed to extract info from {path}: {exc!r}')
+                    yield path, None
+                else:
+                    yield path, future.result()
+
+def extract_all_info(filenames_or_files, minimal=False, file_likes=None, jobs=1):
+    '''Extract info payloads for each of `filenames_or_files`, in
+    order. With `jobs` > 1, files given by name are processed on a
+    process pool (see `iter_extract_info`) and open file handles
+    in this process.
+    '''
+    filenames_or_files = list(filenames_or_files)
+    payloads = [None] * len(filenames_or_files)
+    names = {}
+    for idx, fn_or_fh in enumerate(filenames_or_files):
+        if jobs > 1 and isinstance(fn_or_fh, str):
+            names.setdefault(fn_or_fh, []).append(idx)
         else:
-            fh = fn_or_fh
-        payloads.append(extract_info(fh))
+            payloads[idx] = extract_info(fn_or_fh)
+    if names:
+        for path, payload in iter_extract_info(names, jobs=jobs):
+            for idx in names[path]:
+                payloads[idx] = payload
     return payloads
 
-def init_from_collection(src_collection, default_kind=DatumKind.SCIENCE):
-    irodsfs = data_store.irods_get_fs()
+def _header_payload(fs_checkout, path):
+    try:
+        with fs_checkout() as fs, fits_headers.open_for_headers(fs, path) as fh:
+            update, = run_extractors(fh, (FitsHeaderTap,))
+    except Exception as exc:
+        log.warning(f'Could not read headers of {path}: {exc!r}')
+        return {}
+    return update
+
+def init_from_collection(src_collection, default_kind=DatumKind.SCIENCE, jobs=8, fs=None):
+    '''Build datum payloads for the files in `src_collection` (an iRODS
+    collection, unless another fsspec filesystem is passed as `fs`)
+    without streaming whole files.
+
+    Size and (MD5) checksum come from the detailed listing of the
+    collection. Files whose checksum is in the metadata cache take
+    their headers from there. The rest are read with ranged,
+    header-only reads (see `fits_headers`) on `jobs` threads, each
+    checking an iRODS session out of the shared pool (see
+    `data_store.checkout_irods_fs`). The `POST_EXTRACTORS` then run
+    on the result.
+    '''
+    if fs is None:
+        fs_checkout = data_store.checkout_irods_fs
+    else:
+        fs_checkout = lambda: contextlib.nullcontext(fs)
+    with fs_checkout() as listing_fs:
+        entries = [
+            entry for entry in listing_fs.ls(src_collection, detail=True)
+            if entry['type'] == 'file' and not data_store.name_is_ignored(os.path.basename(entry['name']))
+        ]
     results = []
-    for entry in irodsfs.ls(src_collection):
+    header_updates = []
+    to_read = []
+    for idx, entry in enumerate(entries):
         payload = {
             'kind': default_kind,
-            'filename': os.path.basename(entry['name'])
+            'filename': os.path.basename(entry['name']),
+            'size_bytes': entry['size'],
         }
+        md5sum = data_store.md5_from_entry(listing_fs, entry)
+        if md5sum is not None:
+            payload['checksum_md5'] = md5sum
         results.append(payload)
+        header_updates.append(_cached_contents_payload(md5sum))
+        if header_updates[-1] is None:
+            to_read.append(idx)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        read_updates = executor.map(_header_payload, [fs_checkout] * len(to_read), [entries[idx]['name'] for idx in to_read])
+        for idx, update in zip(to_read, read_updates):
+            header_updates[idx] = update
+            # nothing found may just mean the read failed this time
+            if update and 'checksum_md5' in results[idx]:
+                cache.get_metadata_cache().record(results[idx]['checksum_md5'], update)
+        for idx, update in enumerate(header_updates):
+            payload = merge_payload(results[idx], update)
+            for extractor_func in POST_EXTRACTORS:
+                payload = merge_payload(payload, extractor_func(payload, None))
+            results[idx] = payload
     return results
@@ -0,0 +1,186 @@
+'''Read FITS headers without reading the data that follows them.
+
+A FITS file is a sequence of HDUs, each a header of 80-byte cards
+padded to 2880-byte blocks and ending with an END card, followed by a
+data section whose size follows from BITPIX, NAXISn, PCOUNT and GCOUNT
+(also padded to 2880 bytes). Knowing that, every header can be found
+by reading a few blocks per HDU and skipping the data, so extracting
+metadata costs a few KB per file regardless of how big it is.
+'''
+from dataclasses import dataclass
+import logging
+import math
+
+log = logging.getLogger(__name__)
+
+BLOCK_SIZE = 2880
+CARD_SIZE = 80
+# read this much at a time when looking for the END card, since most
+# headers fit in a handful of blocks
+HEADER_READ_SIZE = 4 * BLOCK_SIZE
+
+_END_CARD = b'END' + b' ' * 5
+_SIZE_KEYWORDS = {b'BITPIX', b'NAXIS', b'PCOUNT', b'GCOUNT', b'GROUPS'}
+
+
+def _padded(n_bytes):
+    return BLOCK_SIZE * math.ceil(n_bytes / BLOCK_SIZE)
+
+
+def _card_value(card):
+    return card[10:].split(b'/')[0].strip()
+
+
+def data_size(header_bytes):
+    '''Size in bytes (before padding) of the data section described by
+    the raw header `header_bytes`
+    '''
+    values = {}
+    naxes = {}
+    for start in range(0, len(header_bytes), CARD_SIZE):
+        card = bytes(header_bytes[start:start + CARD_SIZE])
+        keyword = card[:8].rstrip()
+        if card[8:10] != b'= ':
+            continue
+        if keyword in _SIZE_KEYWORDS:
+            values[keyword] = _card_value(card)
+        elif keyword.startswith(b'NAXIS') and keyword[5:].isdigit():
+            naxes[int(keyword[5:])] = int(_card_value(card))
+    bitpix = int(values.get(b'BITPIX', 8))
+    naxis = int(values.get(b'NAXIS', 0))
+    if naxis == 0:
+        return 0
+    axes = [naxes.get(idx, 0) for idx in range(1, naxis + 1)]
+    if values.get(b'GROUPS') == b'T' and axes[0] == 0:
+        # random groups, NAXIS1 = 0 is a placeholder
+        axes = axes[1:]
+    pcount = int(values.get(b'PCOUNT', 0))
+    gcount = int(values.get(b'GCOUNT', 1))
+    return abs(bitpix) // 8 * gcount * (pcount + math.prod(axes))
+
+
+@dataclass
+class HDUInfo:
+    header_offset: int
+    header_bytes: bytes
+    data_offset: int
+    data_size: int
+
+    @property
+    def padded_data_size(self):
+        return _padded(self.data_size)
+
+    @property
+    def end_offset(self):
+        return self.data_offset + self.padded_data_size
+
+
+class HeaderScanner:
+    '''Incremental FITS structure parser. Bytes from the start of a
+    file are passed to `feed` (in chunks of any size), and the raw
+    header of each HDU is collected in `hdus` while data sections are
+    just counted off.
+
+    Callers able to seek can instead call `take_skip` after each
+    `feed` and seek forward by the returned number of bytes rather
+    than reading them.
+    '''
+    def __init__(self):
+        self.hdus = []
+        self.is_fits = None
+        self.done = False
+        self._skip = 0
+        self._header_offset = 0
+        self._header = bytearray()
+
+    @property
+    def in_header(self):
+        '''Whether the scanner is partway through a header'''
+        return len(self._header) > 0
+
+    def _end_of_block(self):
+        block = self._header[-BLOCK_SIZE:]
+        if len(self._header) == BLOCK_SIZE:
+            magic = b'SIMPLE  =' if not self.hdus else b'XTENSION='
+            if not block.startswith(magic):
+                if not self.hdus:
+                    self.is_fits = False
+                # otherwise just trailing bytes after the last HDU
+                self.done = True
+                return
+            self.is_fits = True
+        for start in range(0, BLOCK_SIZE, CARD_SIZE):
+            if block[start:start + CARD_SIZE].startswith(_END_CARD):
+                break
+        else:
+            return
+        header_bytes = bytes(self._header)
+        hdu = HDUInfo(
+            header_offset=self._header_offset,
+            header_bytes=header_bytes,
+            data_offset=self._header_offset + len(header_bytes),
+            data_size=data_size(header_bytes),
+        )
+        self.hdus.append(hdu)
+        self._header = bytearray()
+        self._header_offset = hdu.end_offset
+        self._skip = hdu.padded_data_size
+
+    def feed(self, data):
+        '''Consume `data`, the next bytes of the file
+
+        Returns
+        -------
+        wants_more : bool
+            False once the scanner has everything it needs (the file
+            isn't FITS, or there was junk after the last HDU)
+        '''
+        data = memoryview(data)
+        idx = 0
+        while idx < len(data) and not self.done:
+            if self._skip:
+                n_bytes = min(self._skip, len(data) - idx)
+                self._skip -= n_bytes
+            else:
+                n_bytes = min(BLOCK_SIZE - len(self._header) % BLOCK_SIZE, len(data) - idx)
+                self._header.extend(data[idx:idx + n_bytes])
+                if len(self._header) % BLOCK_SIZE == 0:
+                    self._end_of_block()
+            idx += n_bytes
+        return not self.done
+
+    def take_skip(self):
+        '''Return the number of bytes of data section the scanner is
+        waiting to be fed, and consider them skipped
+        '''
+        n_bytes, self._skip = self._skip, 0
+        return n_bytes
+
+
+def scan(file_handle):
+    '''Find every HDU in `file_handle`, reading only header blocks and
+    seeking past data sections
+
+    Returns
+    -------
+    hdus : list of HDUInfo
+        empty if the file is not FITS
+    '''
+    file_handle.seek(0)
+    scanner = HeaderScanner()
+    while True:
+        block = file_handle.read(BLOCK_SIZE if scanner.in_header else HEADER_READ_SIZE)
+        if not block or not scanner.feed(block):
+            break
+        n_skip = scanner.take_skip()
+        if n_skip:
+            file_handle.seek(n_skip, 1)
+    return scanner.hdus
+
+
+def open_for_headers(fs, path):
+    '''Open `path` on fsspec filesystem `fs` with a small read-ahead
+    block, so that for remote files `scan` fetches just the byte
+    ranges holding the headers rather than large buffered blocks
+    '''
+    return fs.open(path, 'rb', block_size=HEADER_READ_SIZE)
@@ -0,0 +1,196 @@
+'''Bounded pool of filesystem instances (and so of the connections or
+sessions behind them), shared by the threads of a process.
+
+Threads check an instance out for a unit of work and return it when
+done, instead of each keeping its own for as long as the thread lives.
+At most `max_size` instances exist per key (one key per distinct set
+of connection arguments); threads wanting more wait for one to come
+back. Instances idle for longer than `idle_timeout` are closed
+whenever any instance is checked out or returned, and one that has
+sat idle for `check_after` seconds, or was returned after an error,
+is health-checked before being handed out again (and replaced if the
+check fails).
+'''
+import collections
+import contextlib
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_SIZE = 8
+# seconds
+DEFAULT_IDLE_TIMEOUT = 300
+DEFAULT_CHECK_AFTER = 30
+
+_Idle = collections.namedtuple('_Idle', ['fs', 'returned_at', 'checked_at'])
+
+
+class FilesystemPool:
+    '''Pool of instances made by the `factory` passed to `checkout` for
+    each key, at most `max_size` per key.
+
+    `health_check(fs)` returns whether `fs` is still usable, and
+    `close(fs)` releases whatever it holds; by default every instance
+    is healthy and nothing needs closing.
+    '''
+    def __init__(
+        self,
+        max_size=DEFAULT_MAX_SIZE,
+        idle_timeout=DEFAULT_IDLE_TIMEOUT,
+        check_after=DEFAULT_CHECK_AFTER,
+        health_check=None,
+        close=None,
+        clock=time.monotonic,
+    ):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.check_after = check_after
+        self._health_check = health_check if health_check is not None else lambda fs: True
+        self._close = close if close is not None else lambda fs: None
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        # key -> list of _Idle, most recently returned last
+        self._idle = {}
+        # key -> number of instances checked out
+        self._n_out = collections.Counter()
+        # key -> [fs, depth] for checkouts held by this thread
+        self._held = threading.local()
+
+    def _check_pid(self):
+        # instances inherited across a fork share their parent's
+        # connections, so a child process starts over
+        if os.getpid() != self._pid:
+            self._reset()
+
+    def size(self, key):
+        '''Number of instances for `key`, checked out or idle'''
+        with self._cond:
+            self._check_pid()
+            return self._n_out[key] + len(self._idle.get(key, ()))
+
+    def _evict_idle(self, now):
+        '''Remove instances idle longer than `idle_timeout`, returning
+        them to be closed outside the lock
+        '''
+        stale = []
+        for key, idle in self._idle.items():
+            fresh = [entry for entry in idle if now - entry.returned_at <= self.idle_timeout]
+            if len(fresh) != len(idle):
+                stale.extend(entry.fs for entry in idle if now - entry.returned_at > self.idle_timeout)
+                idle[:] = fresh
+        return stale
+
+    def _close_all(self, instances):
+        for fs in instances:
+            try:
+                self._close(fs)
+            except Exception as exc:
+                log.debug(f'Error closing pooled filesystem {fs}: {exc!r}')
+
+    def acquire(self, key, factory, timeout=None):
+        '''Check out an instance for `key`, reusing an idle one or making
+        one with `factory()`, waiting up to `timeout` seconds (forever
+        if None) for one to be returned if there are already `max_size`
+
+        Raises
+        ------
+        TimeoutError
+            if none became available in time
+        '''
+        deadline = None if timeout is None else self._clock() + timeout
+        with self._cond:
+            self._check_pid()
+            while True:
+                stale = self._evict_idle(self._clock())
+                idle = self._idle.get(key)
+                if idle:
+                    entry = idle.pop()
+                    break
+                if self._n_out[key] < self.max_size:
+                    entry = None
+                    break
+                remaining = None if deadline is None else deadline - self._clock()
+                if remaining is not None and remaining <= 0:
+                    self._close_all(stale)
+                    raise TimeoutError(f'No filesystem for {key} available within {timeout} s')
+                self._cond.wait(remaining)
+            self._n_out[key] += 1
+        self._close_all(stale)
+        try:
+            if entry is not None:
+                checked_at = entry.checked_at
+                if checked_at is None or self._clock() - checked_at >= self.check_after:
+                    if not self._healthy(entry.fs):
+                        log.info(f'Replacing pooled filesystem for {key} that failed its health check')
+                        self._close_all([entry.fs])
+                        entry = None
+            return entry.fs if entry is not None else factory()
+        except BaseException:
+            with self._cond:
+                self._n_out[key] -= 1
+                self._cond.notify()
+            raise
+
+    def _healthy(self, fs):
+        try:
+            return self._health_check(fs)
+        except Exception as exc:
+            log.debug(f'Health check of {fs} failed: {exc!r}')
+            return False
+
+    def release(self, key, fs, suspect=False):
+        '''Return `fs`, checked out for `key`, to the pool. If `suspect`
+        (e.g. it was in use when an error happened), it is
+        health-checked before being used again.
+        '''
+        with self._cond:
+            if os.getpid() != self._pid:
+                return
+            now = self._clock()
+            self._n_out[key] -= 1
+            self._idle.setdefault(key, []).append(_Idle(fs, now, None if suspect else now))
+            stale = self._evict_idle(now)
+            self._cond.notify()
+        self._close_all(stale)
+
+    @contextlib.contextmanager
+    def checkout(self, key, factory, timeout=None):
+        '''Context manager for `acquire` and `release`. Nested checkouts
+        of the same key in one thread share an instance, so they don't
+        wait on each other.
+        '''
+        self._check_pid()
+        held = getattr(self._held, 'checkouts', None)
+        if held is None:
+            held = self._held.checkouts = {}
+        if key in held:
+            held[key][1] += 1
+            try:
+                yield held[key][0]
+            finally:
+                held[key][1] -= 1
+            return
+        fs = self.acquire(key, factory, timeout=timeout)
+        held[key] = [fs, 1]
+        try:
+            yield fs
+        except BaseException:
+            del held[key]
+            self.release(key, fs, suspect=True)
+            raise
+        del held[key]
+        self.release(key, fs)
+
+    def clear(self):
+        '''Close all idle instances'''
+        with self._cond:
+            self._check_pid()
+            idle, self._idle = self._idle, {}
+        self._close_all([entry.fs for entries in idle.values() for entry in entries])
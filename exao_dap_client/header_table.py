@@ -0,0 +1,183 @@
+'''Columnar export of extracted FITS headers, for querying large
+extraction batches with vectorized scans instead of looping over
+nested payloads.
+
+Each file becomes a row, with a column per keyword per HDU: primary
+header keywords under their own names, extension keywords as
+`EXTNAME.KEYWORD` (see `datum.FitsHeaderTap` for how extensions are
+named), plus `path`, `checksum_md5`, `size_bytes` and `created_at`.
+Rows are written as they come in row groups of `row_group_size`, each
+a Parquet file in the table's directory, so memory use doesn't grow
+with the number of files. `read_header_table` reads them back as one
+`pyarrow.Table`, e.g. to find all frames with EXPTIME > 10::
+
+    import pyarrow.compute as pc
+    table = read_header_table('headers/', columns=['path', 'EXPTIME'])
+    long_frames = table.filter(pc.greater(table['EXPTIME'], 10))
+
+Columns whose type varies between files are widened to float64 (for
+a mix of integers and floats) or strings.
+
+Requires the optional `pyarrow` dependency
+(`pip install exao_dap_client[table]`).
+'''
+import datetime
+import glob
+import logging
+import os
+import os.path
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+log = logging.getLogger(__name__)
+
+DEFAULT_ROW_GROUP_SIZE = 10_000
+PART_PATTERN = 'part-{:05}.parquet'
+
+_FILE_COLUMNS = ('checksum_md5', 'size_bytes', 'created_at')
+
+
+def flatten_payload(path, payload):
+    '''One table row (as a dict of column name to value) from the info
+    payload extracted from the file at `path`
+    '''
+    row = {'path': path}
+    for key in _FILE_COLUMNS:
+        if key in payload:
+            row[key] = payload[key]
+    headers = dict(payload.get('meta', {}).get('fits', {}))
+    extensions = headers.pop('ext', {})
+    row.update(headers)
+    for extname, ext_headers in extensions.items():
+        for keyword, value in ext_headers.items():
+            row[f'{extname}.{keyword}'] = value
+    return row
+
+
+def _column_type(values):
+    kinds = set()
+    for value in values:
+        if value is None:
+            continue
+        elif isinstance(value, bool):
+            kinds.add(pa.bool_())
+        elif isinstance(value, int):
+            kinds.add(pa.int64())
+        elif isinstance(value, float):
+            kinds.add(pa.float64())
+        elif isinstance(value, datetime.datetime):
+            kinds.add(pa.timestamp('us', tz='UTC'))
+        else:
+            kinds.add(pa.string())
+    return _common_type(kinds)
+
+
+def _common_type(types):
+    types = set(types)
+    if len(types) == 1:
+        return types.pop()
+    if types == {pa.int64(), pa.float64()}:
+        return pa.float64()
+    return pa.string()
+
+
+def _column(values, type_):
+    if type_ == pa.string():
+        values = [None if value is None else str(value) for value in values]
+    return pa.array(values, type=type_)
+
+
+class HeaderTableWriter:
+    '''Accumulates rows from `append` and writes them out to `directory`
+    as a Parquet file per `row_group_size` rows (continuing the
+    numbering of any parts already there). Use as a context manager,
+    or call `close` to write the last partial row group.
+    '''
+    def __init__(self, directory, row_group_size=DEFAULT_ROW_GROUP_SIZE):
+        self.directory = directory
+        self.row_group_size = row_group_size
+        os.makedirs(directory, exist_ok=True)
+        self._n_parts = len(_part_paths(directory))
+        self._rows = []
+        self.n_rows = 0
+
+    def append(self, path, payload):
+        self._rows.append(flatten_payload(path, payload))
+        self.n_rows += 1
+        if len(self._rows) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if not self._rows:
+            return
+        columns = {}
+        for row in self._rows:
+            for name in row:
+                columns.setdefault(name, None)
+        arrays = []
+        for name in columns:
+            values = [row.get(name) for row in self._rows]
+            arrays.append(_column(values, _column_type(values)))
+        table = pa.Table.from_arrays(arrays, names=list(columns))
+        part_path = os.path.join(self.directory, PART_PATTERN.format(self._n_parts))
+        tmp_path = f'{part_path}.tmp'
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, part_path)
+        log.debug(f'Wrote {len(self._rows)} rows to {part_path}')
+        self._n_parts += 1
+        self._rows = []
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _part_paths(directory):
+    return sorted(glob.glob(os.path.join(directory, PART_PATTERN.replace('{:05}', '*'))))
+
+
+def write_header_table(directory, path_payloads, row_group_size=DEFAULT_ROW_GROUP_SIZE):
+    '''Stream `(path, payload)` pairs (e.g. from `datum.iter_extract_info`,
+    skipping failures given as None payloads) into the header table at
+    `directory`, returning the number of rows written
+    '''
+    with HeaderTableWriter(directory, row_group_size=row_group_size) as writer:
+        for path, payload in path_payloads:
+            if payload is not None:
+                writer.append(path, payload)
+    return writer.n_rows
+
+
+def read_header_table(directory, columns=None):
+    '''Read the header table at `directory` as a `pyarrow.Table`, with
+    only `columns` (if given) read from disk. Columns missing from some
+    row groups are null there.
+    '''
+    schemas = [pq.read_schema(path) for path in _part_paths(directory)]
+    names = {}
+    for schema in schemas:
+        for field in schema:
+            if columns is None or field.name in columns:
+                names.setdefault(field.name, []).append(field.type)
+    if columns is not None:
+        names = {name: names[name] for name in columns if name in names}
+    types = {name: _common_type(field_types) for name, field_types in names.items()}
+    tables = []
+    for path, schema in zip(_part_paths(directory), schemas):
+        present = [name for name in types if name in schema.names]
+        part = pq.read_table(path, columns=present)
+        arrays = []
+        for name, type_ in types.items():
+            if name in present:
+                arrays.append(part[name].cast(type_))
+            else:
+                arrays.append(pa.nulls(part.num_rows, type=type_))
+        tables.append(pa.Table.from_arrays(arrays, names=list(types)))
+    if not tables:
+        return pa.table({})
+    return pa.concat_tables(tables)
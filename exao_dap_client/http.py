@@ -1,23 +1,112 @@
+import gzip
+import threading
 import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from urllib.parse import urljoin
 from .config import get_config
 from . import __version__
 
-def make_request(method, endpoint, payload):
+_LOCAL = threading.local()
+
+POOL_MAXSIZE = 16
+MAX_RETRIES = 5
+BACKOFF_FACTOR = 0.5
+# Statuses worth retrying an idempotent request on
+RETRY_STATUSES = (429, 502, 503, 504)
+# Those of them meaning the request wasn't handled, so retrying a POST
+# or PATCH can't register anything twice (behind a bad gateway or
+# gateway timeout the service may have handled it already)
+NOT_HANDLED_STATUSES = (429, 503)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+# Request bodies at least this big are sent gzip-compressed
+GZIP_THRESHOLD = 2**14
+
+def retries_status(method, status_code):
+    '''Whether a `method` request answered with `status_code` is
+    retried: any of `RETRY_STATUSES` for `IDEMPOTENT_METHODS`, only
+    `NOT_HANDLED_STATUSES` for others
+    '''
+    if method.upper() in IDEMPOTENT_METHODS:
+        return status_code in RETRY_STATUSES
+    return status_code in NOT_HANDLED_STATUSES
+
+class _Retry(Retry):
+    def is_retry(self, method, status_code, has_retry_after=False):
+        return retries_status(method, status_code) and super().is_retry(method, status_code, has_retry_after)
+
+def get_session() -> requests.Session:
+    '''Session for talking to the service from the current thread,
+    keeping connections alive in a pool and retrying with
+    exponential backoff on connection errors and the statuses allowed
+    by `retries_status` (honoring Retry-After). Errors reading the
+    response aren't retried, as the service may have acted on the
+    request already.
+    '''
+    if not hasattr(_LOCAL, 'session'):
+        retry = _Retry(
+            total=MAX_RETRIES,
+            read=0,
+            backoff_factor=BACKOFF_FACTOR,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=None,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _LOCAL.session = session
+    return _LOCAL.session
+
+def encode_body(payload):
+    '''Serialize `payload` to JSON, gzip-compressing it if it is at
+    least `GZIP_THRESHOLD` bytes
+
+    Returns
+    -------
+    body : bytes
+    headers : dict
+        Content-Type and (if compressed) Content-Encoding headers
+    '''
+    body = orjson.dumps(payload)
+    headers = {'Content-Type': 'application/json'}
+    if GZIP_THRESHOLD is not None and len(body) >= GZIP_THRESHOLD:
+        body = gzip.compress(body, compresslevel=5)
+        headers['Content-Encoding'] = 'gzip'
+    return body, headers
+
+def prepare_request(endpoint, payload):
+    '''Everything needed to send `payload` to `endpoint` on the
+    configured service, shared by the blocking and asyncio clients
+
+    Returns
+    -------
+    url : str
+    body : bytes
+    headers : dict
+    timeout : float
+    '''
     config = get_config()
     url = urljoin(config.SERVICE_URL, endpoint)
-    headers = {
-        'User-Agent': f'exao_dap_client / {__version__}',
-        'Content-Type': 'application/json',
-        'Authorization': f'Token {config.TOKEN}'
-    }
-    resp = method(url, headers=headers, data=orjson.dumps(payload))
+    body, headers = encode_body(payload)
+    headers['User-Agent'] = f'exao_dap_client / {__version__}'
+    headers['Authorization'] = f'Token {config.TOKEN}'
+    return url, body, headers, config.HTTP_TIMEOUT
+
+def make_request(method, endpoint, payload):
+    url, body, headers, timeout = prepare_request(endpoint, payload)
+    resp = get_session().request(method, url, headers=headers, data=body, timeout=timeout)
     resp.raise_for_status()
-    return orjson.loads(resp.text)
+    return orjson.loads(resp.content)
 
 def get(endpoint, payload):
-    return make_request(requests.get, endpoint, payload)
+    return make_request('GET', endpoint, payload)
 
 def post(endpoint, payload):
-    return make_request(requests.post, endpoint, payload)
+    return make_request('POST', endpoint, payload)
+
+def patch(endpoint, payload):
+    return make_request('PATCH', endpoint, payload)
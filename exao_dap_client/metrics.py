@@ -0,0 +1,170 @@
+'''Counters and timings for `data_store.sync`, to tell whether a slow
+sync is bound by listing the catalog, hashing, or bandwidth.
+
+A `FileMetrics` is filled in while each file is synced and folded
+into the run's `SyncMetrics` when it's done, which can report live
+progress and be written out as JSON lines or as a Prometheus
+node_exporter textfile.
+'''
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+import os
+import threading
+import time
+import orjson
+
+PROMETHEUS_PREFIX = 'dap_sync'
+
+
+@dataclass
+class FileMetrics:
+    relpath: str
+    action: str
+    size: int = 0
+    bytes_transferred: int = 0
+    bytes_hashed: int = 0
+    checksum_seconds: float = 0.0
+    copy_seconds: float = 0.0
+    skipped: bool = False
+    error: str = None
+
+    @contextmanager
+    def timing(self, attr):
+        '''Add the time spent in the block to `attr`'''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            setattr(self, attr, getattr(self, attr) + time.perf_counter() - start)
+
+
+class SyncMetrics:
+    '''Aggregate metrics for one sync run, safe to update from worker
+    threads
+
+    Parameters
+    ----------
+    progress : callable or None
+        called with this `SyncMetrics` after each file is done
+    keep_files : bool
+        whether to keep every `FileMetrics` (for `write_json_lines`)
+    '''
+    COUNTERS = (
+        'files_transferred', 'files_skipped', 'files_failed',
+        'bytes_transferred', 'bytes_hashed',
+        'dest_listing_seconds', 'src_listing_seconds',
+        'checksum_seconds', 'copy_seconds',
+    )
+
+    def __init__(self, progress=None, keep_files=True):
+        self.progress = progress
+        self.keep_files = keep_files
+        self.files = []
+        self.started = time.time()
+        self.finished = None
+        self._lock = threading.Lock()
+        for name in self.COUNTERS:
+            setattr(self, name, 0)
+
+    @contextmanager
+    def timing(self, attr):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(**{attr: time.perf_counter() - start})
+
+    def timed_iter(self, iterable, attr):
+        '''Iterate over `iterable`, adding the time spent waiting for
+        each item to `attr` (e.g. for a streamed listing)
+        '''
+        iterator = iter(iterable)
+        while True:
+            with self.timing(attr):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def add(self, **amounts):
+        with self._lock:
+            for name, amount in amounts.items():
+                setattr(self, name, getattr(self, name) + amount)
+
+    def file_done(self, file_metrics):
+        with self._lock:
+            if file_metrics.error is not None:
+                self.files_failed += 1
+            elif file_metrics.skipped:
+                self.files_skipped += 1
+            else:
+                self.files_transferred += 1
+            self.bytes_transferred += file_metrics.bytes_transferred
+            self.bytes_hashed += file_metrics.bytes_hashed
+            self.checksum_seconds += file_metrics.checksum_seconds
+            self.copy_seconds += file_metrics.copy_seconds
+            if self.keep_files:
+                self.files.append(file_metrics)
+        if self.progress is not None:
+            self.progress(self)
+
+    def finish(self):
+        self.finished = time.time()
+
+    @property
+    def elapsed_seconds(self):
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def files_done(self):
+        return self.files_transferred + self.files_skipped + self.files_failed
+
+    def summary(self):
+        '''Counters plus derived rates in bytes per second. Copy and
+        checksum throughput are per worker (bytes over time spent in
+        those steps, summed over threads), the overall rate is bytes
+        transferred over wall time.
+        '''
+        with self._lock:
+            summary = {name: getattr(self, name) for name in self.COUNTERS}
+        summary['elapsed_seconds'] = self.elapsed_seconds
+        summary['copy_bytes_per_second'] = (
+            summary['bytes_transferred'] / summary['copy_seconds'] if summary['copy_seconds'] else None
+        )
+        summary['checksum_bytes_per_second'] = (
+            summary['bytes_hashed'] / summary['checksum_seconds'] if summary['checksum_seconds'] else None
+        )
+        summary['overall_bytes_per_second'] = (
+            summary['bytes_transferred'] / summary['elapsed_seconds'] if summary['elapsed_seconds'] else None
+        )
+        return summary
+
+    def write_json_lines(self, fh):
+        '''Write one JSON object per file (if kept), then one for the
+        summary, to binary file handle `fh`
+        '''
+        for file_metrics in self.files:
+            fh.write(orjson.dumps(dict(asdict(file_metrics), record='file')) + b'\n')
+        fh.write(orjson.dumps(dict(self.summary(), record='summary')) + b'\n')
+
+    def prometheus_text(self):
+        lines = []
+        for name, value in self.summary().items():
+            if value is None:
+                continue
+            metric = f'{PROMETHEUS_PREFIX}_{name}'
+            lines.append(f'# TYPE {metric} gauge')
+            lines.append(f'{metric} {float(value)!r}')
+        lines.append(f'# TYPE {PROMETHEUS_PREFIX}_last_run_timestamp_seconds gauge')
+        lines.append(f'{PROMETHEUS_PREFIX}_last_run_timestamp_seconds {self.finished or time.time()!r}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        '''Write the summary as a Prometheus textfile at `path`,
+        replacing it atomically so the collector never reads half
+        '''
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as fh:
+            fh.write(self.prometheus_text())
+        os.replace(tmp_path, path)
@@ -0,0 +1,71 @@
+import asyncio
+import orjson
+import pytest
+from . import dataset, datum
+
+httpx = pytest.importorskip('httpx')
+from . import aio
+
+
+def _run(coro):
+    async def run_and_close():
+        try:
+            return await coro
+        finally:
+            await aio.close()
+    return asyncio.run(run_and_close())
+
+
+def test_concurrent_requests_share_connections(stub_server):
+    async def many():
+        return await asyncio.gather(*(aio.get('/api/v1/things/', {'q': i % 10}) for i in range(50)))
+    assert _run(many()) == [{'ok': True, 'length': 7}] * 50
+    assert len({req[4] for req in stub_server.requests}) <= aio.MAX_CONCURRENT_REQUESTS
+    assert stub_server.requests[0][2]['Authorization'] == 'Token secret'
+
+
+def test_retries_unavailable(stub_server):
+    failures = iter([503, 429])
+    stub_server.handler = lambda method, path, body: (next(failures, 200), {})
+    assert _run(aio.post('/api/v1/things/', {})) == {}
+    assert len(stub_server.requests) == 3
+
+
+def test_no_retry_after_request_sent(stub_server):
+    def drop_connection(method, path, body):
+        raise ConnectionAbortedError('handled, but no response sent')
+    stub_server.handler = drop_connection
+    with pytest.raises(httpx.TransportError):
+        _run(aio.post('/api/v1/things/', {}))
+    assert len(stub_server.requests) == 1
+
+
+def test_gateway_errors_retried_only_for_idempotent_methods(stub_server):
+    stub_server.handler = lambda method, path, body: (504, {})
+    with pytest.raises(httpx.HTTPStatusError):
+        _run(aio.patch('/api/v1/things/', {}))
+    assert len(stub_server.requests) == 1
+    failures = iter([504, 502])
+    stub_server.handler = lambda method, path, body: (next(failures, 200), {})
+    assert _run(aio.get('/api/v1/things/', {})) == {}
+    assert len(stub_server.requests) == 4
+
+
+def test_errors_raised(stub_server):
+    stub_server.handler = lambda method, path, body: (400, {})
+    with pytest.raises(httpx.HTTPStatusError):
+        _run(aio.post('/api/v1/things/', {}))
+
+
+def test_ingest_in_batches(stub_server):
+    payloads = [{'kind': datum.DatumKind.SCIENCE, 'filename': f'{i}.fits'} for i in range(10)]
+    _run(aio.ingest_in_batches(
+        '/iplant/home/example/raw', 'example',
+        dataset.DatasetSource.ON_SKY, dataset.DatasetStage.RAW, datum.DatumKind.SCIENCE,
+        None, None, payloads, batch_size=3
+    ))
+    methods = [(r[0], r[1]) for r in stub_server.requests]
+    assert methods[0] == ('POST', '/api/v1/registrar/datasets/')
+    assert methods[-1] == ('PATCH', '/api/v1/registrar/datasets/example/')
+    sent = [p['filename'] for r in stub_server.requests[1:-1] for p in orjson.loads(r[3])['data']]
+    assert sorted(sent) == sorted(p['filename'] for p in payloads)
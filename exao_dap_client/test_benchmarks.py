@@ -0,0 +1,15 @@
+from . import benchmarks
+
+
+def test_run_benchmarks(tmp_path):
+    shape = benchmarks.TreeShape(n_dirs=2, files_per_dir=2, image_shape=(8, 8), n_keywords=2)
+    results = list(benchmarks.run_benchmarks(str(tmp_path), shape, repeat=1))
+    assert len(results) == len(benchmarks.BENCHMARKS)
+    assert all(result['seconds_min'] > 0 and result['n_files'] == 4 for result in results)
+
+    slower = [dict(result, seconds_min=2 * result['seconds_min']) for result in results]
+    comparisons, regressions = benchmarks.compare(slower, results)
+    assert len(comparisons) == len(results)
+    assert len(regressions) == len(results)
+    _, regressions = benchmarks.compare(results, slower)
+    assert regressions == []
@@ -0,0 +1,70 @@
+import hashlib
+import os
+from . import cache
+
+
+def test_checksum_index_reuses_and_invalidates(tmp_path, monkeypatch):
+    index = cache.ChecksumIndex(str(tmp_path / 'index.sqlite'))
+    path = tmp_path / 'data.bin'
+    path.write_bytes(b'first version')
+    assert index.md5sum(str(path)) == hashlib.md5(b'first version').hexdigest()
+
+    # a valid entry is answered without reading the file
+    monkeypatch.setattr(cache.utils, 'size_and_md5sum', lambda fh: 1 / 0)
+    assert index.md5sum(str(path)) == hashlib.md5(b'first version').hexdigest()
+    monkeypatch.undo()
+
+    path.write_bytes(b'second version!')
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+    assert index.lookup(str(path)) is None
+    assert index.md5sum(str(path)) == hashlib.md5(b'second version!').hexdigest()
+
+
+def test_checksum_index_evicts_least_recently_used(tmp_path):
+    index = cache.ChecksumIndex(str(tmp_path / 'index.sqlite'), max_entries=10)
+    paths = []
+    for i in range(12):
+        path = tmp_path / f'file_{i}'
+        path.write_bytes(str(i).encode('utf8'))
+        paths.append(str(path))
+        index.md5sum(paths[-1])
+    index.lookup(paths[0])  # touch the oldest so it survives
+    assert index.evict() > 0
+    assert index.lookup(paths[0]) is not None
+    assert index.lookup(paths[1]) is None
+
+
+def test_block_digest_index_checks_whole_file_md5(tmp_path):
+    index = cache.BlockDigestIndex(str(tmp_path / 'blocks.sqlite'))
+    index.record('irods://host:1247/zone/file.fits', 'a' * 32, 1024, ['b' * 32, 'c' * 32])
+    assert index.lookup('irods://host:1247/zone/file.fits', 'a' * 32, 1024) == ['b' * 32, 'c' * 32]
+    assert index.lookup('irods://host:1247/zone/file.fits', 'd' * 32, 1024) is None
+    assert index.lookup('irods://host:1247/zone/file.fits', 'a' * 32, 2048) is None
+    assert index.lookup('irods://host:1247/zone/other.fits', 'a' * 32, 1024) is None
+
+
+def test_metadata_cache_evicts_to_size_cap(tmp_path):
+    metadata = cache.MetadataCache(str(tmp_path / 'metadata.sqlite'), max_bytes=1000)
+    for i in range(10):
+        metadata.record(f'{i:032x}', {'meta': {'fits': {'OBJECT': 'x' * 180}}})
+    metadata.lookup(f'{0:032x}')  # touch the oldest so it survives
+    assert metadata.evict() > 0
+    assert metadata.lookup(f'{0:032x}') == {'meta': {'fits': {'OBJECT': 'x' * 180}}}
+    assert metadata.lookup(f'{1:032x}') is None
+    assert metadata.lookup(f'{9:032x}') is not None
+
+
+def test_local_path_of_only_trusts_local_files(tmp_path):
+    import fsspec
+    path = tmp_path / 'data.bin'
+    path.write_bytes(b'contents')
+    with open(path, 'rb') as fh:
+        assert cache.local_path_of(fh) == str(path)
+    with fsspec.filesystem('file').open(str(path), 'rb') as fh:
+        assert cache.local_path_of(fh) == str(path)
+    # a remote file whose path happens to exist locally too
+    memfs = fsspec.filesystem('memory')
+    memfs.pipe_file(str(path), b'other contents')
+    with memfs.open(str(path), 'rb') as fh:
+        assert cache.local_path_of(fh) is None
@@ -0,0 +1,55 @@
+import os.path
+import subprocess
+import sys
+import pytest
+from . import cli
+
+# modules that take a noticeable fraction of a second to import, which
+# `dap` should only pay for when the command being run needs them
+HEAVY_MODULES = ('astropy', 'numpy', 'fsspec', 'irods', 'irods_fsspec', 'requests', 'httpx')
+# seconds, for importing the CLI module (interpreter startup aside)
+IMPORT_BUDGET = 0.15
+
+_PROBE = '''
+import sys
+from exao_dap_client import cli
+try:
+    cli.main(sys.argv[1:])
+except SystemExit:
+    pass
+print(' '.join(sorted({name.split('.')[0] for name in sys.modules} & set(%r))))
+'''
+
+
+def _run_cli(*args):
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', _PROBE % (HEAVY_MODULES,), *args],
+        capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    cumulative_us = None
+    for line in proc.stderr.splitlines():
+        if line.startswith('import time:') and line.rstrip().endswith(' exao_dap_client.cli'):
+            cumulative_us = int(line.split('|')[1])
+    return proc.stdout.splitlines()[-1].split(), cumulative_us / 1e6
+
+
+def test_help_imports_nothing_heavy():
+    heavy, import_seconds = _run_cli('--help')
+    assert heavy == []
+    assert import_seconds < IMPORT_BUDGET
+
+
+def test_extract_info_on_non_fits_skips_astropy(tmp_path):
+    path = tmp_path / 'notes.txt'
+    path.write_text('not a FITS file')
+    heavy, _ = _run_cli('extract_info', str(path))
+    assert 'astropy' not in heavy
+    assert 'irods' not in heavy
+
+
+@pytest.mark.parametrize("name", sorted(cli.COMMANDS))
+def test_command_registry(name):
+    command_cls = cli.load_command(name)
+    assert command_cls.name == name
+    assert command_cls.help == cli.COMMANDS[name][2]
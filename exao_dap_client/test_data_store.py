@@ -0,0 +1,560 @@
+import concurrent.futures
+import datetime
+import hashlib
+import os
+import threading
+import types
+import pytest
+from . import data_store
+
+
+def _make_tree(root, n_dirs=3, n_files=4):
+    for d in range(n_dirs):
+        dirpath = root / f'dir_{d}'
+        dirpath.mkdir(parents=True)
+        for f in range(n_files):
+            (dirpath / f'file_{f}.dat').write_bytes(os.urandom(128 + f))
+
+
+def _read_tree(root):
+    contents = {}
+    for dirpath, _, filenames in os.walk(root):
+        for fn in filenames:
+            if fn == data_store.SYNC_MANIFEST_NAME:
+                continue
+            path = os.path.join(dirpath, fn)
+            with open(path, 'rb') as fh:
+                contents[os.path.relpath(path, root)] = fh.read()
+    return contents
+
+
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_sync_local(tmp_path, jobs):
+    src, dest = tmp_path / 'src', tmp_path / 'dest'
+    _make_tree(src)
+    dest.mkdir()
+    failures = data_store.sync(str(src), str(dest), jobs=jobs)
+    assert failures == {}
+    assert _read_tree(src) == _read_tree(dest)
+
+
+
+def test_sync_new_files_not_probed(tmp_path, monkeypatch):
+    src, dest = tmp_path / 'src', tmp_path / 'dest'
+    _make_tree(src, n_dirs=2)
+    fs = data_store.get_fs(str(dest))
+    probed = []
+    orig_exists = type(fs).exists
+    def recording_exists(self, path, **kwargs):
+        probed.append(path)
+        return orig_exists(self, path, **kwargs)
+    monkeypatch.setattr(type(fs), 'exists', recording_exists)
+    assert data_store.sync(str(src), str(dest)) == {}
+    # the plan already knows new files aren't at the destination
+    assert not [path for path in probed if path.endswith('.dat')]
+
+
+def test_sync_reports_failures(tmp_path, monkeypatch):
+    src, dest = tmp_path / 'src', tmp_path / 'dest'
+    _make_tree(src, n_dirs=1)
+    dest.mkdir()
+    orig_sync_single_file = data_store.sync_single_file
+    def flaky_sync_single_file(src_path, dest_path, **kwargs):
+        if src_path.endswith('file_1.dat'):
+            raise IOError("simulated transfer failure")
+        return orig_sync_single_file(src_path, dest_path, **kwargs)
+    monkeypatch.setattr(data_store, 'sync_single_file', flaky_sync_single_file)
+    failures = data_store.sync(str(src), str(dest), jobs=2)
+    assert list(failures) == [str(src / 'dir_0' / 'file_1.dat')]
+    assert len(_read_tree(dest)) == 3
+
+
+def test_local_checkouts_not_bounded(tmp_path):
+    n_threads = 2 * data_store.fs_pool.DEFAULT_MAX_SIZE
+    # fails if any thread is kept waiting for an instance
+    barrier = threading.Barrier(n_threads, timeout=5)
+    def work(_):
+        with data_store.checkout_fs(str(tmp_path)) as fs:
+            barrier.wait()
+            return fs
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_threads) as executor:
+        instances = set(executor.map(work, range(n_threads)))
+    assert instances == {data_store.get_fs(str(tmp_path))}
+
+
+def test_copy_between_filesystems_hashes_while_copying(tmp_path, monkeypatch):
+    src = tmp_path / 'src.dat'
+    src.write_bytes(os.urandom(4096))
+    srcfs = data_store.get_fs(str(src))
+    memfs = data_store.get_fs('memory://')
+    digest = data_store.copy_between_filesystems(str(src), srcfs, '/copied.dat', memfs)
+    assert digest == hashlib.md5(src.read_bytes()).hexdigest()
+    assert memfs.cat_file('/copied.dat') == src.read_bytes()
+    assert data_store.cache.get_checksum_index().lookup(str(src)) == digest
+
+    monkeypatch.setattr(data_store, 'reported_md5', lambda fs, path: '0' * 32)
+    with pytest.raises(data_store.ChecksumMismatchError):
+        data_store.copy_between_filesystems(str(src), srcfs, '/copied.dat', memfs)
+
+
+def test_copy_ranged_to_local(tmp_path, monkeypatch):
+    # (not from the memory filesystem, which hands every reader the
+    # same file object)
+    data = os.urandom(10_000)
+    src = tmp_path / 'src.dat'
+    src.write_bytes(data)
+    dest = tmp_path / 'big.dat'
+    fs = data_store.get_fs(str(dest))
+    data_store.copy_between_filesystems(
+        str(src), fs, str(dest), fs,
+        ranged_threshold=1000
+    )
+    assert dest.read_bytes() == data
+    # shrinking an existing destination works too, streaming each
+    # part in several chunks
+    monkeypatch.setattr(data_store.utils, 'DEFAULT_CHUNK_SIZE', 300)
+    src.write_bytes(data[:5000])
+    data_store.copy_ranged(str(src), fs, str(dest), fs, part_size=999)
+    assert dest.read_bytes() == data[:5000]
+
+
+def test_copy_resumes_after_interruption(tmp_path, monkeypatch):
+    data = os.urandom(10_000)
+    src, dest = tmp_path / 'src.dat', tmp_path / 'dest' / 'copy.dat'
+    src.write_bytes(data)
+    dest.parent.mkdir()
+    fs = data_store.get_fs(str(src))
+    orig_record = data_store.PartialTransfer.record
+    def interrupted_record(self, idx, md5):
+        orig_record(self, idx, md5)
+        if idx == 3:
+            raise IOError("simulated interruption")
+    monkeypatch.setattr(data_store.PartialTransfer, 'record', interrupted_record)
+    with pytest.raises(IOError):
+        data_store.copy_between_filesystems(str(src), fs, str(dest), fs, resume_chunk_size=1000)
+    monkeypatch.undo()
+    assert not dest.exists()
+    assert data_store.list_tree(fs, str(dest.parent)) == {}
+    partial = dest.parent / f'.copy.dat{data_store.PARTIAL_SUFFIX}'
+    # damage the third chunk, so only the first two are kept
+    with open(partial, 'r+b') as fh:
+        fh.seek(2500)
+        fh.write(b'garbage')
+
+    read_from = []
+    orig_read_in_chunks = data_store.utils.read_in_chunks
+    def recording_read_in_chunks(file_object, *args, **kwargs):
+        read_from.append(file_object.tell())
+        return orig_read_in_chunks(file_object, *args, **kwargs)
+    monkeypatch.setattr(data_store.utils, 'read_in_chunks', recording_read_in_chunks)
+    digest = data_store.copy_between_filesystems(str(src), fs, str(dest), fs, resume_chunk_size=1000)
+    assert read_from == [2000]
+    assert digest == hashlib.md5(data).hexdigest()
+    assert dest.read_bytes() == data
+    assert sorted(os.listdir(dest.parent)) == ['copy.dat']
+
+
+def test_sync_resumes_after_interruption(tmp_path, monkeypatch):
+    data = os.urandom(10_000)
+    src, dest = tmp_path / 'src', tmp_path / 'dest'
+    src.mkdir()
+    (src / 'big.dat').write_bytes(data)
+    monkeypatch.setattr(data_store, 'RESUME_CHUNK_SIZE', 1000)
+    orig_record = data_store.PartialTransfer.record
+    def interrupted_record(self, idx, md5):
+        orig_record(self, idx, md5)
+        if idx == 3:
+            raise IOError("simulated interruption")
+    monkeypatch.setattr(data_store.PartialTransfer, 'record', interrupted_record)
+    assert list(data_store.sync(str(src), str(dest))) == [str(src / 'big.dat')]
+    assert not (dest / 'big.dat').exists()
+
+    monkeypatch.setattr(data_store.PartialTransfer, 'record', orig_record)
+    read_from = []
+    orig_read_in_chunks = data_store.utils.read_in_chunks
+    def recording_read_in_chunks(file_object, *args, **kwargs):
+        read_from.append(file_object.tell())
+        return orig_read_in_chunks(file_object, *args, **kwargs)
+    monkeypatch.setattr(data_store.utils, 'read_in_chunks', recording_read_in_chunks)
+    assert data_store.sync(str(src), str(dest)) == {}
+    assert read_from == [4000]
+    assert _read_tree(dest) == {'big.dat': data}
+
+
+def test_sync_delta(tmp_path, monkeypatch):
+    # a memory filesystem stands in for iRODS
+    memfs = data_store.get_fs('memory://')
+    session = FakeSession(FakeIRODSDataObjects(memfs))
+    session.host, session.port = 'irods.example.com', 1247
+    monkeypatch.setattr(data_store, 'is_irods', lambda fs: fs is memfs)
+    monkeypatch.setattr(type(memfs), 'session', session, raising=False)
+    dest = tmp_path / 'dest' / 'big.dat'
+    dest.parent.mkdir()
+    data = bytearray(os.urandom(10_000))
+    dest.write_bytes(data)
+    data[4100:4110] = b'0123456789'
+    data.extend(b'appended')
+    memfs.pipe_file('/delta/big.dat', bytes(data))
+    md5 = hashlib.md5(data).hexdigest()
+    fs = data_store.get_fs(str(dest))
+
+    # without the source's block digests it must be copied whole
+    assert data_store.delta_copy('/delta/big.dat', memfs, str(dest), fs, src_md5=md5, block_size=1000) is None
+    block_digests = [hashlib.md5(data[offset:offset + 1000]).hexdigest() for offset in range(0, len(data), 1000)]
+    data_store._record_block_digests(memfs, '/delta/big.dat', md5, block_digests, block_size=1000)
+    digest, written = data_store.delta_copy('/delta/big.dat', memfs, str(dest), fs, src_md5=md5, block_size=1000)
+    assert digest == md5
+    # the changed block and the new partial last one
+    assert written == 1000 + 8
+    assert dest.read_bytes() == data
+    assert os.listdir(dest.parent) == ['big.dat']
+
+    # local copies gain nothing from it, and are copied whole
+    src = tmp_path / 'src'
+    src.mkdir()
+    (src / 'big.dat').write_bytes(b'hello' + data[5:])
+    assert data_store.sync(str(src), str(dest.parent), delta=True) == {}
+    assert dest.read_bytes() == b'hello' + data[5:]
+
+
+def test_expand_paths(tmp_path):
+    _make_tree(tmp_path / 'tree', n_dirs=2, n_files=2)
+    (tmp_path / 'tree' / '.hidden').write_bytes(b'')
+    (tmp_path / 'tree' / '__pycache__').mkdir()
+    (tmp_path / 'tree' / '__pycache__' / 'x.pyc').write_bytes(b'')
+    single = str(tmp_path / 'tree' / 'dir_0' / 'file_0.dat')
+    found = list(data_store.expand_paths([str(tmp_path / 'tree'), str(tmp_path / 'tree' / '*' / 'file_1.dat'), single]))
+    assert sorted(found[:4]) == sorted(str(p) for p in (tmp_path / 'tree').glob('dir_*/file_*.dat'))
+    assert sorted(found[4:6]) == sorted(str(p) for p in (tmp_path / 'tree').glob('dir_*/file_1.dat'))
+    assert found[6:] == [single]
+
+
+def test_sync_to_memory_lists_once(tmp_path, monkeypatch):
+    src = tmp_path / 'src'
+    _make_tree(src, n_dirs=2, n_files=3)
+    (src / 'dir_0' / '.hidden').write_bytes(b'x')
+    (src / 'empty').mkdir()
+    memfs = data_store.get_fs('memory://')
+    memfs.pipe_file('/listing_test/dir_1/file_0.dat', (src / 'dir_1' / 'file_0.dat').read_bytes())
+    ls_calls = []
+    in_mkdir = []
+    orig_ls, orig_mkdir = type(memfs).ls, type(memfs).mkdir
+    def counting_ls(self, path, *args, **kwargs):
+        if not in_mkdir:
+            ls_calls.append(path)
+        return orig_ls(self, path, *args, **kwargs)
+    def mkdir(self, path, *args, **kwargs):
+        # the memory filesystem checks parents exist by listing them
+        in_mkdir.append(path)
+        try:
+            return orig_mkdir(self, path, *args, **kwargs)
+        finally:
+            in_mkdir.pop()
+    monkeypatch.setattr(type(memfs), 'ls', counting_ls)
+    monkeypatch.setattr(type(memfs), 'mkdir', mkdir)
+    copied = []
+    orig_copy = data_store.copy_between_filesystems
+    def recording_copy(src_path, srcfs, dest_path, destfs, **kwargs):
+        copied.append(dest_path)
+        return orig_copy(src_path, srcfs, dest_path, destfs, **kwargs)
+    monkeypatch.setattr(data_store, 'copy_between_filesystems', recording_copy)
+
+    assert data_store.sync(str(src), 'memory:///listing_test') == {}
+    assert len(copied) == 5 and '/listing_test/dir_1/file_0.dat' not in copied
+    for path, content in _read_tree(src).items():
+        if not path.endswith('.hidden'):
+            assert memfs.cat_file(f'/listing_test/{path}') == content
+    assert not memfs.exists('/listing_test/dir_0/.hidden')
+    assert memfs.isdir('/listing_test/empty')
+    # one walk of the destination tree, nothing per file (the root is
+    # looked up again to save the manifest)
+    assert ls_calls.count('/listing_test/dir_1') == 1
+    assert set(ls_calls) == {'/listing_test', '/listing_test/dir_1'}
+
+
+def test_sync_plan(tmp_path):
+    src, dest = tmp_path / 'src', tmp_path / 'dest'
+    _make_tree(src, n_dirs=2)
+    dest.mkdir()
+    data_store.sync(str(src / 'dir_0'), str(dest / 'dir_0'))
+    # checksums both sides into the index
+    data_store.sync(str(src / 'dir_0'), str(dest / 'dir_0'), use_manifest=False)
+    (dest / 'dir_0' / 'file_0.dat').write_bytes(b'x' * 5)
+    (dest / 'dir_0' / 'extra.dat').write_bytes(b'y')
+
+    plan = data_store.make_sync_plan(str(src), str(dest))
+    actions = {entry.relpath: entry.action for entry in plan.entries}
+    assert actions['dir_1'] is data_store.SyncAction.MKDIR
+    assert actions['dir_1/file_0.dat'] is data_store.SyncAction.NEW
+    assert actions['dir_0/file_0.dat'] is data_store.SyncAction.CHANGED_SIZE
+    assert actions['dir_0/file_1.dat'] is data_store.SyncAction.IDENTICAL
+    assert actions['dir_0/extra.dat'] is data_store.SyncAction.EXTRA
+    summary = plan.summary()
+    assert summary['bytes_to_transfer'] == sum(128 + f for f in range(4)) + 128
+    assert summary['bytes_to_hash'] == 0
+
+    plan.save(tmp_path / 'plan.json')
+    loaded = data_store.SyncPlan.load(tmp_path / 'plan.json')
+    assert loaded == plan
+    parts = loaded.split(2)
+    assert sorted(e.relpath for part in parts for e in part.entries if e.action is not data_store.SyncAction.MKDIR) == \
+        sorted(e.relpath for e in plan.entries if e.action is not data_store.SyncAction.MKDIR)
+    for part in parts:
+        assert data_store.execute_sync_plan(part, jobs=2) == {}
+    assert _read_tree(src).items() <= _read_tree(dest).items()
+
+
+def test_sync_manifest(tmp_path, monkeypatch):
+    src, dest = tmp_path / 'src', tmp_path / 'dest'
+    _make_tree(src)
+    data_store.sync(str(src), str(dest))
+    manifest = data_store.SyncManifest.load(data_store.get_fs(str(dest)), str(dest), str(src))
+    assert len(manifest.files) == 12
+
+    (src / 'dir_1' / 'file_0.dat').write_bytes(b'changed')
+    def no_listing(fs, root):
+        raise AssertionError("destination listed despite the manifest")
+    monkeypatch.setattr(data_store, 'list_tree', no_listing)
+    plan = data_store.make_sync_plan(str(src), str(dest))
+    changed = {entry.relpath for entry in plan.entries if entry.action is not data_store.SyncAction.IDENTICAL}
+    assert changed == {'dir_1/file_0.dat'}
+    assert data_store.sync(str(src), str(dest)) == {}
+    assert _read_tree(src) == _read_tree(dest)
+    monkeypatch.undo()
+
+    # a manifest that doesn't match the destination is not trusted
+    (dest / 'dir_2' / 'file_3.dat').unlink()
+    plan = data_store.make_sync_plan(str(src), str(dest))
+    assert [entry.relpath for entry in plan.entries if entry.action is data_store.SyncAction.NEW] == ['dir_2/file_3.dat']
+
+    # and is replaced even where renaming can't overwrite (as on iRODS)
+    fs = data_store.get_fs(str(dest))
+    orig_mv = type(fs).mv
+    def no_overwrite_mv(self, path1, path2, **kwargs):
+        if os.path.exists(path2):
+            raise FileExistsError(path2)
+        return orig_mv(self, path1, path2, **kwargs)
+    monkeypatch.setattr(type(fs), 'mv', no_overwrite_mv)
+    assert data_store.sync(str(src), str(dest)) == {}
+    assert len(data_store.SyncManifest.load(fs, str(dest), str(src)).files) == 12
+
+
+def test_sync_manifest_with_listed_checksums(monkeypatch):
+    # one filesystem on both sides whose listings carry checksums (as
+    # iRODS does), where the second sync compares against the manifest
+    memfs = data_store.get_fs('memory://')
+    orig_ls = type(memfs).ls
+    def ls_with_checksums(self, path, detail=False, **kwargs):
+        entries = orig_ls(self, path, detail=detail, **kwargs)
+        if not detail:
+            return entries
+        return [
+            dict(entry, checksum=hashlib.md5(self.cat_file(entry['name'])).hexdigest())
+            if entry['type'] == 'file' else entry
+            for entry in entries
+        ]
+    monkeypatch.setattr(type(memfs), 'ls', ls_with_checksums)
+    memfs.pipe_file('/manifest_checksums/src/file.dat', b'original')
+    assert data_store.sync('memory:///manifest_checksums/src', 'memory:///manifest_checksums/dest') == {}
+    assert data_store.SyncManifest.load(memfs, '/manifest_checksums/dest', '/manifest_checksums/src') is not None
+
+    memfs.pipe_file('/manifest_checksums/src/file.dat', b'modified')
+    assert data_store.sync('memory:///manifest_checksums/src', 'memory:///manifest_checksums/dest') == {}
+    assert memfs.cat_file('/manifest_checksums/dest/file.dat') == b'modified'
+
+
+def test_sync_metrics(tmp_path):
+    from .metrics import SyncMetrics
+    src, dest = tmp_path / 'src', tmp_path / 'dest'
+    _make_tree(src, n_dirs=2)
+    metrics = SyncMetrics()
+    assert data_store.sync(str(src), str(dest), metrics=metrics) == {}
+    summary = metrics.summary()
+    assert summary['files_transferred'] == 8
+    assert summary['bytes_transferred'] == 2 * sum(128 + f for f in range(4))
+    assert len(metrics.files) == 8
+
+    (src / 'dir_0' / 'file_0.dat').write_bytes(os.urandom(128))
+    metrics = SyncMetrics()
+    data_store.sync(str(src), str(dest), metrics=metrics, use_manifest=False)
+    summary = metrics.summary()
+    assert (summary['files_transferred'], summary['files_skipped']) == (1, 7)
+    # only the rewritten file, as the rest were indexed when copied
+    assert summary['bytes_hashed'] == 128
+
+    metrics.write_prometheus(tmp_path / 'sync.prom')
+    text = (tmp_path / 'sync.prom').read_text()
+    assert 'dap_sync_bytes_transferred 128.0' in text
+
+
+class FakeSession:
+    def __init__(self, data_objects):
+        self.data_objects = data_objects
+
+
+def test_server_checksums(tmp_path, monkeypatch):
+    # memory filesystems stand in for iRODS, whose server checksums
+    # data objects in place
+    memfs = data_store.get_fs('memory://')
+    checksummed = []
+    class FakeDataObjects:
+        def chksum(self, path):
+            checksummed.append(path)
+            return hashlib.md5(memfs.cat_file(path)).hexdigest()
+    monkeypatch.setattr(data_store, 'is_irods', lambda fs: isinstance(fs, type(memfs)))
+    monkeypatch.setattr(type(memfs), 'session', FakeSession(FakeDataObjects()), raising=False)
+    src = tmp_path / 'src'
+    src.mkdir()
+    contents = {'same.dat': os.urandom(100), 'changed.dat': os.urandom(100)}
+    for name, content in contents.items():
+        (src / name).write_bytes(content)
+    memfs.pipe_file('/server_checksums/same.dat', contents['same.dat'])
+    memfs.pipe_file('/server_checksums/changed.dat', os.urandom(100))
+
+    entries = [
+        data_store.PlanEntry(
+            name, data_store.SyncAction.NEEDS_CHECKSUM, src_size=100, dest_size=100,
+            src_checksum=hashlib.md5(content).hexdigest()
+        )
+        for name, content in contents.items()
+    ]
+    entries = list(data_store._with_server_checksums(
+        entries, str(src), 'memory:///server_checksums', str(src), '/server_checksums', batch_size=1
+    ))
+    assert [entry.action for entry in entries] == [
+        data_store.SyncAction.IDENTICAL, data_store.SyncAction.CHANGED_CHECKSUM
+    ]
+    assert sorted(checksummed) == ['/server_checksums/changed.dat', '/server_checksums/same.dat']
+
+    # only the local side is read to compare
+    metrics = data_store.FileMetrics('same.dat', 'sync')
+    data_store.sync_single_file(str(src / 'same.dat'), '/server_checksums/same.dat', destfs=memfs, metrics=metrics)
+    assert (metrics.bytes_hashed, metrics.bytes_transferred) == (100, 0)
+
+
+def test_source_stamp_of_irods_file(monkeypatch):
+    memfs = data_store.get_fs('memory://')
+    memfs.pipe_file('/stamp/file.dat', b'0123456789')
+    monkeypatch.setattr(data_store, 'is_irods', lambda fs: fs is memfs)
+    checksums = {'/stamp/file.dat': 'b0b2b4a4d1ef3c4f0c29b3c1bd2e5e1a'}
+    orig_info = type(memfs).info
+    def catalog_info(self, path, **kwargs):
+        return dict(orig_info(self, path, **kwargs), checksum=checksums.get(path))
+    monkeypatch.setattr(type(memfs), 'info', catalog_info)
+    assert data_store._source_stamp(memfs, '/stamp/file.dat', 10) == [10, checksums['/stamp/file.dat']]
+
+    # without a registered checksum, the data object's modification time
+    checksums.clear()
+    modified = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+    class FakeDataObjects:
+        def get(self, path):
+            return types.SimpleNamespace(modify_time=modified)
+    monkeypatch.setattr(type(memfs), 'session', FakeSession(FakeDataObjects()), raising=False)
+    assert data_store._source_stamp(memfs, '/stamp/file.dat', 10) == [10, modified.timestamp()]
+
+
+class FakeIRODSHandle:
+    def __init__(self, data_objects, path):
+        self.data_objects = data_objects
+        self.path = path
+        self.position = 0
+        self.raw = types.SimpleNamespace(replica_access_info=lambda: ('token', 'hier'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def seek(self, position):
+        self.position = position
+
+    def write(self, data):
+        with self.data_objects.lock:
+            fh = self.data_objects.memfs.open(self.path, 'rb+')
+            fh.seek(self.position)
+            fh.write(data)
+        self.position += len(data)
+
+
+class FakeIRODSDataObjects:
+    '''Data objects kept in a memory filesystem, opened as handles with
+    positions of their own (unlike the memory filesystem's files)
+    '''
+    def __init__(self, memfs):
+        self.memfs = memfs
+        self.lock = threading.Lock()
+        self.opened = []
+
+    def exists(self, path):
+        return self.memfs.isfile(path)
+
+    def chksum(self, path, **options):
+        return hashlib.md5(self.memfs.cat_file(path)).hexdigest()
+
+    def open(self, path, mode, create=True, **options):
+        self.opened.append((path, mode))
+        if mode == 'w' or (create and not self.exists(path)):
+            self.memfs.pipe_file(path, b'')
+        elif not self.exists(path):
+            raise FileNotFoundError(path)
+        return FakeIRODSHandle(self, path)
+
+    def unlink(self, path, force=False):
+        self.memfs.rm(path)
+
+    def move(self, path1, path2):
+        if self.exists(path2):
+            raise FileExistsError(path2)
+        self.memfs.mv(path1, path2)
+
+
+def test_upload_to_irods_resumes(tmp_path, monkeypatch):
+    # a memory filesystem stands in for iRODS
+    memfs = data_store.get_fs('memory://')
+    data_objects = FakeIRODSDataObjects(memfs)
+    session = FakeSession(data_objects)
+    session.host, session.port = 'irods.example.com', 1247
+    monkeypatch.setattr(data_store, 'is_irods', lambda fs: fs is memfs)
+    monkeypatch.setattr(type(memfs), 'session', session, raising=False)
+
+    data = os.urandom(10_000)
+    src = tmp_path / 'big.dat'
+    src.write_bytes(data)
+    srcfs = data_store.get_fs(str(src))
+    memfs.pipe_file('/uploads/big.dat', b'old version')
+    orig_record = data_store.PartialTransfer.record
+    def interrupted_record(self, idx, md5):
+        orig_record(self, idx, md5)
+        if idx == 3:
+            raise IOError("simulated interruption")
+    monkeypatch.setattr(data_store.PartialTransfer, 'record', interrupted_record)
+    with pytest.raises(IOError):
+        data_store.copy_between_filesystems(
+            str(src), srcfs, '/uploads/big.dat', memfs, ranged_threshold=None, resume_chunk_size=1000
+        )
+    monkeypatch.setattr(data_store.PartialTransfer, 'record', orig_record)
+    # readers still see the old version
+    assert memfs.cat_file('/uploads/big.dat') == b'old version'
+
+    # the parallel upload picks up the parts recorded by the streamed one
+    uploaded = []
+    orig_copy_part = data_store._copy_part_to_irods
+    def recording_copy_part(src, src_fh, dest_fh, offset, length):
+        uploaded.append(offset)
+        return orig_copy_part(src, src_fh, dest_fh, offset, length)
+    monkeypatch.setattr(data_store, '_copy_part_to_irods', recording_copy_part)
+    digest = data_store.copy_ranged(str(src), srcfs, '/uploads/big.dat', memfs, part_size=1000, n_threads=3)
+    assert sorted(uploaded) == list(range(4000, 10_000, 1000))
+    assert digest == hashlib.md5(data).hexdigest()
+    assert memfs.cat_file('/uploads/big.dat') == data
+    assert sorted(memfs.ls('/uploads')) == ['/uploads/big.dat']
+
+    # files of one chunk or less are written directly
+    data_objects.opened.clear()
+    (tmp_path / 'small.dat').write_bytes(data[:1000])
+    data_store.copy_between_filesystems(
+        str(tmp_path / 'small.dat'), srcfs, '/uploads/small.dat', memfs, resume_chunk_size=1000
+    )
+    assert data_objects.opened == []
+    assert memfs.cat_file('/uploads/small.dat') == data[:1000]
@@ -0,0 +1,56 @@
+import orjson
+import pytest
+import requests
+from . import dataset, datum
+
+
+def _ingest(payloads, **kwargs):
+    return dataset.ingest_in_batches(
+        '/iplant/home/example/raw', 'example',
+        dataset.DatasetSource.ON_SKY, dataset.DatasetStage.RAW, datum.DatumKind.SCIENCE,
+        None, None, payloads, batch_size=3, jobs=2, **kwargs
+    )
+
+
+def test_make_batches():
+    payloads = [{'filename': f'{i}.fits'} for i in range(10)]
+    assert [len(b) for b in dataset.make_batches(payloads, batch_size=4)] == [4, 4, 2]
+    assert [len(b) for b in dataset.make_batches(payloads, batch_bytes=45)] == [2] * 5
+
+
+def test_ingest_in_batches_resumes(stub_server):
+    payloads = [{'kind': datum.DatumKind.SCIENCE, 'filename': f'{i}.fits'} for i in range(10)]
+    def failing_handler(method, path, body):
+        if path.endswith('/data/') and orjson.loads(body)['data'][0]['filename'] == '3.fits':
+            return 400, {'error': 'bad batch'}
+        return 200, {}
+    stub_server.handler = failing_handler
+    with pytest.raises(requests.HTTPError):
+        _ingest(payloads)
+    first_requests = list(stub_server.requests)
+    assert [r[0] for r in first_requests].count('POST') == 5
+
+    # headers read differently this time don't stop it resuming
+    payloads = [dict(payload, meta={'fits': {'EXPTIME': 1.5}}) for payload in payloads]
+    stub_server.requests.clear()
+    stub_server.handler = lambda method, path, body: (200, {})
+    _ingest(payloads)
+    assert [(r[0], r[1]) for r in stub_server.requests] == [
+        ('POST', '/api/v1/registrar/datasets/example/data/'),
+        ('PATCH', '/api/v1/registrar/datasets/example/'),
+    ]
+    sent = [
+        payload['filename']
+        for r in first_requests + stub_server.requests if r[1].endswith('/data/')
+        for payload in orjson.loads(r[3])['data']
+    ]
+    assert sorted(sent) == sorted([p['filename'] for p in payloads] + ['3.fits', '4.fits', '5.fits'])
+
+
+def test_ingest_checkpoint_is_for_one_set_of_files(stub_server):
+    payloads = [{'kind': datum.DatumKind.SCIENCE, 'filename': f'{i}.fits'} for i in range(4)]
+    stub_server.handler = lambda method, path, body: (400 if path.endswith('/data/') else 200, {})
+    with pytest.raises(requests.HTTPError):
+        _ingest(payloads)
+    with pytest.raises(ValueError):
+        _ingest(payloads + [{'kind': datum.DatumKind.SCIENCE, 'filename': 'new.fits'}])
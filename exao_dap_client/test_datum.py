@@ -1,11 +1,13 @@
 import io
 import datetime
+import hashlib
 from astropy.io import fits
 import numpy as np
 import dateutil.tz
 import dateutil.parser
 import pytest
-from .datum import make_payload
+from . import data_store, datum, fits_headers
+from .datum import extract_info
 
 
 @pytest.fixture
@@ -41,7 +43,7 @@ def test_extract_date(example_fits_hdul, date_kw, extension):
     hdul = example_fits_hdul
     hdul[extension].header[date_kw] = '2015-11-29T06:10:42.0'
     file_like = _hdul_to_bytesio(hdul)
-    payload = make_payload('example.fits', file_like)
+    payload = extract_info(file_like)
     assert payload['created_at'] == datetime.datetime(
         2015, 11, 29, 6, 10, 42,
         tzinfo=dateutil.tz.UTC
@@ -50,9 +52,10 @@ def test_extract_date(example_fits_hdul, date_kw, extension):
 
 def test_extract_fits(example_fits_hdul):
     file_like = _hdul_to_bytesio(example_fits_hdul)
+    contents = file_like.getvalue()
     ref_payload = {
-        'filename': 'example.fits',
-        'checksum': 'f1550321a1d6e909d767e13d0d789453',
+        'checksum_md5': hashlib.md5(contents).hexdigest(),
+        'size_bytes': len(contents),
         'meta': {
             'fits': {
                 'KEYWORD': 'value',
@@ -90,4 +93,154 @@ def test_extract_fits(example_fits_hdul):
             }}
     }
 
-    assert make_payload('example.fits', file_like) == ref_payload
+    assert extract_info(file_like) == ref_payload
+
+
+
+class CountingReader(io.BytesIO):
+    def __init__(self, contents):
+        super().__init__(contents)
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def readinto(self, buffer):
+        n_read = super().readinto(buffer)
+        self.bytes_read += n_read
+        return n_read
+
+
+def test_run_extractors_single_pass(example_fits_hdul):
+    contents = _hdul_to_bytesio(example_fits_hdul).getvalue()
+    fh = CountingReader(contents)
+    fits_update, checksum_update = datum.run_extractors(fh, (datum.FitsHeaderTap, datum.ChecksumSizeTap))
+    assert fh.bytes_read == len(contents)
+    assert checksum_update['checksum_md5'] == hashlib.md5(contents).hexdigest()
+    assert fits_update['meta']['fits']['ext']['FOO']['INTKW'] == 1
+
+    # headers alone: data sections are seeked over
+    fh = CountingReader(contents)
+    update, = datum.run_extractors(fh, (datum.FitsHeaderTap,))
+    assert update == fits_update
+    assert fh.bytes_read <= len(example_fits_hdul) * fits_headers.HEADER_READ_SIZE < len(contents)
+
+    # not FITS: gives up after the first read
+    fh = CountingReader(b'not FITS' * 10_000)
+    assert datum.run_extractors(fh, (datum.FitsHeaderTap,)) == [{}]
+    assert fh.bytes_read <= fits_headers.HEADER_READ_SIZE
+
+
+def _write_examples(hdul, tmp_path, n_files=3):
+    paths = []
+    for idx in range(n_files):
+        hdul[0].header['DATE-OBS'] = f'2015-11-{idx + 1:02}T06:10:42.0'
+        path = tmp_path / f'example_{idx}.fits'
+        hdul.writeto(path)
+        paths.append(str(path))
+    return paths
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_extract_all_info(example_fits_hdul, tmp_path, monkeypatch, jobs):
+    monkeypatch.setattr(datum, 'MIN_FILES_FOR_PROCESS_POOL', 2)
+    paths = _write_examples(example_fits_hdul, tmp_path)
+    with open(paths[1], 'rb') as fh:
+        payloads = datum.extract_all_info([paths[0], fh, paths[2]], jobs=jobs)
+    assert [payload['created_at'].day for payload in payloads] == [1, 2, 3]
+    for path, payload in zip(paths, payloads):
+        with open(path, 'rb') as fh:
+            assert payload['checksum_md5'] == hashlib.md5(fh.read()).hexdigest()
+
+
+def test_extract_few_files_in_process(example_fits_hdul, tmp_path, monkeypatch):
+    paths = _write_examples(example_fits_hdul, tmp_path)
+    def no_pool(*args, **kwargs):
+        raise AssertionError('started a process pool')
+    monkeypatch.setattr(datum.concurrent.futures, 'ProcessPoolExecutor', no_pool)
+    results = list(datum.iter_extract_info(paths + [str(tmp_path / 'missing.fits')], jobs=16))
+    assert [path for path, _ in results] == paths + [str(tmp_path / 'missing.fits')]
+    assert [payload['created_at'].day for _, payload in results[:3]] == [1, 2, 3]
+    assert results[3][1] is None
+
+    pool_sizes = []
+    def recording_pool(max_workers, **kwargs):
+        pool_sizes.append(max_workers)
+        raise AssertionError('started a process pool')
+    monkeypatch.setattr(datum.concurrent.futures, 'ProcessPoolExecutor', recording_pool)
+    monkeypatch.setattr(datum, 'MIN_FILES_FOR_PROCESS_POOL', 2)
+    with pytest.raises(AssertionError):
+        list(datum.iter_extract_info(iter(paths), jobs=16))
+    assert pool_sizes == [len(paths)]
+
+
+def test_init_from_collection(example_fits_hdul, tmp_path):
+    paths = _write_examples(example_fits_hdul, tmp_path)
+    memfs = data_store.get_fs('memory://')
+    for path in paths:
+        with open(path, 'rb') as fh:
+            memfs.pipe_file(f'/collection_test/{path.rsplit("/", 1)[1]}', fh.read())
+    memfs.pipe_file('/collection_test/.hidden', b'x')
+    payloads = datum.init_from_collection('/collection_test', fs=memfs, jobs=2)
+    payloads = sorted(payloads, key=lambda payload: payload['filename'])
+    assert [payload['filename'] for payload in payloads] == ['example_0.fits', 'example_1.fits', 'example_2.fits']
+    assert payloads[1]['created_at'].day == 2
+    assert payloads[1]['meta']['fits']['ext']['FOO']['INTKW'] == 1
+    assert payloads[1]['kind'] is datum.DatumKind.SCIENCE
+
+
+
+def test_init_from_collection_lists_once(example_fits_hdul, tmp_path, monkeypatch):
+    # sizes and checksums come from one detailed listing (as from the
+    # iRODS catalog), and each file is opened once, for its headers
+    paths = _write_examples(example_fits_hdul, tmp_path)
+    memfs = data_store.get_fs('memory://')
+    checksums = {}
+    for path in paths:
+        with open(path, 'rb') as fh:
+            contents = fh.read()
+        name = f'/catalog_test/{path.rsplit("/", 1)[1]}'
+        memfs.pipe_file(name, contents)
+        checksums[name] = hashlib.md5(contents).hexdigest()
+    calls = []
+    orig_ls, orig_open = type(memfs).ls, type(memfs).open
+    def catalog_ls(self, path, detail=False, **kwargs):
+        calls.append(('ls', path))
+        entries = orig_ls(self, path, detail=detail, **kwargs)
+        if detail:
+            entries = [dict(entry, checksum=checksums.get(entry['name'])) for entry in entries]
+        return entries
+    def counting_open(self, path, *args, **kwargs):
+        calls.append(('open', path))
+        return orig_open(self, path, *args, **kwargs)
+    def no_info(self, path, **kwargs):
+        raise AssertionError(f'per-file catalog query for {path}')
+    monkeypatch.setattr(type(memfs), 'ls', catalog_ls)
+    monkeypatch.setattr(type(memfs), 'open', counting_open)
+    monkeypatch.setattr(type(memfs), 'info', no_info)
+    monkeypatch.setattr(data_store, 'is_irods', lambda fs: fs is memfs)
+
+    payloads = datum.init_from_collection('/catalog_test', fs=memfs, jobs=2)
+    assert calls.count(('ls', '/catalog_test')) == 1
+    assert sorted(path for call, path in calls if call == 'open') == sorted(checksums)
+    for payload in payloads:
+        name = f'/catalog_test/{payload["filename"]}'
+        assert payload['checksum_md5'] == checksums[name]
+        assert payload['size_bytes'] == len(memfs.cat_file(name))
+        assert payload['meta']['fits']['ext']['FOO']['INTKW'] == 1
+
+
+def test_extract_info_uses_metadata_cache(example_fits_hdul, tmp_path, monkeypatch):
+    from . import cache
+    path, copy_path = tmp_path / 'example.fits', tmp_path / 'copy.fits'
+    example_fits_hdul.writeto(path)
+    payload = extract_info(str(path))
+    copy_path.write_bytes(path.read_bytes())
+    cache.get_checksum_index().md5sum(str(copy_path))
+    # unchanged files, or the same bytes under another name once
+    # hashed (e.g. by a sync), are not read at all
+    monkeypatch.setattr(datum, 'run_extractors', lambda fh, extractor_classes: 1 / 0)
+    assert extract_info(str(path)) == payload
+    assert extract_info(str(copy_path)) == payload
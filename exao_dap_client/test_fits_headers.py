@@ -0,0 +1,63 @@
+import io
+import numpy as np
+from astropy.io import fits
+import pytest
+from . import fits_headers
+
+
+class CountingBytesIO(io.BytesIO):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+def _example_bytes():
+    hdul = fits.HDUList([
+        fits.PrimaryHDU(np.zeros((256, 256))),
+        fits.ImageHDU(np.ones((100, 3), dtype=np.int16), name='SCI'),
+        fits.BinTableHDU.from_columns([fits.Column(name='a', format='10E', array=np.ones((7, 10)))]),
+        fits.ImageHDU(),
+    ])
+    for idx, hdu in enumerate(hdul):
+        for n in range(40 * idx):
+            hdu.header[f'KW{n}'] = n
+    buf = io.BytesIO()
+    hdul.writeto(buf)
+    return buf.getvalue()
+
+
+def test_scan_matches_astropy():
+    data = _example_bytes()
+    fh = CountingBytesIO(data)
+    hdus = fits_headers.scan(fh)
+    with fits.open(io.BytesIO(data)) as hdul:
+        assert len(hdus) == len(hdul)
+        for info, hdu in zip(hdus, hdul):
+            fileinfo = hdu.fileinfo()
+            assert info.header_offset == fileinfo['hdrLoc']
+            assert info.data_offset == fileinfo['datLoc']
+            assert info.padded_data_size == fileinfo['datSpan']
+            assert fits.Header.fromstring(info.header_bytes) == hdu.header
+    assert fh.bytes_read < len(data) / 10
+
+
+@pytest.mark.parametrize("chunk_size", [1, 100, 2880, 10**6])
+def test_incremental_scanner(chunk_size):
+    data = _example_bytes()
+    scanner = fits_headers.HeaderScanner()
+    for start in range(0, len(data), chunk_size):
+        assert scanner.feed(data[start:start + chunk_size])
+    assert scanner.is_fits
+    assert [h.header_offset for h in scanner.hdus] == [h.header_offset for h in fits_headers.scan(io.BytesIO(data))]
+
+
+def test_not_fits():
+    scanner = fits_headers.HeaderScanner()
+    assert not scanner.feed(b'not a FITS file' * 1000)
+    assert scanner.is_fits is False
+    assert fits_headers.scan(io.BytesIO(b'not a FITS file' * 1000)) == []
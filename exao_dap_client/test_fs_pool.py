@@ -0,0 +1,91 @@
+import threading
+import time
+import pytest
+from . import fs_pool
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _counting_factory():
+    made = []
+    def factory():
+        made.append(object())
+        return made[-1]
+    return made, factory
+
+
+def test_checkout_is_bounded_and_reused():
+    made, factory = _counting_factory()
+    pool = fs_pool.FilesystemPool(max_size=2)
+    in_use = []
+    peak = []
+    lock = threading.Lock()
+
+    def work():
+        with pool.checkout('key', factory) as fs:
+            with lock:
+                in_use.append(fs)
+                peak.append(len(in_use))
+            time.sleep(0.01)
+            with lock:
+                in_use.remove(fs)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(made) == 2
+    assert max(peak) == 2
+    assert pool.size('key') == 2
+
+
+def test_checkout_times_out_and_nests():
+    _, factory = _counting_factory()
+    pool = fs_pool.FilesystemPool(max_size=1)
+    with pool.checkout('key', factory) as fs:
+        # same thread, same key: shares the instance instead of waiting
+        with pool.checkout('key', factory) as inner_fs:
+            assert inner_fs is fs
+        with pytest.raises(TimeoutError):
+            pool.acquire('key', factory, timeout=0.01)
+
+
+def test_idle_eviction_and_health_check():
+    clock = FakeClock()
+    made, factory = _counting_factory()
+    healthy = {}
+    closed = []
+    pool = fs_pool.FilesystemPool(
+        idle_timeout=100, check_after=10, clock=clock,
+        health_check=lambda fs: healthy.get(id(fs), True), close=closed.append
+    )
+    with pool.checkout('key', factory) as first:
+        pass
+    # recently used, so not checked
+    healthy[id(first)] = False
+    with pool.checkout('key', factory) as fs:
+        assert fs is first
+    # checked after sitting idle, and replaced when unhealthy
+    clock.now += 20
+    with pool.checkout('key', factory) as second:
+        assert second is not first
+    assert closed == [first]
+    # an error while checked out means a check before reuse
+    with pytest.raises(RuntimeError):
+        with pool.checkout('key', factory) as fs:
+            healthy[id(fs)] = False
+            raise RuntimeError()
+    with pool.checkout('key', factory) as third:
+        assert third is not second
+    # closed once idle too long, when another is returned
+    with pool.checkout('other', factory):
+        clock.now += 200
+    assert closed == [first, second, third]
+    assert pool.size('key') == 0
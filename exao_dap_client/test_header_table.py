@@ -0,0 +1,47 @@
+import datetime
+import pytest
+
+pa = pytest.importorskip('pyarrow')
+import pyarrow.compute as pc
+from . import header_table
+
+
+def _payload(exptime, extra=None):
+    fits_meta = {'EXPTIME': exptime, 'OBJECT': 'HD 1', 'ext': {'SCI': {'NAXIS': 2}}}
+    fits_meta.update(extra or {})
+    return {
+        'checksum_md5': '0' * 32,
+        'size_bytes': 2880,
+        'created_at': datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc),
+        'meta': {'fits': fits_meta},
+    }
+
+
+def test_flatten_payload():
+    row = header_table.flatten_payload('a.fits', _payload(1))
+    assert row['path'] == 'a.fits'
+    assert row['EXPTIME'] == 1
+    assert row['SCI.NAXIS'] == 2
+    assert 'ext' not in row
+
+
+def test_header_table_round_trip(tmp_path):
+    # row groups of 2 with an int/float mix and a keyword only some
+    # files have, written in two batches
+    path_payloads = [(f'{idx}.fits', _payload(idx)) for idx in range(3)]
+    path_payloads.append(('3.fits', _payload(12.5, {'FILTER': 'Ks'})))
+    path_payloads.append(('failed.fits', None))
+    n_rows = header_table.write_header_table(tmp_path, path_payloads[:2], row_group_size=2)
+    n_rows += header_table.write_header_table(tmp_path, path_payloads[2:], row_group_size=2)
+    assert n_rows == 4
+    assert len(list(tmp_path.glob('part-*.parquet'))) == 2
+
+    table = header_table.read_header_table(tmp_path)
+    assert table.num_rows == 4
+    assert table.schema.field('EXPTIME').type == pa.float64()
+    assert table['FILTER'].to_pylist() == [None, None, None, 'Ks']
+    long_frames = table.filter(pc.greater(table['EXPTIME'], 10))
+    assert long_frames['path'].to_pylist() == ['3.fits']
+
+    table = header_table.read_header_table(tmp_path, columns=['path', 'SCI.NAXIS'])
+    assert table.column_names == ['path', 'SCI.NAXIS']
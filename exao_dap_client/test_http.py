@@ -0,0 +1,46 @@
+import orjson
+import pytest
+import requests
+from . import http
+
+
+def test_requests_reuse_connection(stub_server):
+    for _ in range(3):
+        assert http.get('/api/v1/things/', {'q': 1}) == {'ok': True, 'length': 7}
+    ports = {req[4] for req in stub_server.requests}
+    assert len(ports) == 1
+    assert stub_server.requests[0][2]['Authorization'] == 'Token secret'
+
+
+def test_retries_unavailable(stub_server):
+    failures = iter([503, 429])
+    stub_server.handler = lambda method, path, body: (next(failures, 200), {})
+    assert http.post('/api/v1/things/', {}) == {}
+    assert len(stub_server.requests) == 3
+
+
+def test_large_bodies_compressed(stub_server):
+    payload = {'data': [{'filename': f'file_{i}.fits'} for i in range(2000)]}
+    assert http.post('/api/v1/things/', payload)['length'] == len(orjson.dumps(payload))
+    assert stub_server.requests[0][2]['Content-Encoding'] == 'gzip'
+
+
+def test_no_retry_after_request_sent(stub_server):
+    def drop_connection(method, path, body):
+        raise ConnectionAbortedError('handled, but no response sent')
+    stub_server.handler = drop_connection
+    with pytest.raises(requests.ConnectionError):
+        http.post('/api/v1/things/', {})
+    assert len(stub_server.requests) == 1
+
+
+def test_gateway_errors_retried_only_for_idempotent_methods(stub_server):
+    # the service may have handled a POST behind a bad gateway
+    stub_server.handler = lambda method, path, body: (502, {})
+    with pytest.raises(requests.HTTPError):
+        http.post('/api/v1/things/', {})
+    assert len(stub_server.requests) == 1
+    failures = iter([502, 504])
+    stub_server.handler = lambda method, path, body: (next(failures, 200), {})
+    assert http.get('/api/v1/things/', {}) == {}
+    assert len(stub_server.requests) == 4
@@ -0,0 +1,49 @@
+import io
+from astropy.io import fits
+import numpy as np
+from .commands import normalize_fits
+
+
+def _write_lowercase_keyword_fits(path):
+    hdu = fits.PrimaryHDU(np.arange(100, dtype='>i2').reshape(10, 10))
+    hdu.header['EXPTIME'] = 1.5
+    buf = io.BytesIO()
+    hdu.writeto(buf)
+    data = buf.getvalue().replace(b'EXPTIME ', b'exptime ')
+    path.write_bytes(data)
+    return data
+
+
+def test_normalize_patches_headers(tmp_path, monkeypatch):
+    path = tmp_path / 'frame.fits'
+    original = _write_lowercase_keyword_fits(path)
+    outfolder = tmp_path / 'out'
+    outfolder.mkdir()
+    outpath, action = normalize_fits.normalize_file(str(path), str(outfolder))
+    assert action == normalize_fits.HEADERS_PATCHED
+    assert open(outpath, 'rb').read() == original.replace(b'exptime ', b'EXPTIME ')
+    assert normalize_fits.normalize_file(outpath, None)[1] == normalize_fits.UNCHANGED
+
+    outpath, action = normalize_fits.normalize_file(str(path), None)
+    assert (outpath, action) == (str(path), normalize_fits.HEADERS_PATCHED)
+    with fits.open(path) as hdul:
+        assert hdul[0].header['EXPTIME'] == 1.5
+        assert np.all(hdul[0].data == np.arange(100).reshape(10, 10))
+
+    # headers that change length mean writing the whole file
+    _write_lowercase_keyword_fits(path)
+    monkeypatch.setattr(normalize_fits, '_fixed_headers', lambda hdul, hdus: None)
+    assert normalize_fits.normalize_file(str(path), None)[1] == normalize_fits.REWRITTEN
+    with fits.open(path) as hdul:
+        assert hdul[0].header['EXPTIME'] == 1.5
+
+
+def test_normalize_files_in_parallel(tmp_path):
+    paths = []
+    for idx in range(3):
+        paths.append(str(tmp_path / f'frame_{idx}.fits'))
+        _write_lowercase_keyword_fits(tmp_path / f'frame_{idx}.fits')
+    (tmp_path / 'junk.fits').write_bytes(b'not FITS')
+    results = list(normalize_fits.normalize_files(paths + [str(tmp_path / 'junk.fits')], jobs=2))
+    actions = {fn: action for fn, outpath, action in results}
+    assert actions == {**dict.fromkeys(paths, normalize_fits.HEADERS_PATCHED), str(tmp_path / 'junk.fits'): None}
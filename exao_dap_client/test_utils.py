@@ -0,0 +1,42 @@
+import hashlib
+import io
+import os
+import pytest
+from . import utils
+
+
+@pytest.mark.parametrize("use_mmap", [True, False])
+@pytest.mark.parametrize("size", [0, 1, utils.MIN_CHUNK_SIZE, 5 * utils.MIN_CHUNK_SIZE + 17])
+def test_read_in_chunks(tmp_path, size, use_mmap):
+    data = os.urandom(size)
+    path = tmp_path / 'data.bin'
+    path.write_bytes(data)
+    with open(path, 'rb') as fh:
+        fh.seek(min(size, 3))
+        chunks = [bytes(c) for c in utils.read_in_chunks(fh, chunk_size=2 * utils.MIN_CHUNK_SIZE, use_mmap=use_mmap)]
+        assert fh.tell() == size
+    assert b''.join(chunks) == data[min(size, 3):]
+    assert all(len(c) <= 2 * utils.MIN_CHUNK_SIZE for c in chunks)
+
+
+def test_read_in_chunks_adapts_chunk_size():
+    data = os.urandom(20 * utils.MIN_CHUNK_SIZE)
+    sizes = [len(c) for c in utils.read_in_chunks(io.BytesIO(data), chunk_size=4 * utils.MIN_CHUNK_SIZE)]
+    assert sizes[:3] == [utils.MIN_CHUNK_SIZE, 2 * utils.MIN_CHUNK_SIZE, 4 * utils.MIN_CHUNK_SIZE]
+    assert sum(sizes) == len(data)
+
+
+def test_size_and_md5sum():
+    data = os.urandom(3 * utils.MIN_CHUNK_SIZE + 5)
+    assert utils.size_and_md5sum(io.BytesIO(data)) == (len(data), hashlib.md5(data).hexdigest())
+
+
+def test_block_md5sums():
+    data = os.urandom(5 * utils.MIN_CHUNK_SIZE + 17)
+    block_size = 3 * utils.MIN_CHUNK_SIZE // 2
+    size, md5, digests = utils.block_md5sums(io.BytesIO(data), block_size)
+    assert (size, md5) == (len(data), hashlib.md5(data).hexdigest())
+    assert digests == [
+        hashlib.md5(data[offset:offset + block_size]).hexdigest()
+        for offset in range(0, len(data), block_size)
+    ]
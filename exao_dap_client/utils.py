@@ -1,11 +1,103 @@
 import hashlib
+import io
+import mmap
+import os
+import stat
 
-def read_in_chunks(file_object, chunk_size=2**30):
+MIN_CHUNK_SIZE = 2**16
+DEFAULT_CHUNK_SIZE = 2**23
+
+def _local_fileno(file_object):
+    '''File descriptor of a regular local file backing `file_object`,
+    or None if it isn't one (remote files, BytesIO, pipes...)
+    '''
+    try:
+        fileno = file_object.fileno()
+    except (AttributeError, io.UnsupportedOperation, OSError, ValueError):
+        return None
+    if not isinstance(fileno, int):
+        return None
+    try:
+        st = os.fstat(fileno)
+    except OSError:
+        return None
+    return fileno if stat.S_ISREG(st.st_mode) else None
+
+def _read_mmapped(file_object, fileno, chunk_size):
+    start = file_object.tell()
+    size = os.fstat(fileno).st_size
+    if size <= start:
+        return
+    mm = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+    view = memoryview(mm)
+    try:
+        for offset in range(start, size, chunk_size):
+            chunk = view[offset:offset + chunk_size]
+            try:
+                yield chunk
+            finally:
+                chunk.release()
+    finally:
+        view.release()
+        file_object.seek(size)
+        try:
+            mm.close()
+        except BufferError:
+            # caller kept a view derived from a chunk, the mapping
+            # will be closed when that is garbage collected
+            pass
+
+def _read_into_buffer(file_object, chunk_size, min_chunk_size):
+    readinto = getattr(file_object, 'readinto', None)
+    window = min(min_chunk_size, chunk_size)
+    buf = bytearray(window)
+    view = memoryview(buf)
     while True:
-        data = file_object.read(chunk_size)
-        if not data:
-            break
-        yield data
+        if readinto is not None:
+            n_read = readinto(view[:window])
+            if not n_read:
+                break
+            chunk = view[:n_read]
+        else:
+            data = file_object.read(window)
+            if not data:
+                break
+            n_read = len(data)
+            chunk = memoryview(data)
+        try:
+            yield chunk
+        finally:
+            chunk.release()
+        if n_read == window and window < chunk_size:
+            # reads are filling the buffer, so grow it until we hit
+            # the configured ceiling
+            window = min(2 * window, chunk_size)
+            if window > len(buf):
+                view.release()
+                buf = bytearray(window)
+                view = memoryview(buf)
+
+def read_in_chunks(file_object, chunk_size=DEFAULT_CHUNK_SIZE, min_chunk_size=MIN_CHUNK_SIZE, use_mmap=True):
+    '''Iterate over the contents of `file_object` from its current
+    position in chunks of at most `chunk_size` bytes, without
+    allocating a new bytes object per chunk.
+
+    Chunks are `memoryview` objects over a single reused buffer (filled
+    with `readinto` when available), so each one is only valid until
+    the next is requested. Copy it (e.g. `bytes(chunk)`) to keep it.
+    Reads start at `min_chunk_size` bytes and double while the file
+    keeps filling the buffer, so small files never allocate the full
+    `chunk_size`.
+
+    If `file_object` is a regular local file and `use_mmap` is True,
+    chunks are instead slices of a read-only memory map of the file
+    and no copying happens at all.
+    '''
+    fileno = _local_fileno(file_object) if use_mmap else None
+    if fileno is not None:
+        yield from _read_mmapped(file_object, fileno, chunk_size)
+    else:
+        yield from _read_into_buffer(file_object, chunk_size, min_chunk_size)
 
 def size_and_md5sum(str_or_file_handle):
     md5_hasher = hashlib.md5()
@@ -24,3 +116,58 @@ def size_and_md5sum(str_or_file_handle):
 def md5sum(str_or_file_handle):
     _, checksum = size_and_md5sum(str_or_file_handle)
     return checksum
+
+class BlockHasher:
+    '''MD5 digests of consecutive `block_size` blocks of a stream that
+    is fed in pieces of any size with `update`. `on_block` (if given)
+    is called with the index and digest of each block as it is
+    completed, counting from `first_block`.
+    '''
+    def __init__(self, block_size, on_block=None, first_block=0):
+        self.block_size = block_size
+        self.on_block = on_block
+        self.digests = []
+        self._index = first_block
+        self._hasher = hashlib.md5()
+        self._filled = 0
+
+    def _block_done(self):
+        digest = self._hasher.hexdigest()
+        self.digests.append(digest)
+        if self.on_block is not None:
+            self.on_block(self._index, digest)
+        self._index += 1
+        self._hasher = hashlib.md5()
+        self._filled = 0
+
+    def update(self, data):
+        pos = 0
+        while pos < len(data):
+            take = min(len(data) - pos, self.block_size - self._filled)
+            self._hasher.update(data[pos:pos + take])
+            pos += take
+            self._filled += take
+            if self._filled == self.block_size:
+                self._block_done()
+
+    def finish(self):
+        '''Digest the trailing partial block (if any) and return the
+        digests of all the blocks fed since this hasher was created
+        '''
+        if self._filled:
+            self._block_done()
+        return self.digests
+
+def block_md5sums(file_handle, block_size):
+    '''Size, MD5 and list of per-block MD5s (see `BlockHasher`) of the
+    contents of `file_handle` from the start
+    '''
+    md5_hasher = hashlib.md5()
+    block_hasher = BlockHasher(block_size)
+    total_size = 0
+    file_handle.seek(0)
+    for chunk in read_in_chunks(file_handle):
+        md5_hasher.update(chunk)
+        block_hasher.update(chunk)
+        total_size += len(chunk)
+    return total_size, md5_hasher.hexdigest(), block_hasher.finish()
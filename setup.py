@@ -15,6 +15,12 @@ extras = {
     'dev': [
         'pytest',
     ],
+    'async': [
+        'httpx>=0.23,<1',
+    ],
+    'table': [
+        'pyarrow>=3',
+    ],
 }
 all_deps = set()
 for _, deps in extras.items():
@@ -33,6 +39,7 @@ setup(
         'astropy>=4.2,<5',
         'python-dateutil>=2.8.1,<3',
         'orjson>=3.4.8,<4',
+        'requests>=2.25,<3',
         'fsspec>=0.8.5,<0.9',
         'irods-fsspec',
     ],